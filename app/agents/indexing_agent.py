@@ -1,89 +1,243 @@
-import json
+from itertools import islice
+from typing import Callable, Iterable, Iterator
 import numpy as np
-import faiss
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+from app.core.chunk_store import ChunkStore, ChunkStoreWriter, write_chunk_store
+from app.core.chunker import iter_chunks, TokenCounter
+from app.core.config import EMBEDDING_MODEL_NAME, CHUNK_STORE_COMPRESS, CHUNK_STORE_BLOCK_SIZE, CHUNK_STORE_MAX_DEAD, STREAM_EMBED_BATCH
+from app.core.corpus_index import corpus_index
+from app.core.embedding_cache import embedding_cache
+from app.core.lexical_index import corpus_lexical_index, tokenize, write_lexical_index, LexicalIndex, PostingsBuilder
+from app.core.metrics import stage, EMBED_BATCH_SECONDS, EMBED_TEXTS
+from app.core.model_registry import get_embedding_model
+from app.core.vector_index import write_document_index, update_document_index, VectorSpill
+
+# Per-model token counters; their word-count caches persist across documents
+_token_counters: dict[str, TokenCounter] = {}
 
 
 class IndexingAgent:
     def __init__(self):
-        # Load sentence embedding model
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-
-    def chunk_text(self, text: str, chunk_size=600, overlap=100):
+        # Shared sentence embedding model (loaded once per process)
+        self.model_name = EMBEDDING_MODEL_NAME
+        self.model = get_embedding_model(self.model_name)
+        # torch, fp32 ONNX and int8 ONNX vectors for one model must not be mixed in the cache
+        self.cache_namespace = f"{self.model_name}:{getattr(self.model, 'variant', '')}"
+
+    @property
+    def max_chunk_tokens(self) -> int:
+        # Model input limit minus [CLS]/[SEP]; anything longer is silently truncated
+        return self.model.max_seq_length - 2
+
+    def count_tokens(self, texts: list[str]) -> list[int]:
+        # Word-piece counts from the model's own tokenizer, excluding special tokens
+        counter = _token_counters.get(self.model_name)
+        if counter is None:
+            tokenizer = getattr(self.model, "tokenizer", None)
+            if tokenizer is None:
+                # No tokenizer exposed: estimate ~4 characters per token
+                return [max(1, len(t) // 4) for t in texts]
+            counter = _token_counters[self.model_name] = TokenCounter(tokenizer)
+        return counter(texts)
+
+    def chunk_pages(self, pages: Iterable[tuple[int, str]], chunk_size=200, overlap=32) -> Iterator[dict]:
         """
-        Semantic chunking that respects sentence boundaries.
-        No more mid-word cuts like 'mach' or 'lear'.
+        Token-sized, sentence-aware chunks over (page_number, text) pairs, with page
+        numbers and character offsets. chunk_size and overlap are model tokens;
+        chunk_size is capped at what the model can embed.
         """
-        import re
-
-        # Split into sentences (respects periods, question marks, exclamation marks)
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-
-        chunks = []
-        current_chunk = []
-        current_length = 0
-
-        for sentence in sentences:
-            sentence = sentence.strip()
-            if not sentence:
-                continue
+        return iter_chunks(pages, self.count_tokens, min(chunk_size, self.max_chunk_tokens), overlap)
 
-            sentence_length = len(sentence)
+    def chunk_text(self, text: str, chunk_size=200, overlap=32) -> list[str]:
+        # Chunk texts for a single unpaged string
+        return [chunk["text"] for chunk in self.chunk_pages([(1, text)], chunk_size, overlap)]
 
-            # If adding this sentence exceeds chunk_size, save current chunk
-            if current_length + sentence_length > chunk_size and current_chunk:
-                chunks.append(" ".join(current_chunk))
+    def embed_chunks(self, chunks: list[str]) -> np.ndarray:
+        """
+        Encode chunks as float32, reusing cached embeddings for text seen before.
+        """
+        cached = embedding_cache.get_many(self.cache_namespace, chunks)
+        missing = [i for i in range(len(chunks)) if i not in cached]
 
-                # Keep last sentences for overlap (semantic continuity)
-                overlap_sentences = []
-                overlap_length = 0
-                for s in reversed(current_chunk):
-                    if overlap_length + len(s) <= overlap:
-                        overlap_sentences.insert(0, s)
-                        overlap_length += len(s)
-                    else:
-                        break
+        embeddings = np.empty((len(chunks), self.model.get_sentence_embedding_dimension()), dtype="float32")
+        for i, vector in cached.items():
+            embeddings[i] = vector
 
-                current_chunk = overlap_sentences
-                current_length = overlap_length
+        if missing:
+            # Encode only the chunks the cache has never seen
+            texts = [chunks[i] for i in missing]
+            with stage("embed") as timer:
+                encoded = np.asarray(self.model.encode(texts, show_progress_bar=False), dtype="float32")
+            EMBED_BATCH_SECONDS.observe(timer.seconds, source="index")
+            EMBED_TEXTS.inc(len(texts), source="index")
+            embeddings[missing] = encoded
+            embedding_cache.put_many(self.cache_namespace, texts, encoded)
 
-            current_chunk.append(sentence)
-            current_length += sentence_length
+        return embeddings
 
-        # Add final chunk
-        if current_chunk:
-            chunks.append(" ".join(current_chunk))
+    def build_index(self, chunks: list[str], index_path: Path, store_path: Path, document_id: int | None = None):
+        embeddings, tokens = self.write_document_files(chunks, index_path, store_path)
 
-        return chunks
+        # Replace this document's vectors and BM25 postings in the corpus-wide indexes
+        if document_id is not None:
+            corpus_index.add_document(document_id, embeddings)
+            corpus_lexical_index.add_document(document_id, tokens)
 
-    def build_index(self, chunks: list[str], index_path: Path, map_path: Path):
-        # Encode chunks into embeddings
-        embeddings = self.model.encode(chunks, show_progress_bar=False)
+        # Return chunk count
+        return len(chunks)
 
-        # Convert to float32 for FAISS
-        embeddings = np.array(embeddings).astype("float32")
+    def write_document_files(
+        self,
+        chunks: list[str],
+        index_path: Path,
+        store_path: Path,
+        embeddings: np.ndarray | None = None,
+    ) -> tuple[np.ndarray, list[list[str]]]:
+        """
+        Write one document's FAISS index, chunk store and BM25 index.
+        embeddings (one row per chunk) skips encoding when they were computed
+        elsewhere. Returns the normalized embeddings and chunk tokens for the
+        corpus indexes.
+        """
+        import faiss
+        # Encode chunks into float32 embeddings for FAISS
+        if embeddings is None:
+            embeddings = self.embed_chunks(chunks)
 
         # Normalize embeddings for cosine similarity
         faiss.normalize_L2(embeddings)
-        # Create FAISS Inner Product index (= cosine similarity after normalization)
-        index = faiss.IndexFlatIP(embeddings.shape[1])
-        # Add embeddings to index
-        index.add(embeddings)
 
-        # Persist index to disk
-        faiss.write_index(index, str(index_path))
+        # Build the configured index type (inner product = cosine similarity after
+        # normalization) and persist it, with float16 re-ranking vectors if compressed
+        write_document_index(index_path, embeddings)
 
-        # Create chunk index mapping
-        mapping = {str(i): {"chunk_index": i} for i in range(len(chunks))}
-        # Create chunk index mapping with text preview
-        mapping = {str(i): {"chunk_index": i,"text": chunks[i] } # Store full chunk text for quick access
-        for i in range(len(chunks))
-         }
-        
+        # Save chunk texts; position in the store == FAISS vector id == chunk_index
+        write_chunk_store(store_path, chunks, CHUNK_STORE_COMPRESS, CHUNK_STORE_BLOCK_SIZE)
 
-        # Save mapping file
-        map_path.write_text(json.dumps(mapping, indent=2))
+        # BM25 index over the same chunks for lexical / hybrid retrieval
+        tokens = [tokenize(chunk) for chunk in chunks]
+        write_lexical_index(index_path.with_suffix(".bm25"), tokens, range(len(tokens)))
 
-        # Return chunk count
-        return len(chunks)
+        return embeddings, tokens
+
+    def build_index_streaming(
+        self,
+        spans: Iterable[dict],
+        index_path: Path,
+        store_path: Path,
+        document_id: int | None = None,
+        batch_size: int = STREAM_EMBED_BATCH,
+        on_batch: Callable[[int, list[dict]], None] | None = None,
+    ) -> int:
+        """
+        build_index for documents of any size: chunks (as yielded by chunk_pages)
+        are consumed batch_size at a time. Each batch is embedded and appended to
+        the chunk store, BM25 postings and a float32 spill file next to the index,
+        so memory depends on batch_size rather than on the document. The vector
+        indexes are built from the memory-mapped spill file at the end.
+
+        on_batch(first_chunk_index, batch) runs after each batch (e.g. to persist chunk rows).
+        """
+        import faiss
+        spill = VectorSpill(index_path.with_suffix(".spill"), self.model.get_sentence_embedding_dimension())
+        postings = PostingsBuilder()
+        count = 0
+        spans = iter(spans)
+
+        try:
+            # Chunk texts go straight to the store; position == FAISS vector id == chunk_index
+            with ChunkStoreWriter(store_path, CHUNK_STORE_COMPRESS, CHUNK_STORE_BLOCK_SIZE) as store:
+                while batch := list(islice(spans, batch_size)):
+                    texts = [span["text"] for span in batch]
+                    embeddings = self.embed_chunks(texts)
+                    faiss.normalize_L2(embeddings)
+                    spill.add(embeddings)
+
+                    for text in texts:
+                        store.add(text)
+                        postings.add(tokenize(text))
+
+                    if on_batch is not None:
+                        on_batch(count, batch)
+                    count += len(batch)
+
+                # Written before the store is renamed into place, as in build_index
+                embeddings = spill.open()
+                write_document_index(index_path, embeddings)
+                postings.write(index_path.with_suffix(".bm25"), range(count))
+
+            if document_id is not None:
+                corpus_index.add_document(document_id, embeddings)
+                corpus_lexical_index.add_postings(document_id, postings)
+        finally:
+            spill.discard()
+
+        return count
+
+    def update_index(
+        self,
+        chunks: list[str],
+        removed_ids: list[int],
+        source_paths: tuple[Path, Path],
+        index_path: Path,
+        store_path: Path,
+        document_id: int | None = None,
+    ) -> np.ndarray:
+        """
+        Apply a chunk diff to a document's stored index instead of rebuilding it:
+        the index and chunk store at source_paths are written to index_path and
+        store_path with chunks (new texts) embedded and added under ids that
+        continue after the chunk store, and the chunks with removed_ids deleted.
+        Unchanged chunks are neither re-embedded nor re-tokenized, and only the
+        new chunks' postings go into the corpus BM25 index. The chunk store is
+        rewritten without its removed chunks once they pass CHUNK_STORE_MAX_DEAD
+        of its slots. The source index must be is_updatable and have a BM25 file.
+
+        Returns the new chunks' ids.
+        """
+        import faiss
+        source_index_path, source_store_path = source_paths
+        store = ChunkStore(source_store_path)
+        lexical = LexicalIndex(source_index_path.with_suffix(".bm25"))
+        try:
+            # New ids continue after every id the store has ever used
+            ids = np.arange(store.next_id, store.next_id + len(chunks), dtype="int64")
+            embeddings = np.empty((0, self.model.get_sentence_embedding_dimension()), dtype="float32")
+            if chunks:
+                embeddings = self.embed_chunks(chunks)
+                faiss.normalize_L2(embeddings)
+
+            update_document_index(source_index_path, index_path, embeddings, ids, np.asarray(removed_ids, dtype="int64"))
+
+            # BM25: the stored postings minus removed rows, plus the new chunks (also kept
+            # on their own for the corpus index)
+            postings, kept_ids = PostingsBuilder.from_index(lexical, removed_ids)
+            added = PostingsBuilder()
+            for chunk in chunks:
+                tokens = tokenize(chunk)
+                postings.add(tokens)
+                added.add(tokens)
+            chunk_ids = np.concatenate([kept_ids, ids])
+            postings.write(index_path.with_suffix(".bm25"), chunk_ids)
+
+            # Append to the chunk store; removed chunks keep their (now unreferenced) slots
+            # until they make up too much of it, then only the live chunks are copied
+            slots = len(store) + len(chunks)
+            with ChunkStoreWriter(store_path, CHUNK_STORE_COMPRESS, CHUNK_STORE_BLOCK_SIZE) as writer:
+                if slots - len(chunk_ids) > CHUNK_STORE_MAX_DEAD * slots:
+                    for chunk_id in np.sort(kept_ids):
+                        writer.add(store.get(int(chunk_id)), int(chunk_id))
+                    writer.next_id = max(writer.next_id, store.next_id)
+                else:
+                    writer.copy_from(store)
+                for chunk in chunks:
+                    writer.add(chunk)
+        finally:
+            lexical.close()
+            store.close()
+
+        if document_id is not None:
+            corpus_index.update_document(document_id, embeddings, ids, removed_ids)
+            corpus_lexical_index.update_postings(document_id, added, ids, removed_ids, postings, chunk_ids)
+
+        return ids
@@ -1,66 +1,176 @@
-from pathlib import Path
-import fitz  # PyMuPDF
-from PIL import Image
-import pytesseract
+import multiprocessing
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Iterator
+
+from app.core.config import PDF_EXTRACT_WORKERS, PDF_PARALLEL_MIN_PAGES, OCR_DPI
+
+# Shared page-extraction pool, created on first large PDF
+_pool = None
+_pool_lock = threading.Lock()
+
+# Pages per extraction task. With at most two tasks per worker in flight, this
+# bounds how many extracted pages wait in memory, whatever the document size.
+RANGE_PAGES = 16
+
+# Whitespace that needs rewriting (anything but a lone space, soft hyphens) and
+# hyphenated line breaks: "convers-\nation" -> "conversation"
+_CLEAN_PATTERN = re.compile(r"(?<=\w)-\n(?=\w)|[ \t\n\x00\u00ad]{2,}|[\t\n\x00\u00ad]")
+_PARAGRAPH_BREAK = re.compile(r"\n{2,}")
+
+
+def _init_worker():
+    # Each worker already owns a core; keep Tesseract single-threaded
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _ocr_page(page) -> str:
+    # Rasterize a page without a text layer and run it through Tesseract
+    from PIL import Image
+    import pytesseract
+
+    pix = page.get_pixmap(dpi=OCR_DPI)
+    image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    return pytesseract.image_to_string(image)
+
+
+def _iter_page_range(file_path: str, start: int, stop: int) -> Iterator[tuple[int, str]]:
+    """
+    Yield raw text for pages [start, stop), falling back to OCR for scanned pages.
+    Opens its own document handle, so it also runs in worker processes.
+    """
+    import fitz  # PyMuPDF (imported on first use to keep API startup fast)
+
+    with fitz.open(file_path) as doc:
+        for page_number in range(start, stop):
+            page = doc[page_number]
+            # Read page text
+            page_text = page.get_text()
+            if not page_text.strip():
+                page_text = _ocr_page(page)
+            # Page numbers are 1-based for citations
+            yield page_number + 1, page_text
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> list[tuple[int, str]]:
+    # Worker-process entry point
+    return list(_iter_page_range(file_path, start, stop))
+
+
+@lru_cache(maxsize=4096)
+def _normalize_whitespace(run: str) -> str:
+    # Cached: pages repeat the same few runs ("\n", " \n", "\n\n", ...)
+    if run == "-\n":
+        return ""
+    # Blank lines are paragraph breaks; any other run of whitespace is one space
+    parts = _PARAGRAPH_BREAK.split(run.replace("\u00ad", ""))
+    return "\n\n".join(" " if part else "" for part in parts)
+
+
+def _clean_whitespace(match: re.Match) -> str:
+    return _normalize_whitespace(match.group())
 
 
 class IngestionAgent:
 
     def extract_text(self, file_path: str, file_type: str) -> str:
+        return self.join_pages(self.extract_pages(file_path, file_type))
+
+    @staticmethod
+    def join_pages(pages: list[tuple[int, str]]) -> str:
+        # Join cleaned pages; page breaks become paragraph breaks
+        return "\n\n".join(text for _, text in pages if text)
+
+    def extract_pages(self, file_path: str, file_type: str) -> list[tuple[int, str]]:
+        """
+        Extract cleaned text per page as [(page_number, text)] in page order.
+        Images are a single page.
+        """
+        return list(self.iter_pages(file_path, file_type))
+
+    def iter_pages(self, file_path: str, file_type: str) -> Iterator[tuple[int, str]]:
+        """
+        Yield cleaned (page_number, text) pairs in page order as they are extracted,
+        so callers can write them out without holding the whole document.
+        """
         # Route extraction based on file type
         if file_type == "pdf":
-            return self._extract_pdf(file_path)
+            return self._iter_pdf(file_path)
         elif file_type == "image":
-            return self._extract_image(file_path)
+            return iter([(1, self._extract_image(file_path))])
         else:
             # Reject unsupported formats
             raise ValueError(f"Unsupported file type: {file_type}")
 
-    def _extract_pdf(self, file_path: str) -> str:
-        # Extract text from all PDF pages
-        text_parts = []
-        doc = fitz.open(file_path)
+    def page_count(self, file_path: str, file_type: str) -> int:
+        if file_type != "pdf":
+            return 1
+        import fitz
 
-        for page in doc:
-            # Read page text
-            page_text = page.get_text()
-            if page_text:
-                text_parts.append(page_text)
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+
+    def _iter_pdf(self, file_path: str) -> Iterator[tuple[int, str]]:
+        page_count = self.page_count(file_path, "pdf")
+
+        if page_count < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS <= 1:
+            raw_pages = _iter_page_range(file_path, 0, page_count)
+        else:
+            raw_pages = self._iter_pdf_parallel(file_path, page_count)
 
         # Normalize extracted content
-        return self._clean_text("\n".join(text_parts))
+        for page_number, text in raw_pages:
+            yield page_number, self._clean_text(text)
+
+    def _iter_pdf_parallel(self, file_path: str, page_count: int) -> Iterator[tuple[int, str]]:
+        # Small contiguous ranges balance OCR-heavy and text-only stretches; a window of
+        # two ranges per worker keeps every worker busy without reading ahead further
+        bounds = list(range(0, page_count, RANGE_PAGES)) + [page_count]
+        ranges = iter(zip(bounds, bounds[1:]))
+        pool = _get_pool()
+        window = deque()
+        try:
+            while True:
+                while len(window) < PDF_EXTRACT_WORKERS * 2 and (page_range := next(ranges, None)):
+                    window.append(pool.submit(_extract_page_range, file_path, *page_range))
+                if not window:
+                    break
+                # Futures are collected in submission order, so pages stay in order
+                yield from window.popleft().result()
+        finally:
+            for future in window:
+                future.cancel()
 
     def _extract_image(self, file_path: str) -> str:
         # Perform OCR on image file
+        from PIL import Image
+        import pytesseract
+
         image = Image.open(file_path)
         text = pytesseract.image_to_string(image)
         return self._clean_text(text)
 
     def _clean_text(self, text: str) -> str:
         """
-        Aggressive text cleaning for better chunking and display
+        Text cleaning for better chunking and display, in one regex pass:
+        hyphenated line breaks are joined, single newlines become spaces,
+        blank lines become one paragraph break, tabs / NULs / repeated spaces
+        collapse to one space and soft hyphens are dropped.
         """
-        import re
-
-        # Remove null characters
-        text = text.replace("\x00", " ")
-
-        # Fix hyphenated words broken across lines: "convers-\nation" → "conversation"
-        text = re.sub(r"(\w)-\n(\w)", r"\1\2", text)
-
-        # Join lines within paragraphs: "word1\nword2" → "word1 word2"
-        text = re.sub(r"(?<!\n)\n(?!\n)", " ", text)
-
-        # Replace multiple newlines (paragraph breaks) with double newline
-        text = re.sub(r"\n{2,}", "\n\n", text)
-
-        # Replace tabs with spaces
-        text = text.replace("\t", " ")
-
-        # Normalize multiple spaces to single space
-        text = re.sub(r" {2,}", " ", text)
-
-        # Fix common PDF artifacts (soft hyphens)
-        text = re.sub(r"[­\u00ad]", "", text)
-
-        return text.strip()
+        return _CLEAN_PATTERN.sub(_clean_whitespace, text).strip()
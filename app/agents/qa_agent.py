@@ -1,63 +1,234 @@
-import json
+import time
+from typing import AsyncIterator
 import numpy as np
-import faiss
-from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from openai import OpenAI
-import os
+from app.core.vector_index import search_index
+from app.core.corpus_index import corpus_index
+from app.core.index_cache import index_cache, open_chunk_store
+from app.core.lexical_index import corpus_lexical_index, reciprocal_rank_fusion
+from app.core.config import LLM_MODEL, LLM_MAX_TOKENS, LLM_TEMPERATURE, LLM_TIMEOUT_SECONDS, RETRIEVAL_MODE, CORPUS_DOCUMENT_SEARCH_MAX
+from app.core.model_registry import get_embedding_model, get_openai_client, get_async_openai_client
+from app.core.metrics import (
+    stage,
+    record_timing,
+    top_k_label,
+    EMBED_BATCH_SECONDS,
+    EMBED_TEXTS,
+    SEARCH_SECONDS,
+    LLM_SECONDS,
+    LLM_TOKENS,
+    LLM_ERRORS,
+    STAGE_SECONDS,
+)
+
+NO_CONTEXT_ANSWER = "I don't have enough information in the uploaded document to answer that question."
+
+# Hybrid/lexical retrieval fetches this many candidates per requested chunk before fusing
+HYBRID_DEPTH_FACTOR = 4
+
+
+class AnswerGenerationError(Exception):
+    pass
 
 
 class QAAgent:
     def __init__(self):
-        # Load sentence embedding model
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
+        # Shared sentence embedding model (loaded once per process)
+        self.model = get_embedding_model()
         
-        # Initialize OpenAI client
-        self.openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
-    def retrieve(self, document_id: int, question: str, top_k: int = 5):
-        # Resolve index and mapping paths
-        index_path = Path("storage/indexes") / f"{document_id}.faiss"
-        map_path = Path("storage/indexes") / f"{document_id}_map.json"
-
-        # Ensure index exists
-        if not index_path.exists() or not map_path.exists():
-            raise ValueError("Vector index not found. Please index the document first.")
-
-        # Load FAISS index and metadata
-        index = faiss.read_index(str(index_path))
-        mapping = json.loads(map_path.read_text())
-
-        # Encode question embedding
-        q_emb = self.model.encode([question])
-        q_emb = np.array(q_emb).astype("float32")
-
-        # Perform similarity search
-        faiss.normalize_L2(q_emb)
-        similarities, indices = index.search(q_emb, top_k)
-
-        # Build ranked result set
-        results = []
-        for rank, idx in enumerate(indices[0]):
-            if idx == -1:
-                continue
-            chunk_data = mapping.get(str(idx), {})
-            results.append({
-                "vector_id": int(idx),
-                "similarity": float(similarities[0][rank]),
-                "text": chunk_data.get("text", ""),
-                "preview": chunk_data.get("text", "")[:200]
-            })
+        # Shared OpenAI client (connection pool reused across requests)
+        self.openai_client = get_openai_client()
 
-        return results
+    def embed_question(self, question: str) -> np.ndarray:
+        # Normalized (1, d) float32 question embedding
+        return self.embed_questions([question])
 
-    def answer_from_context(self, question: str, contexts: list[str]) -> str:
+    def embed_questions(self, questions: list[str]) -> np.ndarray:
+        # Normalized (n, d) float32 embeddings from a single encode call
+        import faiss
+        with stage("embed_question") as timer:
+            q_embs = self.model.encode(questions)
+        EMBED_BATCH_SECONDS.observe(timer.seconds, source="question")
+        EMBED_TEXTS.inc(len(questions), source="question")
+        q_embs = np.array(q_embs).astype("float32")
+        faiss.normalize_L2(q_embs)
+        return q_embs
+
+    def retrieve(
+        self,
+        document_id: int,
+        question: str,
+        top_k: int = 5,
+        q_emb: np.ndarray | None = None,
+        mode: str | None = None,
+    ):
         """
-        Generate intelligent answer using OpenAI with retrieved context.
+        Top chunks of one document. mode is "vector", "lexical" (BM25) or "hybrid"
+        (both, merged by reciprocal-rank fusion); defaults to RETRIEVAL_MODE.
         """
-        if not contexts:
-            return "I don't have enough information in the uploaded document to answer that question."
+        return self.retrieve_many(document_id, [question], top_k, q_emb, mode)[0]
+
+    def retrieve_many(
+        self,
+        document_id: int,
+        questions: list[str],
+        top_k: int = 5,
+        q_embs: np.ndarray | None = None,
+        mode: str | None = None,
+    ) -> list[list[dict]]:
+        """
+        retrieve() for several questions against one index load and a single
+        multi-query vector search. Returns one result list per question.
+        """
+        mode = mode or RETRIEVAL_MODE
+
+        # Load FAISS index, chunk store and BM25 index, all from the current snapshot
+        # (cached across requests, reloaded after re-indexing)
+        index, store, vectors, lexical = index_cache.get(document_id)
+        depth = top_k if mode == "vector" else top_k * HYBRID_DEPTH_FACTOR
+
+        # Per question: chunk_index -> cosine similarity, best first
+        similarities = [{} for _ in questions]
+        if mode != "lexical":
+            # Encode question embeddings (unless the caller already has them)
+            if q_embs is None:
+                q_embs = self.embed_questions(questions)
+
+            # Perform similarity search (compressed indexes re-rank against float16 vectors)
+            with stage("search") as timer:
+                scores, indices = search_index(index, q_embs, depth, vectors)
+            SEARCH_SECONDS.observe(timer.seconds, scope="document", top_k=top_k_label(top_k))
+            similarities = [
+                {int(i): float(s) for i, s in zip(row_indices, row_scores) if i != -1}
+                for row_scores, row_indices in zip(scores, indices)
+            ]
+
+        if lexical is None and mode == "lexical":
+            raise ValueError("Lexical index not found. Please re-index the document.")
+
+        batch = []
+        for question, question_similarities in zip(questions, similarities):
+            ranked = list(question_similarities)
+            if mode != "vector":
+                with stage("lexical_search") as timer:
+                    hits = [i for i, _ in lexical.search(question, depth)] if lexical else []
+                SEARCH_SECONDS.observe(timer.seconds, scope="document_lexical", top_k=top_k_label(top_k))
+                ranked = hits if mode == "lexical" else [i for i, _ in reciprocal_rank_fusion(ranked, hits)]
+
+            # Build ranked result set
+            results = []
+            for idx in ranked[:top_k]:
+                text = store.get(idx)
+                results.append({
+                    "vector_id": idx,
+                    "similarity": question_similarities.get(idx),
+                    "text": text,
+                    "preview": text[:200]
+                })
+            batch.append(results)
+
+        return batch
+
+    def retrieve_corpus(
+        self,
+        question: str,
+        top_k: int = 5,
+        document_ids: list[int] | None = None,
+        q_emb: np.ndarray | None = None,
+        mode: str | None = None,
+    ):
+        """
+        Search the corpus-wide index, optionally restricted to some documents.
+        Hits carry (document_id, chunk_index) and the chunk text.
+        """
+        return self.retrieve_corpus_many([question], top_k, document_ids, q_emb, mode)[0]
+
+    def retrieve_corpus_many(
+        self,
+        questions: list[str],
+        top_k: int = 5,
+        document_ids: list[int] | None = None,
+        q_embs: np.ndarray | None = None,
+        mode: str | None = None,
+    ) -> list[list[dict]]:
+        # retrieve_corpus() for several questions with one multi-query corpus search
+        mode = mode or RETRIEVAL_MODE
+        depth = top_k if mode == "vector" else top_k * HYBRID_DEPTH_FACTOR
+
+        # Per question: (document_id, chunk_index) -> cosine similarity, best first
+        similarities = [{} for _ in questions]
+        if mode != "lexical":
+            if q_embs is None:
+                q_embs = self.embed_questions(questions)
+
+            with stage("search") as timer:
+                if self._search_documents_directly(document_ids):
+                    hits = self._search_documents(q_embs, depth, document_ids)
+                else:
+                    hits = corpus_index.search_many(q_embs, depth, document_ids)
+            SEARCH_SECONDS.observe(timer.seconds, scope="corpus", top_k=top_k_label(top_k))
+            similarities = [{(d, c): s for d, c, s in row} for row in hits]
 
+        # Read hit texts from each document's chunk store
+        stores = {}
+        batch = []
+        try:
+            for question, question_similarities in zip(questions, similarities):
+                ranked = list(question_similarities)
+                if mode != "vector":
+                    with stage("lexical_search") as timer:
+                        hits = [(d, c) for d, c, _ in corpus_lexical_index.search(question, depth, document_ids)]
+                    SEARCH_SECONDS.observe(timer.seconds, scope="corpus_lexical", top_k=top_k_label(top_k))
+                    ranked = hits if mode == "lexical" else [key for key, _ in reciprocal_rank_fusion(ranked, hits)]
+
+                results = []
+                for document_id, chunk_index in ranked:
+                    if len(results) == top_k:
+                        break
+                    if document_id not in stores:
+                        stores[document_id] = open_chunk_store(document_id)
+                    try:
+                        text = stores[document_id].get(chunk_index)
+                    except IndexError:
+                        # Corpus indexes run briefly ahead of a snapshot being published
+                        continue
+                    results.append({
+                        "document_id": document_id,
+                        "chunk_index": chunk_index,
+                        "similarity": question_similarities.get((document_id, chunk_index)),
+                        "text": text,
+                    })
+                batch.append(results)
+        finally:
+            for store in stores.values():
+                store.close()
+
+        return batch
+
+    @staticmethod
+    def _search_documents_directly(document_ids: list[int] | None) -> bool:
+        # A fixed-nprobe IVF search only sees the filtered documents' vectors in the
+        # lists it probes; for a narrow filter that can be fewer than top_k
+        return (
+            document_ids is not None
+            and len(set(document_ids)) <= CORPUS_DOCUMENT_SEARCH_MAX
+            and corpus_index.kind == "ivf"
+        )
+
+    def _search_documents(self, q_embs: np.ndarray, depth: int, document_ids: list[int]):
+        # corpus_index.search_many() over each document's own index, merged by similarity
+        batch = [[] for _ in range(len(q_embs))]
+        for document_id in sorted(set(document_ids)):
+            try:
+                index, _, vectors, _ = index_cache.get(document_id)
+            except ValueError:
+                # Not indexed: the corpus index holds nothing for it either
+                continue
+            scores, indices = search_index(index, q_embs, depth, vectors)
+            for row, (row_scores, row_indices) in enumerate(zip(scores, indices)):
+                batch[row] += [(document_id, int(i), float(s)) for i, s in zip(row_indices, row_scores) if i != -1]
+        return [sorted(row, key=lambda hit: hit[2], reverse=True)[:depth] for row in batch]
+
+    def build_messages(self, question: str, contexts: list[str]) -> list[dict]:
         # Use top 3 most relevant chunks
         
         context_text = "\n\n".join(contexts[:5])
@@ -81,18 +252,84 @@ QUESTION: {question}
 
 Provide a detailed, specific answer based exclusively on the information in the context above. Include concrete examples and details mentioned in the document."""
 
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def answer_from_context(self, question: str, contexts: list[str]) -> str:
+        """
+        Generate intelligent answer using OpenAI with retrieved context.
+        Raises AnswerGenerationError when the API call fails.
+        """
+        if not contexts:
+            return NO_CONTEXT_ANSWER
+
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=800,  # Increased from 500 for more detailed answers
-                temperature=0.1  # Lower temperature (was 0.3) for more focused, less creative answers
-            )
-            
+            with stage("llm") as timer:
+                response = self.openai_client.chat.completions.create(
+                    model=LLM_MODEL,
+                    messages=self.build_messages(question, contexts),
+                    max_tokens=LLM_MAX_TOKENS,  # Increased from 500 for more detailed answers
+                    temperature=LLM_TEMPERATURE,  # Lower temperature (was 0.3) for more focused, less creative answers
+                    timeout=LLM_TIMEOUT_SECONDS
+                )
+            LLM_SECONDS.observe(timer.seconds, mode="complete")
+            self._count_tokens(getattr(response, "usage", None))
+
             return response.choices[0].message.content.strip()
         
         except Exception as e:
-            return f"Error generating answer: {str(e)}\n\nRelevant context:\n{contexts[0][:300]}..."
+            LLM_ERRORS.inc(mode="complete")
+            raise AnswerGenerationError(str(e)) from e
+
+    async def stream_answer(self, question: str, contexts: list[str], usage: dict | None = None) -> AsyncIterator[str]:
+        """
+        Stream answer tokens from OpenAI as they are generated; token usage, once
+        the API reports it, is stored into usage.
+        Closing the generator (e.g. on client disconnect) closes the upstream request.
+        """
+        if not contexts:
+            yield NO_CONTEXT_ANSWER
+            return
+
+        client = get_async_openai_client()
+        started = time.perf_counter()
+        try:
+            stream = await client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=self.build_messages(question, contexts),
+                max_tokens=LLM_MAX_TOKENS,
+                temperature=LLM_TEMPERATURE,
+                timeout=LLM_TIMEOUT_SECONDS,
+                stream=True,
+                # Final chunk carries token usage (with empty choices)
+                stream_options={"include_usage": True}
+            )
+            async with stream:
+                async for event in stream:
+                    if event.choices and event.choices[0].delta.content:
+                        yield event.choices[0].delta.content
+                    self._count_tokens(getattr(event, "usage", None))
+                    if usage is not None and getattr(event, "usage", None) is not None:
+                        usage.update(
+                            prompt_tokens=event.usage.prompt_tokens,
+                            completion_tokens=event.usage.completion_tokens,
+                            total_tokens=event.usage.total_tokens,
+                        )
+        except Exception:
+            LLM_ERRORS.inc(mode="stream")
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            LLM_SECONDS.observe(elapsed, mode="stream")
+            STAGE_SECONDS.observe(elapsed, stage="llm")
+            record_timing("llm", elapsed)
+
+    @staticmethod
+    def _count_tokens(usage) -> None:
+        # Token usage as reported by the API (absent from stubs and some servers)
+        if usage is None:
+            return
+        LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, kind="prompt")
+        LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, kind="completion")
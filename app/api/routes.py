@@ -1,17 +1,42 @@
-from fastapi import APIRouter, UploadFile, File, Depends, HTTPException
+import json
+from typing import Literal
+
+from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 
 from app.db.session import get_db
-from app.db.models import Document
+from app.db.models import Document, Job
 
-from app.services.validators import validate_upload, validate_size
+from app.services.validators import validate_upload
 from app.services.storage import save_upload, infer_file_type
 
-from app.services.ingestion_service import ingest_document
-from app.services.indexing_service import index_document
-from app.services.qa_service import ask_question
+from app.services.ingestion_service import ingest_document, load_document_pages
+from app.services.indexing_service import index_document, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP
+from app.services.qa_service import (
+    ask_question,
+    ask_corpus_question,
+    ask_questions,
+    retrieve_contexts,
+    retrieve_corpus_contexts,
+    stream_answer,
+    AnswerGenerationError,
+)
 from app.services.orchestrator import Orchestrator
+from app.services.bulk_ingest import start_bulk_ingestion, get_bulk_ingestion
+from app.services.job_queue import job_queue, job_to_dict, QueueFullError
+from app.core.model_registry import model_stats
+from app.core.index_cache import index_cache
+from app.core.corpus_index import corpus_index
+from app.core.extraction_cache import extraction_cache
+from app.core.embedding_cache import embedding_cache
+from app.core.answer_cache import answer_cache
+from app.core.lexical_index import corpus_lexical_index
+from app.core.metrics import registry
+from app.core.readiness import readiness
+from app.core.config import QA_BATCH_MAX_QUESTIONS
 
 router = APIRouter()
 
@@ -23,6 +48,63 @@ router = APIRouter()
 def health():
     return {"ok": True}
 
+@router.get("/ready")
+def ready(response: Response):
+    # 503 until startup warmup (database, job queue, models, indexes) has finished
+    status = readiness.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+@router.get("/health/models")
+def health_models():
+    # Load time and memory footprint of the shared embedding models
+    return model_stats()
+
+@router.get("/health/caches")
+def health_caches():
+    # Hit/miss/eviction counters for sizing the in-process caches
+    return {
+        "index_cache": index_cache.stats(),
+        "corpus_index": corpus_index.stats(),
+        "extraction_cache": extraction_cache.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "answer_cache": answer_cache.stats(),
+        "corpus_lexical_index": corpus_lexical_index.stats(),
+    }
+
+# --------------------------------------------------
+# Prometheus Metrics
+# --------------------------------------------------
+
+def _cache_metrics():
+    # Cache counters are owned by the caches; report them at scrape time
+    caches = {
+        "index": index_cache.stats(),
+        "extraction": extraction_cache.stats(),
+        "embedding": embedding_cache.stats(),
+        "answer": answer_cache.stats(),
+    }
+    answers = caches["answer"]
+    return [
+        ("docai_cache_hits_total", "counter", "Cache hits.",
+         [({"cache": name}, stats.get("hits")) for name, stats in caches.items() if name != "answer"]
+         + [({"cache": "answer_exact"}, answers["exact_hits"]), ({"cache": "answer_semantic"}, answers["semantic_hits"])]),
+        ("docai_cache_misses_total", "counter", "Cache misses.",
+         [({"cache": name}, stats.get("misses")) for name, stats in caches.items()]),
+        ("docai_cache_entries", "gauge", "Entries currently held in each cache.",
+         [({"cache": name}, stats.get("entries")) for name, stats in caches.items()]),
+        ("docai_index_cache_bytes", "gauge", "Approximate bytes held by the index cache.",
+         [({}, caches["index"]["bytes"])]),
+    ]
+
+registry.register_collector(_cache_metrics)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # Prometheus text exposition format, counters and histograms summed over the node's processes
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 # --------------------------------------------------
 # Document Upload
 # --------------------------------------------------
@@ -33,15 +115,16 @@ async def upload_document(
     db: Session = Depends(get_db)
 ):
     ext = validate_upload(file)
-    await validate_size(file)
 
-    path = await save_upload(file)
+    # Streams to disk with size checks and hashing in a single pass
+    path, size, content_hash = await save_upload(file)
 
     doc = Document(
         filename=file.filename,
         file_type=infer_file_type(ext),
         path=str(path),
-        status="UPLOADED"
+        status="UPLOADED",
+        content_hash=content_hash
     )
 
     db.add(doc)
@@ -54,10 +137,70 @@ async def upload_document(
             "id": doc.id,
             "filename": doc.filename,
             "file_type": doc.file_type,
-            "status": doc.status
+            "status": doc.status,
+            "size_bytes": size,
+            "content_hash": doc.content_hash
         }
     }
 
+# --------------------------------------------------
+# Bulk Ingestion
+# --------------------------------------------------
+
+@router.post("/documents/bulk", status_code=202)
+async def bulk_upload(
+    files: list[UploadFile] = File(...),
+    db: Session = Depends(get_db)
+):
+    # Files that fail validation are reported and skipped; the rest are processed
+    # together by the bulk pipeline in the background
+    documents, rejected = [], []
+    for file in files:
+        try:
+            ext = validate_upload(file)
+            path, size, content_hash = await save_upload(file)
+        except HTTPException as e:
+            rejected.append({"filename": file.filename, **e.detail})
+            continue
+
+        doc = Document(
+            filename=file.filename,
+            file_type=infer_file_type(ext),
+            path=str(path),
+            status="UPLOADED",
+            content_hash=content_hash
+        )
+        db.add(doc)
+        documents.append(doc)
+
+    db.commit()
+    run = start_bulk_ingestion([doc.id for doc in documents])
+
+    return {
+        "success": True,
+        "bulk": run.progress(),
+        "documents": [{"id": doc.id, "filename": doc.filename} for doc in documents],
+        "rejected": rejected
+    }
+
+@router.get("/documents/bulk/{bulk_id}")
+def get_bulk(bulk_id: str, db: Session = Depends(get_db)):
+    # Progress and throughput of a bulk run, whichever API process started it
+    progress = get_bulk_ingestion(bulk_id, db)
+    if not progress:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "code": "BULK_NOT_FOUND",
+                "message": "Bulk ingestion run not found"
+            }
+        )
+
+    return {
+        "success": True,
+        "bulk": progress
+    }
+
 # --------------------------------------------------
 # DEBUG: Text Extraction (Optional)
 # --------------------------------------------------
@@ -85,10 +228,16 @@ def extract_text(document_id: int, db: Session = Depends(get_db)):
 # --------------------------------------------------
 
 @router.post("/documents/{document_id}/index")
-def index_doc(document_id: int, db: Session = Depends(get_db)):
+def index_doc(
+    document_id: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+    db: Session = Depends(get_db)
+):
     doc = db.get(Document, document_id)
 
-    if not doc or doc.status != "TEXT_EXTRACTED":
+    # Already-indexed documents can be re-chunked from their stored text
+    if not doc or doc.status not in ("TEXT_EXTRACTED", "INDEXED") or not doc.text_path:
         raise HTTPException(
             status_code=400,
             detail={
@@ -97,9 +246,9 @@ def index_doc(document_id: int, db: Session = Depends(get_db)):
             }
         )
 
-    # NOTE: indexing assumes text already extracted
-    text = ingest_document(document_id, db)
-    count = index_document(document_id, text, db)
+    # Read the persisted text artifact instead of re-running extraction
+    pages = load_document_pages(document_id, db)
+    count = index_document(document_id, pages, db, chunk_size=chunk_size, overlap=overlap)
 
     return {
         "success": True,
@@ -110,47 +259,190 @@ def index_doc(document_id: int, db: Session = Depends(get_db)):
 # Orchestrated Processing (PRODUCTION FLOW)
 # --------------------------------------------------
 
-@router.post("/documents/{document_id}/process")
-def process_document(document_id: int, db: Session = Depends(get_db)):
+@router.post("/documents/{document_id}/process", status_code=202)
+def process_document(document_id: int, response: Response, sync: bool = False, db: Session = Depends(get_db)):
+    # Legacy blocking mode: run the whole pipeline inside the request
+    if sync:
+        response.status_code = 200
+        try:
+            orch = Orchestrator()
+            result = orch.process_document(document_id, db)
+            return {
+                "success": True,
+                "result": result
+            }
+        except Exception as e:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    "code": "PROCESSING_FAILED",
+                    "message": str(e)
+                }
+            )
+
     try:
-        orch = Orchestrator()
-        result = orch.process_document(document_id, db)
-        return {
-            "success": True,
-            "result": result
-        }
-    except Exception as e:
+        job = job_queue.enqueue(document_id, db)
+    except QueueFullError as e:
         raise HTTPException(
-            status_code=400,
+            status_code=429,
+            detail={
+                "code": "QUEUE_FULL",
+                "message": str(e)
+            }
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=404,
             detail={
-                "code": "PROCESSING_FAILED",
+                "code": "DOCUMENT_NOT_FOUND",
                 "message": str(e)
             }
         )
 
+    return {
+        "success": True,
+        "job": job_to_dict(job)
+    }
+
+# --------------------------------------------------
+# Job Status
+# --------------------------------------------------
+
+@router.get("/jobs/{job_id}")
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(Job, job_id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail={
+                "code": "JOB_NOT_FOUND",
+                "message": "Job not found"
+            }
+        )
+
+    # Document status reflects the orchestrator's stage (PROCESSING_TEXT, PROCESSING_INDEX, ...)
+    doc = db.get(Document, job.document_id)
+
+    return {
+        "success": True,
+        "job": job_to_dict(job, doc.status if doc else None)
+    }
+
 # --------------------------------------------------
 # Question Answering
 # --------------------------------------------------
 
 class QuestionRequest(BaseModel):
-    document_id: int
+    # Single-document mode
+    document_id: int | None = None
+    # Corpus mode: a list of document ids, or "all" for every indexed document
+    document_ids: list[int] | Literal["all"] | None = None
     question: str
     top_k: int = 5
+    # Retrieval strategy; defaults to the server's RETRIEVAL_MODE
+    mode: Literal["vector", "lexical", "hybrid"] | None = None
 
-@router.post("/questions/ask")
-def ask(req: QuestionRequest, db: Session = Depends(get_db)):
-    try:
-        answer, sources = ask_question(
-            document_id=req.document_id,
+class BatchQuestionRequest(BaseModel):
+    # Same scope fields as QuestionRequest, shared by every question
+    document_id: int | None = None
+    document_ids: list[int] | Literal["all"] | None = None
+    questions: list[str]
+    top_k: int = 5
+    mode: Literal["vector", "lexical", "hybrid"] | None = None
+
+def _validate_question_request(req: QuestionRequest | BatchQuestionRequest) -> None:
+    if (req.document_id is None) == (req.document_ids is None):
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "INVALID_REQUEST",
+                "message": "Provide exactly one of document_id or document_ids"
+            }
+        )
+
+def _retrieve(req: QuestionRequest, db: Session):
+    # (contexts, sources) for either single-document or corpus mode
+    if req.document_ids is not None:
+        return retrieve_corpus_contexts(
             question=req.question,
             db=db,
-            top_k=req.top_k
+            top_k=req.top_k,
+            document_ids=None if req.document_ids == "all" else req.document_ids,
+            mode=req.mode
         )
+    return retrieve_contexts(
+        document_id=req.document_id,
+        question=req.question,
+        db=db,
+        top_k=req.top_k,
+        mode=req.mode
+    )
+
+@router.post("/questions/ask")
+def ask(req: QuestionRequest, db: Session = Depends(get_db)):
+    _validate_question_request(req)
+
+    try:
+        if req.document_ids is not None:
+            answer, sources = ask_corpus_question(
+                question=req.question,
+                db=db,
+                top_k=req.top_k,
+                document_ids=None if req.document_ids == "all" else req.document_ids,
+                mode=req.mode
+            )
+        else:
+            answer, sources = ask_question(
+                document_id=req.document_id,
+                question=req.question,
+                db=db,
+                top_k=req.top_k,
+                mode=req.mode
+            )
         return {
             "success": True,
             "answer": answer,
             "sources": sources
         }
+    except AnswerGenerationError as e:
+        raise HTTPException(
+            status_code=502,
+            detail={
+                "code": "LLM_FAILED",
+                "message": str(e)
+            }
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "QA_FAILED",
+                "message": str(e)
+            }
+        )
+
+@router.post("/questions/ask_batch")
+def ask_batch(req: BatchQuestionRequest, db: Session = Depends(get_db)):
+    _validate_question_request(req)
+    if not req.questions or len(req.questions) > QA_BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "INVALID_REQUEST",
+                "message": f"Provide between 1 and {QA_BATCH_MAX_QUESTIONS} questions"
+            }
+        )
+
+    # Scope errors fail the whole request; anything later is reported per question
+    try:
+        results = ask_questions(
+            questions=req.questions,
+            db=db,
+            top_k=req.top_k,
+            document_id=req.document_id,
+            document_ids=None if req.document_ids in (None, "all") else req.document_ids,
+            mode=req.mode
+        )
     except Exception as e:
         raise HTTPException(
             status_code=400,
@@ -159,3 +451,56 @@ def ask(req: QuestionRequest, db: Session = Depends(get_db)):
                 "message": str(e)
             }
         )
+
+    return {
+        "success": True,
+        "results": results
+    }
+
+# --------------------------------------------------
+# Streaming Question Answering (Server-Sent Events)
+# --------------------------------------------------
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/questions/ask/stream")
+async def ask_stream(req: QuestionRequest, request: Request, db: Session = Depends(get_db)):
+    _validate_question_request(req)
+
+    try:
+        # Embedding and FAISS search block; keep them off the event loop
+        contexts, sources = await run_in_threadpool(_retrieve, req, db)
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "code": "QA_FAILED",
+                "message": str(e)
+            }
+        )
+
+    async def events():
+        # Sources go out as soon as retrieval finishes, before the first LLM token
+        yield _sse("sources", {"sources": sources})
+
+        usage = {}
+        tokens = stream_answer(req.question, contexts, usage)
+        try:
+            async for token in tokens:
+                if await request.is_disconnected():
+                    # Stop paying for tokens nobody will read
+                    break
+                yield _sse("token", {"text": token})
+            else:
+                yield _sse("done", {"usage": usage or None})
+        except Exception as e:
+            yield _sse("error", {"code": "LLM_FAILED", "message": str(e)})
+        finally:
+            await tokens.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
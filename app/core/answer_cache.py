@@ -0,0 +1,136 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.core.config import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_SIMILARITY,
+)
+
+
+def normalize_question(question: str) -> str:
+    # Case, whitespace and trailing punctuation don't change the question
+    return re.sub(r"\s+", " ", question).strip().strip("?!. ").lower()
+
+
+class AnswerCache:
+    """
+    In-process cache of generated answers.
+
+    Entries live in a scope — (document_id, index version, top_k) or the corpus
+    equivalent — so a rebuilt index never serves stale answers. Lookups match
+    the normalized question exactly, then fall back to the most similar cached
+    question embedding above a cosine threshold. Entries expire after a TTL
+    and are evicted LRU past max_entries.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int, similarity: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+
+        # (scope, normalized question) -> entry, in LRU order
+        self._entries: OrderedDict[tuple, dict] = OrderedDict()
+        # scope -> (keys, stacked embeddings) for the similarity scan; rebuilt lazily
+        self._matrices: dict[tuple, tuple[list, np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def get_exact(self, scope: tuple, question: str):
+        key = (scope, normalize_question(question))
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None
+            self.exact_hits += 1
+            return entry["answer"], entry["sources"]
+
+    def get_similar(self, scope: tuple, q_emb: np.ndarray):
+        """
+        Best cached answer whose question embedding is within the threshold.
+        q_emb must be L2-normalized with shape (d,) or (1, d). Counts a miss otherwise.
+        """
+        with self._lock:
+            keys, matrix = self._matrix(scope)
+            if keys:
+                scores = matrix @ q_emb.reshape(-1)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.similarity:
+                    entry = self._live(keys[best])
+                    if entry is not None:
+                        self.semantic_hits += 1
+                        return entry["answer"], entry["sources"]
+            self.misses += 1
+            return None
+
+    def put(self, scope: tuple, question: str, q_emb: np.ndarray | None, answer: str, sources: list) -> None:
+        key = (scope, normalize_question(question))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "embedding": None if q_emb is None else np.asarray(q_emb, dtype="float32").reshape(-1),
+                "answer": answer,
+                "sources": sources,
+                "expires": time.monotonic() + self.ttl_seconds,
+            }
+            self._matrices.pop(scope, None)
+
+            while len(self._entries) > self.max_entries:
+                (old_scope, _), _ = self._entries.popitem(last=False)
+                self._matrices.pop(old_scope, None)
+
+    def invalidate_document(self, document_id: int) -> None:
+        # Drop every scope that includes this document (single-document or corpus)
+        with self._lock:
+            stale = [
+                key for key in self._entries
+                if key[0][0] == document_id or key[0][0] == "corpus"
+            ]
+            for key in stale:
+                del self._entries[key]
+                self._matrices.pop(key[0], None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 4) if total else None,
+            }
+
+    def _live(self, key: tuple):
+        # Entry if present and not expired; refreshes its LRU position
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry["expires"] < time.monotonic():
+            del self._entries[key]
+            self._matrices.pop(key[0], None)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _matrix(self, scope: tuple):
+        cached = self._matrices.get(scope)
+        if cached is None:
+            # Entries put without an embedding only answer exact matches
+            keys = [key for key in self._entries if key[0] == scope and self._entries[key]["embedding"] is not None]
+            matrix = np.stack([self._entries[k]["embedding"] for k in keys]) if keys else None
+            cached = (keys, matrix)
+            self._matrices[scope] = cached
+        return cached
+
+
+# Process-wide answer cache
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY)
@@ -0,0 +1,244 @@
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+# Header: magic, version, flags, chunk count, chunks per compressed block
+_HEADER = struct.Struct("<4sHHII")
+_MAGIC = b"DCHK"
+_VERSION = 1
+_FLAG_COMPRESSED = 1
+_FLAG_IDS = 2
+
+
+class ChunkStoreWriter:
+    """
+    Streams chunk texts into a chunk store file.
+
+    Layout after the header:
+      uncompressed: offsets uint64[count + 1], then the concatenated UTF-8 blob
+      compressed:   block offsets uint64[blocks + 1], chunk offsets uint64[count + 1]
+                    (into the uncompressed text), then zlib-compressed blocks
+    A chunk's id is its position, unless the store was compacted (chunks
+    dropped from the middle): then the header is followed by the next free id
+    uint64 and the ascending chunk ids int64[count].
+    The file is written to a temp name and renamed into place on close().
+    """
+
+    def __init__(self, path: Path, compress: bool = False, block_size: int = 16):
+        self.path = path
+        self.compress = compress
+        self.block_size = block_size
+
+        self._tmp_blob = path.with_name(path.name + ".blob.tmp")
+        self._blob = open(self._tmp_blob, "wb")
+        self._offsets = array("Q", [0])
+        self._block_offsets = array("Q", [0])
+        self._pending = []
+        # Explicit chunk ids, once one differs from its position
+        self._ids = None
+        self.next_id = 0
+
+    def add(self, text: str, chunk_id: int | None = None) -> int:
+        # Returns the chunk's id: chunk_id (at least next_id), by default next_id
+        position = len(self._offsets) - 1
+        if chunk_id is None:
+            chunk_id = self.next_id
+        elif chunk_id < self.next_id:
+            raise ValueError(f"Chunk ids must ascend and not reuse freed ids: {chunk_id}")
+        if self._ids is None and chunk_id != position:
+            self._ids = array("q", range(position))
+        if self._ids is not None:
+            self._ids.append(chunk_id)
+        self.next_id = max(self.next_id, chunk_id + 1)
+
+        data = text.encode("utf-8")
+        self._offsets.append(self._offsets[-1] + len(data))
+        if self.compress:
+            self._pending.append(data)
+            if len(self._pending) == self.block_size:
+                self._flush_block()
+        else:
+            self._blob.write(data)
+        return chunk_id
+
+    def copy_from(self, store: "ChunkStore") -> None:
+        """
+        Add every chunk of an existing store under its id, e.g. before appending
+        new chunks to it. Into an empty writer with the same layout the bytes are
+        copied as they are (whole compressed blocks without recompressing);
+        otherwise chunk by chunk.
+        """
+        chunk_ids = store.chunk_ids()
+        same_layout = store.compressed == self.compress and (not self.compress or store.block_size == self.block_size)
+        if len(self._offsets) > 1 or not same_layout:
+            for slot, chunk_id in enumerate(chunk_ids):
+                self.add(store._slot_text(slot), int(chunk_id))
+            self.next_id = max(self.next_id, store.next_id)
+            return
+
+        if store.ids is not None:
+            self._ids = array("q")
+
+        if not self.compress:
+            end = int(store._offsets[-1])
+            self._blob.write(store._mm[store._data_start:store._data_start + end])
+            self._offsets.frombytes(store._offsets[1:].tobytes())
+            if self._ids is not None:
+                self._ids.frombytes(store.ids.tobytes())
+            self.next_id = store.next_id
+            return
+
+        # Full blocks verbatim; the chunks of a trailing partial block are re-added
+        full = len(store) // store.block_size
+        end = int(store._block_offsets[full])
+        self._blob.write(store._mm[store._data_start:store._data_start + end])
+        self._block_offsets.frombytes(store._block_offsets[1:full + 1].tobytes())
+        self._offsets.frombytes(store._offsets[1:full * store.block_size + 1].tobytes())
+        if self._ids is not None:
+            self._ids.frombytes(store.ids[:full * store.block_size].tobytes())
+        self.next_id = int(chunk_ids[full * store.block_size - 1]) + 1 if full else 0
+        for slot in range(full * store.block_size, len(store)):
+            self.add(store._slot_text(slot), int(chunk_ids[slot]))
+        self.next_id = max(self.next_id, store.next_id)
+
+    def _flush_block(self) -> None:
+        if not self._pending:
+            return
+        block = zlib.compress(b"".join(self._pending), 6)
+        self._blob.write(block)
+        self._block_offsets.append(self._block_offsets[-1] + len(block))
+        self._pending = []
+
+    def close(self) -> int:
+        if self.compress:
+            self._flush_block()
+        self._blob.close()
+
+        count = len(self._offsets) - 1
+        flags = _FLAG_COMPRESSED if self.compress else 0
+        # Ids are only stored when they are not simply 0..count-1
+        if self._ids is not None or self.next_id != count:
+            flags |= _FLAG_IDS
+        tmp = self.path.with_name(self.path.name + ".tmp")
+
+        with open(tmp, "wb") as out, open(self._tmp_blob, "rb") as blob:
+            out.write(_HEADER.pack(_MAGIC, _VERSION, flags, count, self.block_size))
+            if flags & _FLAG_IDS:
+                array("Q", [self.next_id]).tofile(out)
+                (self._ids if self._ids is not None else array("q", range(count))).tofile(out)
+            if self.compress:
+                self._block_offsets.tofile(out)
+            self._offsets.tofile(out)
+            while data := blob.read(1024 * 1024):
+                out.write(data)
+
+        os.unlink(self._tmp_blob)
+        os.replace(tmp, self.path)
+        return count
+
+    def abort(self) -> None:
+        self._blob.close()
+        Path(self._tmp_blob).unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_chunk_store(path: Path, chunks: list[str], compress: bool = False, block_size: int = 16) -> int:
+    with ChunkStoreWriter(path, compress, block_size) as writer:
+        for chunk in chunks:
+            writer.add(chunk)
+    return len(chunks)
+
+
+class ChunkStore:
+    """
+    Read-only, memory-mapped chunk store.
+    get(i) is O(1) (O(log n) in a compacted store) and touches only the bytes
+    of chunk i (or its compressed block).
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, count, block_size = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Not a chunk store: {path}")
+
+        self.count = count
+        self.block_size = block_size
+        self.compressed = bool(flags & _FLAG_COMPRESSED)
+
+        pos = _HEADER.size
+        # Chunk ids, when they are not the positions
+        self.ids = None
+        self.next_id = count
+        if flags & _FLAG_IDS:
+            self.next_id = int(np.frombuffer(self._mm, dtype="<u8", count=1, offset=pos)[0])
+            self.ids = np.frombuffer(self._mm, dtype="<i8", count=count, offset=pos + 8)
+            pos += 8 * (count + 1)
+        if self.compressed:
+            blocks = (count + block_size - 1) // block_size
+            self._block_offsets = np.frombuffer(self._mm, dtype="<u8", count=blocks + 1, offset=pos)
+            pos += 8 * (blocks + 1)
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=pos)
+        self._data_start = pos + 8 * (count + 1)
+
+        # Last decompressed block; consecutive hits often share one
+        self._block_cache = (None, b"")
+
+    def __len__(self) -> int:
+        # Stored chunks (ids run up to next_id)
+        return self.count
+
+    def chunk_ids(self) -> np.ndarray:
+        return np.arange(self.count, dtype="int64") if self.ids is None else self.ids
+
+    def get(self, chunk_id: int) -> str:
+        if self.ids is None:
+            if not 0 <= chunk_id < self.count:
+                raise IndexError(chunk_id)
+            return self._slot_text(chunk_id)
+
+        slot = int(np.searchsorted(self.ids, chunk_id))
+        if slot == self.count or int(self.ids[slot]) != chunk_id:
+            raise IndexError(chunk_id)
+        return self._slot_text(slot)
+
+    def _slot_text(self, i: int) -> str:
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        if not self.compressed:
+            return self._mm[self._data_start + start:self._data_start + end].decode("utf-8")
+
+        b = i // self.block_size
+        cached_b, block = self._block_cache
+        if cached_b != b:
+            lo, hi = int(self._block_offsets[b]), int(self._block_offsets[b + 1])
+            block = zlib.decompress(self._mm[self._data_start + lo:self._data_start + hi])
+            self._block_cache = (b, block)
+
+        base = int(self._offsets[b * self.block_size])
+        return block[start - base:end - base].decode("utf-8")
+
+    def get_many(self, ids) -> list[str]:
+        return [self.get(int(i)) for i in ids]
+
+    def close(self) -> None:
+        # Drop numpy views before closing the map they point into
+        self._offsets = None
+        self._block_offsets = None
+        self.ids = None
+        self._mm.close()
@@ -0,0 +1,146 @@
+import re
+from collections import deque
+from typing import Callable, Iterable, Iterator
+
+# Sentence boundary: whitespace after terminal punctuation (captured, to keep offsets)
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])(\s+)")
+
+# Separator between pages in the joined document text (see IngestionAgent.join_pages)
+PAGE_SEPARATOR = "\n\n"
+
+
+class TokenCounter:
+    """
+    Token counts per text, computed from cached per-word counts.
+
+    WordPiece (and SentencePiece-style) tokenizers encode whitespace-separated
+    words independently, so a text's count is the sum of its words' counts.
+    Only words not seen before go through the tokenizer, in one batch per call,
+    which makes counting a dictionary lookup per word for typical prose.
+    """
+
+    def __init__(self, tokenizer, max_words: int = 500_000):
+        self.tokenizer = tokenizer
+        self.max_words = max_words
+        self._counts: dict[str, int] = {}
+
+    def __call__(self, texts: list[str]) -> list[int]:
+        counts = self._counts
+        split = [text.split() for text in texts]
+
+        unknown = list({w for words in split for w in words if w not in counts})
+        if unknown:
+            if len(counts) + len(unknown) > self.max_words:
+                counts.clear()
+            input_ids = self.tokenizer(unknown, add_special_tokens=False, verbose=False)["input_ids"]
+            counts.update(zip(unknown, map(len, input_ids)))
+
+        return [sum(map(counts.__getitem__, words)) for words in split]
+
+
+def _sentences(text: str) -> list[tuple[str, int, int]]:
+    # (sentence, start, end) for each whitespace-trimmed sentence in text
+    parts = _SENTENCE_BREAK.split(text)
+    sentences = []
+    pos = 0
+    for i in range(0, len(parts), 2):
+        part = parts[i]
+        start, end = pos, pos + len(part)
+        pos = end + (len(parts[i + 1]) if i + 1 < len(parts) else 0)
+
+        # Only the first and last parts can carry surrounding whitespace
+        if part[:1].isspace() or part[-1:].isspace():
+            stripped = part.lstrip()
+            start += len(part) - len(stripped)
+            part = stripped.rstrip()
+            end = start + len(part)
+        if part:
+            sentences.append((part, start, end))
+    return sentences
+
+
+def _split_long(text: str, start: int, end: int, max_tokens: int, count_tokens) -> Iterator[tuple[str, int, int, int]]:
+    # Split a sentence longer than max_tokens into word-aligned pieces of at most max_tokens
+    words = [(m.start() + start, m.end() + start) for m in re.finditer(r"\S+", text[start:end])]
+    counts = count_tokens([text[s:e] for s, e in words])
+
+    piece_start, piece_tokens = words[0][0], 0
+    for (word_start, word_end), tokens in zip(words, counts):
+        if piece_tokens and piece_tokens + tokens > max_tokens:
+            yield text[piece_start:prev_end], piece_start, prev_end, piece_tokens
+            piece_start, piece_tokens = word_start, 0
+        # A single word over the limit stays whole; the model truncates it
+        piece_tokens += tokens
+        prev_end = word_end
+    yield text[piece_start:prev_end], piece_start, prev_end, piece_tokens
+
+
+def iter_chunks(
+    pages: Iterable[tuple[int, str]],
+    count_tokens: Callable[[list[str]], list[int]],
+    max_tokens: int,
+    overlap_tokens: int = 0,
+) -> Iterator[dict]:
+    """
+    Sentence-aware chunking sized by model tokens, in a single pass over pages.
+
+    Chunks hold whole sentences up to max_tokens (longer sentences are split at
+    word boundaries) and start with the trailing sentences of the previous chunk
+    up to overlap_tokens. Page boundaries are sentence boundaries.
+
+    Yields {"text", "tokens", "page_start", "page_end", "char_start", "char_end"};
+    character offsets are into the pages joined with PAGE_SEPARATOR (empty pages
+    skipped), i.e. the text returned by IngestionAgent.join_pages.
+    """
+    # Sentences in the current chunk: (text, tokens, page, char_start, char_end)
+    window: deque[tuple] = deque()
+    window_tokens = 0
+    offset = 0
+    first_page = True
+
+    def emit() -> dict:
+        return {
+            "text": " ".join(s[0] for s in window),
+            "tokens": window_tokens,
+            "page_start": window[0][2],
+            "page_end": window[-1][2],
+            "char_start": window[0][3],
+            "char_end": window[-1][4],
+        }
+
+    for page_number, text in pages:
+        if not text:
+            continue
+        if not first_page:
+            offset += len(PAGE_SEPARATOR)
+        first_page = False
+
+        sentences = _sentences(text)
+        # One tokenizer call per page keeps the fast tokenizer batched
+        counts = count_tokens([s[0] for s in sentences])
+
+        for (sentence, start, end), tokens in zip(sentences, counts):
+            if tokens <= max_tokens:
+                pieces = ((sentence, start, end, tokens),)
+            else:
+                pieces = _split_long(text, start, end, max_tokens, count_tokens)
+
+            for piece, piece_start, piece_end, piece_tokens in pieces:
+                if window and window_tokens + piece_tokens > max_tokens:
+                    yield emit()
+
+                    # Carry trailing sentences (up to overlap_tokens) into the next chunk;
+                    # each sentence is dropped once, so the whole pass stays linear
+                    while window and window_tokens > overlap_tokens:
+                        window_tokens -= window.popleft()[1]
+                    # Make room for the incoming sentence
+                    while window and window_tokens + piece_tokens > max_tokens:
+                        window_tokens -= window.popleft()[1]
+
+                window.append((piece, piece_tokens, page_number, offset + piece_start, offset + piece_end))
+                window_tokens += piece_tokens
+
+        offset += len(text)
+
+    if window:
+        yield emit()
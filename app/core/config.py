@@ -1,9 +1,152 @@
+import os
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parents[2]  # doc_ai_backend/
-STORAGE_DIR = BASE_DIR / "storage"
+STORAGE_DIR = Path(os.getenv("STORAGE_DIR", BASE_DIR / "storage"))
 UPLOAD_DIR = STORAGE_DIR / "uploads"
-DB_PATH = BASE_DIR / "storage" / "app.db"
+INDEX_DIR = STORAGE_DIR / "indexes"
+TEXT_DIR = STORAGE_DIR / "text"  # extracted text artifacts (gzip'd JSON lines, one page per line)
+DB_PATH = STORAGE_DIR / "app.db"
 
 ALLOWED_EXTENSIONS = {".pdf", ".png", ".jpg", ".jpeg", ".tiff"}
 MAX_FILE_SIZE_BYTES = 25 * 1024 * 1024  # 25MB (adjust if you want)
+
+# Sentence embedding model shared by indexing and Q&A
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# Inference backend: "torch" (SentenceTransformer) or "onnx" (ONNX Runtime, see app/core/embedding_backend.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+# Intra-op threads for the model (0 = library default, usually one per core)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))
+# ONNX only: int8 dynamic quantization, and an optional local .onnx file instead of the published export
+EMBEDDING_ONNX_QUANTIZED = os.getenv("EMBEDDING_ONNX_QUANTIZED", "1") == "1"
+EMBEDDING_ONNX_PATH = os.getenv("EMBEDDING_ONNX_PATH", "")
+
+# Shared embedding sidecar (python -m app.core.embedding_sidecar): workers encode through this
+# UNIX socket whenever a sidecar is listening on it, else load the model themselves ("" = never).
+# Concurrent requests within the window are merged into batches of up to MAX_BATCH texts.
+EMBEDDING_SIDECAR_SOCKET = os.getenv("EMBEDDING_SIDECAR_SOCKET", str(STORAGE_DIR / "embedding.sock"))
+EMBEDDING_SIDECAR_WINDOW_MS = float(os.getenv("EMBEDDING_SIDECAR_WINDOW_MS", 5))
+EMBEDDING_SIDECAR_MAX_BATCH = int(os.getenv("EMBEDDING_SIDECAR_MAX_BATCH", 256))
+# Per request: bulk encodes are sent in slices of at most the sidecar's max batch, each
+# with the bulk timeout; small (query) encodes and tokenize calls use the query timeout
+EMBEDDING_SIDECAR_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_SIDECAR_TIMEOUT_SECONDS", 60))
+EMBEDDING_SIDECAR_QUERY_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_SIDECAR_QUERY_TIMEOUT_SECONDS", 10))
+
+# In-process cache of loaded FAISS indexes + chunk maps (LRU, bounded by bytes and entries)
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+INDEX_CACHE_MAX_ENTRIES = int(os.getenv("INDEX_CACHE_MAX_ENTRIES", 256))
+# Indexes at least this large are memory-mapped instead of copied into RAM
+INDEX_MMAP_MIN_BYTES = int(os.getenv("INDEX_MMAP_MIN_BYTES", 64 * 1024 * 1024))
+
+# Corpus-wide vector index covering every indexed document
+CORPUS_INDEX_PATH = INDEX_DIR / "corpus.faiss"
+CORPUS_MANIFEST_PATH = INDEX_DIR / "corpus.json"
+# Stay exact (flat) until this many vectors, then switch to IVF
+CORPUS_IVF_MIN_VECTORS = int(os.getenv("CORPUS_IVF_MIN_VECTORS", 20_000))
+CORPUS_NPROBE = int(os.getenv("CORPUS_NPROBE", 32))
+# An IVF search filtered to a few documents probes too few lists to fill top_k,
+# so filters of at most this many documents search each document's own index
+CORPUS_DOCUMENT_SEARCH_MAX = int(os.getenv("CORPUS_DOCUMENT_SEARCH_MAX", 4))
+# Writes append small delta files; they are merged into a new base index in the
+# background once they hold this many added or deleted vectors, or this many files
+CORPUS_DELTA_MAX_VECTORS = int(os.getenv("CORPUS_DELTA_MAX_VECTORS", 50_000))
+CORPUS_DELTA_MAX_FILES = int(os.getenv("CORPUS_DELTA_MAX_FILES", 64))
+
+# Counters and histograms from every process on the node (API workers, job
+# workers) are written here every METRICS_FLUSH_SECONDS and summed by GET /metrics
+METRICS_DIR = Path(os.getenv("METRICS_DIR", STORAGE_DIR / "metrics"))
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+
+# Background processing jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))  # worker processes per API process
+JOB_MAX_QUEUE_DEPTH = int(os.getenv("JOB_MAX_QUEUE_DEPTH", 100))  # queued jobs before rejecting
+# Each active job's owner (the API process holding it queued, then the worker running it)
+# refreshes its heartbeat this often; one process per node sweeps jobs whose owner is gone
+# or whose heartbeat is older than JOB_STALE_SECONDS, and requeues them
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 10))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", 60))
+JOB_LOCK_PATH = STORAGE_DIR / "jobs.lock"
+
+# Streaming mode (bounded memory): documents with at least this many pages are extracted
+# page by page and indexed STREAM_EMBED_BATCH chunks at a time (0 = stream every document)
+STREAMING_MIN_PAGES = int(os.getenv("STREAMING_MIN_PAGES", 200))
+STREAM_EMBED_BATCH = int(os.getenv("STREAM_EMBED_BATCH", 256))
+
+# Re-processing an indexed document only embeds and writes the chunks that changed,
+# unless more than this fraction of its chunks were inserted or removed (0 = always rebuild)
+INDEX_UPDATE_MAX_CHANGE = float(os.getenv("INDEX_UPDATE_MAX_CHANGE", 0.5))
+
+# Bulk ingestion (POST /documents/bulk, python -m app.services.bulk_ingest): extraction
+# processes (one pool shared by every run in the process), chunks per cross-document
+# embedding batch, documents per corpus index write, and documents buffered between stages
+BULK_EXTRACT_WORKERS = int(os.getenv("BULK_EXTRACT_WORKERS", os.cpu_count() or 1))
+BULK_EMBED_BATCH = int(os.getenv("BULK_EMBED_BATCH", 256))
+BULK_WRITE_BATCH = int(os.getenv("BULK_WRITE_BATCH", 32))
+BULK_QUEUE_SIZE = int(os.getenv("BULK_QUEUE_SIZE", 64))
+# Progress of a running bulk run is saved to the bulk_runs table this often; a run
+# that stops saving for JOB_STALE_SECONDS is reported as interrupted
+BULK_PROGRESS_SECONDS = float(os.getenv("BULK_PROGRESS_SECONDS", 2))
+
+# PDF extraction: pages are extracted in parallel worker processes
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 8))  # smaller PDFs stay in-process
+# Pages without a text layer are rasterized at this resolution and OCR'd
+OCR_DPI = int(os.getenv("OCR_DPI", 300))
+
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_BYTES = 256 * 1024
+
+# Content-addressed caches (extracted text by file hash, embeddings by chunk-text hash)
+CACHE_DIR = STORAGE_DIR / "cache"
+EXTRACT_CACHE_MAX_BYTES = int(os.getenv("EXTRACT_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+EMBEDDING_CACHE_PATH = CACHE_DIR / "embeddings.db"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 2_000_000))
+
+# Chunk text store next to each index; optional per-block zlib compression
+CHUNK_STORE_COMPRESS = os.getenv("CHUNK_STORE_COMPRESS", "0") == "1"
+CHUNK_STORE_BLOCK_SIZE = int(os.getenv("CHUNK_STORE_BLOCK_SIZE", 16))
+# An incremental update rewrites a document's chunk store without its removed
+# chunks once they make up more than this fraction of its slots
+CHUNK_STORE_MAX_DEAD = float(os.getenv("CHUNK_STORE_MAX_DEAD", 0.25))
+
+# Answer generation (OPENAI_BASE_URL points the clients at a compatible/fake server)
+LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4o-mini")
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", 800))
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0.1))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 60))
+
+# POST /questions/ask_batch: questions per request, and concurrent LLM calls per request
+QA_BATCH_MAX_QUESTIONS = int(os.getenv("QA_BATCH_MAX_QUESTIONS", 100))
+QA_BATCH_CONCURRENCY = int(os.getenv("QA_BATCH_CONCURRENCY", 8))
+
+# Answer cache for repeated / near-duplicate questions
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 10_000))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 24 * 3600))
+# Cosine similarity above which a new question reuses a cached answer
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+
+# Add a Server-Timing stage breakdown to every response (otherwise only when the
+# request sends "X-Debug-Timing: 1")
+DEBUG_TIMING = os.getenv("DEBUG_TIMING", "0") == "1"
+
+# Retrieval: "vector" (dense only), "lexical" (BM25 only) or "hybrid" (both, fused by reciprocal rank)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+# Corpus BM25 segments; similar-sized segments are merged once this many accumulate
+CORPUS_LEXICAL_DIR = INDEX_DIR / "corpus_bm25"
+LEXICAL_MERGE_FACTOR = int(os.getenv("LEXICAL_MERGE_FACTOR", 8))
+# A segment is rewritten without its replaced or removed rows once they pass this fraction
+LEXICAL_MAX_DEAD = float(os.getenv("LEXICAL_MAX_DEAD", 0.3))
+
+# Vector index type per deployment: "flat" (exact float32), "sq8" (8-bit scalar
+# quantized, 4x smaller) or "ivfpq" (IVF + product quantization, ~32x smaller).
+# Compressed indexes keep float16 copies of the vectors ({id}.f16) for re-ranking.
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+# Compressed searches fetch this many candidates per requested chunk, then re-rank exactly
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", 4))
+# IVF-PQ: bytes per vector (must divide the embedding dimension), bits per code, probed lists
+VECTOR_PQ_M = int(os.getenv("VECTOR_PQ_M", 48))
+VECTOR_PQ_NBITS = int(os.getenv("VECTOR_PQ_NBITS", 8))
+VECTOR_NPROBE = int(os.getenv("VECTOR_NPROBE", 16))
+# PQ codebooks need enough training vectors; smaller indexes fall back to sq8
+VECTOR_IVFPQ_MIN_VECTORS = int(os.getenv("VECTOR_IVFPQ_MIN_VECTORS", 10_000))
@@ -0,0 +1,637 @@
+import fcntl
+import json
+import logging
+import math
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import (
+    CORPUS_INDEX_PATH,
+    CORPUS_MANIFEST_PATH,
+    CORPUS_IVF_MIN_VECTORS,
+    CORPUS_NPROBE,
+    CORPUS_DELTA_MAX_VECTORS,
+    CORPUS_DELTA_MAX_FILES,
+    VECTOR_INDEX_TYPE,
+    VECTOR_RERANK_FACTOR,
+)
+from app.core.index_snapshots import current_snapshots, lease_snapshot
+from app.core.vector_index import document_vectors, is_exact, make_ivf_index
+
+logger = logging.getLogger(__name__)
+
+# Filters up to this many documents use ID ranges; larger ones use an exact id set
+_MAX_RANGE_FILTERS = 16
+
+# Re-train the coarse quantizer once the corpus grows this much past its training size
+_RETRAIN_GROWTH = 8
+
+
+def make_vector_id(document_id: int, chunk_index: int) -> int:
+    # Pack (document_id, chunk_index) into one int64 FAISS id
+    return (document_id << 32) | chunk_index
+
+
+def split_vector_id(vector_id: int) -> tuple[int, int]:
+    return vector_id >> 32, vector_id & 0xFFFFFFFF
+
+
+class CorpusIndex:
+    """
+    Single vector index over every indexed document.
+
+    Vector ids encode (document_id, chunk_index), so hits map straight back to
+    chunks and a document's vectors can be replaced, updated chunk by chunk or
+    filtered by id. Small
+    corpora use an exact flat index; past CORPUS_IVF_MIN_VECTORS the index is
+    rebuilt as IVF so query time stays roughly constant as the corpus grows.
+    The IVF lists hold VECTOR_INDEX_TYPE codes; compressed codes are re-ranked
+    against each document's float16 vectors.
+
+    On disk the index is an immutable base file plus append-only delta files:
+    a write only stores the vectors it adds and the ids it deletes, so it costs
+    O(change) rather than O(corpus). Searches cover the base (minus deleted ids)
+    and an exact index over the live delta vectors. Once deltas pass
+    CORPUS_DELTA_MAX_VECTORS or CORPUS_DELTA_MAX_FILES, a background merge
+    writes a new base. The manifest names the base and its deltas and is
+    replaced atomically, so readers in any process load a consistent view
+    (base memory-mapped) without locks and swap it in.
+    """
+
+    def __init__(self, index_path: Path, manifest_path: Path):
+        self.index_path = index_path
+        self.manifest_path = manifest_path
+        self.delta_dir = index_path.with_suffix(".delta")
+        self.lock_path = index_path.with_suffix(".lock")
+        self.merge_lock_path = index_path.with_suffix(".merge.lock")
+
+        self._view = _View.empty()
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._merging = False
+
+    # --------------------------------------------------
+    # Writes
+    # --------------------------------------------------
+
+    def add_document(self, document_id: int, embeddings: np.ndarray, chunk_ids: np.ndarray | None = None) -> None:
+        """
+        Replace a document's vectors with normalized float32 embeddings (one row
+        per chunk). chunk_ids default to the row numbers.
+        """
+        self.add_documents({document_id: embeddings}, None if chunk_ids is None else {document_id: chunk_ids})
+
+    def add_documents(self, batch: dict[int, np.ndarray], chunk_ids: dict[int, np.ndarray] | None = None) -> None:
+        # Apply several documents as one delta
+        ids, vectors = [], []
+        for document_id, embeddings in batch.items():
+            if len(embeddings) == 0:
+                continue
+            document_chunk_ids = (chunk_ids or {}).get(document_id)
+            if document_chunk_ids is None:
+                document_chunk_ids = np.arange(len(embeddings), dtype="int64")
+            ids.append(make_vector_id(document_id, np.asarray(document_chunk_ids, dtype="int64")))
+            vectors.append(np.asarray(embeddings, dtype="float32"))
+        self._write_delta(ids, vectors, cleared=list(batch))
+
+    def update_document(
+        self,
+        document_id: int,
+        embeddings: np.ndarray,
+        chunk_ids: np.ndarray,
+        removed_chunk_ids: np.ndarray,
+    ) -> None:
+        # Add and remove individual chunks of an indexed document, keeping the rest
+        ids = [make_vector_id(document_id, np.asarray(chunk_ids, dtype="int64"))] if len(chunk_ids) else []
+        vectors = [np.asarray(embeddings, dtype="float32")] if len(chunk_ids) else []
+        removed = make_vector_id(document_id, np.asarray(removed_chunk_ids, dtype="int64"))
+        self._write_delta(ids, vectors, removed=removed)
+
+    def remove_document(self, document_id: int) -> None:
+        self._write_delta([], [], cleared=[document_id])
+
+    def merge(self, index_type: str = VECTOR_INDEX_TYPE, force: bool = False) -> bool:
+        """
+        Fold the current deltas into a new base index (re-training IVF if due,
+        or always with force). Concurrent writes are not blocked: deltas added
+        meanwhile stay pending. Returns False if another merge is running.
+        """
+        import faiss
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        lock = os.open(self.merge_lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if force else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+
+            manifest = self._read_manifest()
+            merged = [name for name, _ in manifest["deltas"]]
+            if not merged and not force:
+                return True
+
+            # Base (copied into memory so it can be modified) with the deltas applied
+            index = None
+            if manifest["base"]:
+                index = faiss.read_index(str(self.index_path.parent / manifest["base"]))
+            deltas = [_load_delta(self.delta_dir / name) for name in merged]
+            dead, live_ids, live_vectors = _apply_deltas(manifest["base_documents"], deltas)
+            if index is not None and len(dead):
+                _remove_ids(index, dead)
+            if len(live_ids):
+                if index is None:
+                    index = faiss.IndexIDMap2(faiss.IndexFlatIP(live_vectors.shape[1]))
+                index.add_with_ids(live_vectors, live_ids)
+            index, trained_on = _maybe_retrain(index, manifest["trained_on"], index_type, force)
+
+            base = None
+            if index is not None:
+                base = f"{self.index_path.stem}.{uuid.uuid4().hex}{self.index_path.suffix}"
+                tmp = self.index_path.parent / f"{base}.tmp"
+                faiss.write_index(index, str(tmp))
+                os.replace(tmp, self.index_path.parent / base)
+
+            # Publish; deltas written during the merge stay pending on top of the new base
+            with self._write_lock():
+                current = self._read_manifest()
+                old_base = current["base"]
+                current.update({
+                    "base": base,
+                    "kind": "ivf" if isinstance(index, faiss.IndexIVF) else "flat",
+                    "trained_on": trained_on,
+                    "base_documents": manifest["documents"],
+                    "deltas": current["deltas"][len(merged):],
+                })
+                _write_manifest(self.manifest_path, current)
+
+            # Readers that already loaded them keep their copies (memory-mapped or in RAM)
+            if old_base and old_base != base:
+                (self.index_path.parent / old_base).unlink(missing_ok=True)
+            for name in merged:
+                (self.delta_dir / name).unlink(missing_ok=True)
+            return True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            os.close(lock)
+
+    def requantize(self, index_type: str = VECTOR_INDEX_TYPE) -> None:
+        # Rebuild an IVF corpus index with index_type codes (flat corpora stay flat)
+        if self._current().kind == "ivf":
+            self.merge(index_type, force=True)
+
+    # --------------------------------------------------
+    # Reads
+    # --------------------------------------------------
+
+    def search(self, q_emb: np.ndarray, top_k: int, document_ids: list[int] | None = None):
+        """
+        Search the corpus with a normalized (1, d) query.
+        Returns [(document_id, chunk_index, similarity)] best first.
+        """
+        return self.search_many(q_emb, top_k, document_ids)[0]
+
+    def search_many(self, q_embs: np.ndarray, top_k: int, document_ids: list[int] | None = None):
+        # One search per index part for (n, d) queries; one result list per query
+        import faiss
+        view = self._current()
+        if view.ntotal == 0:
+            return [[] for _ in range(len(q_embs))]
+
+        document_filter = view.selector(document_ids)
+        if document_filter is False:
+            return [[] for _ in range(len(q_embs))]
+
+        batch = [[] for _ in range(len(q_embs))]
+        if view.base is not None and view.base.ntotal:
+            # Deleted base vectors are filtered out rather than removed
+            selector = document_filter
+            if view.dead is not None:
+                selector = view.dead if selector is None else _keep(faiss.IDSelectorAnd(selector, view.dead), selector, view.dead)
+            exact = is_exact(view.base)
+            depth = top_k if exact else top_k * VECTOR_RERANK_FACTOR
+            for row, results in enumerate(_search(view.base, q_embs, depth, selector)):
+                batch[row] = results if exact else _rerank(q_embs[row:row + 1], results)[:top_k]
+
+        if view.delta is not None:
+            for row, results in enumerate(_search(view.delta, q_embs, top_k, document_filter)):
+                if results:
+                    batch[row] = sorted(batch[row] + results, key=lambda hit: hit[2], reverse=True)[:top_k]
+        return batch
+
+    @property
+    def kind(self) -> str:
+        # "ivf" once the base index has switched to IVF, otherwise "flat"
+        return self._current().kind
+
+    def version(self) -> int | None:
+        # Changes on every write, from any process
+        try:
+            return self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def stats(self) -> dict:
+        view = self._current()
+        return {
+            "documents": len(view.documents),
+            "vectors": view.ntotal,
+            "type": "none" if view.base is None and view.delta is None else type(view.base or view.delta).__name__,
+            "deltas": len(view.deltas),
+        }
+
+    # --------------------------------------------------
+    # Internals
+    # --------------------------------------------------
+
+    @contextmanager
+    def _write_lock(self):
+        # Serialize writers across threads and worker processes
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _write_delta(self, ids: list[np.ndarray], vectors: list[np.ndarray], removed=None, cleared=()) -> None:
+        # Append one delta file and list it in the manifest
+        ids = np.concatenate(ids) if ids else np.empty(0, dtype="int64")
+        removed = np.empty(0, dtype="int64") if removed is None else np.asarray(removed, dtype="int64")
+        with self._write_lock():
+            manifest = self._read_manifest()
+            documents = manifest["documents"]
+            cleared = [d for d in cleared if str(d) in documents]
+            if not len(ids) and not len(removed) and not cleared:
+                return
+
+            self.delta_dir.mkdir(parents=True, exist_ok=True)
+            name = f"{uuid.uuid4().hex}.npz"
+            tmp = self.delta_dir / f"{name}.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    ids=ids,
+                    vectors=np.concatenate(vectors) if vectors else np.empty((0, 0), dtype="float32"),
+                    removed=removed,
+                    cleared=np.asarray(cleared, dtype="int64"),
+                )
+            os.replace(tmp, self.delta_dir / name)
+
+            # Document id bounds: every chunk_index of a document is below its bound
+            for document_id in cleared:
+                documents.pop(str(document_id), None)
+            for document_id in np.unique(ids >> 32):
+                bound = int((ids[ids >> 32 == document_id] & 0xFFFFFFFF).max()) + 1
+                documents[str(document_id)] = max(documents.get(str(document_id), 0), bound)
+
+            # Size in vectors added or deleted, which is what a merge has to apply
+            size = len(ids) + len(removed) + sum(manifest["base_documents"].get(str(d), 0) for d in cleared)
+            manifest["deltas"].append([name, size])
+            _write_manifest(self.manifest_path, manifest)
+
+        pending = manifest["deltas"]
+        if len(pending) > CORPUS_DELTA_MAX_FILES or sum(size for _, size in pending) > CORPUS_DELTA_MAX_VECTORS:
+            self._merge_in_background()
+
+    def _merge_in_background(self) -> None:
+        with self._lock:
+            if self._merging:
+                return
+            self._merging = True
+
+        def run():
+            try:
+                self.merge()
+            except Exception:
+                logger.exception("Corpus index merge failed")
+            finally:
+                self._merging = False
+
+        threading.Thread(target=run, name="corpus-merge", daemon=True).start()
+
+    def _current(self) -> "_View":
+        # The latest published view; loading a new one does not block searches on the old one
+        try:
+            mtime = self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return self._view
+        if mtime == self._view.mtime:
+            return self._view
+
+        with self._refresh_lock:
+            if mtime != self._view.mtime:
+                self._view = self._load_view()
+            return self._view
+
+    def _read_manifest(self) -> dict:
+        manifest = {}
+        try:
+            manifest = json.loads(self.manifest_path.read_text())
+        except FileNotFoundError:
+            pass
+        if "base" not in manifest and manifest.get("documents"):
+            # Written before deltas: one whole-corpus file at index_path
+            manifest.update({"base": self.index_path.name, "kind": "legacy", "base_documents": manifest["documents"]})
+        return _with_defaults(manifest)
+
+    def _load_view(self) -> "_View":
+        while True:
+            mtime = self.manifest_path.stat().st_mtime_ns
+            manifest = self._read_manifest()
+            try:
+                return _View.load(self, manifest, mtime, self._view)
+            except FileNotFoundError:
+                # Merged away between reading the manifest and the files; read it again
+                continue
+
+
+class _View:
+    """
+    One consistent read-only state of the corpus index: the base (memory-mapped),
+    a selector for its deleted ids and an exact index over the live delta vectors.
+    """
+
+    def __init__(self, manifest: dict, mtime, base, delta_state):
+        self.mtime = mtime
+        self.kind = "flat"
+        self.documents = manifest["documents"]
+        self.deltas = [name for name, _ in manifest["deltas"]]
+        self.base = base
+        self.base_name = manifest["base"]
+        self.delta_state = delta_state
+
+        ids, vectors, dead_ids = delta_state
+        self.delta = None
+        self.dead = None
+        # The empty view built at import time must not load faiss
+        if base is not None or len(ids) or len(dead_ids):
+            import faiss
+            if isinstance(base, faiss.IndexIVF):
+                self.kind = "ivf"
+            if len(ids):
+                self.delta = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+                self.delta.add_with_ids(vectors, ids)
+            if len(dead_ids):
+                batch = faiss.IDSelectorBatch(dead_ids)
+                self.dead = _keep(faiss.IDSelectorNot(batch), batch, dead_ids)
+        # Approximate: cleared documents count their whole id range as deleted
+        base_total = 0 if base is None else int(base.ntotal)
+        self.ntotal = max(base_total - len(dead_ids), 0) + len(ids)
+
+    @classmethod
+    def empty(cls) -> "_View":
+        return cls(_with_defaults({}), None, None, _empty_delta_state())
+
+    @classmethod
+    def load(cls, owner: CorpusIndex, manifest: dict, mtime, previous: "_View") -> "_View":
+        import faiss
+        directory = owner.index_path.parent
+
+        # The base is immutable under its name: reuse it when unchanged
+        base = previous.base if previous.base_name == manifest["base"] else None
+        if base is None and manifest["base"]:
+            # Memory-mapped: flat codes (where this FAISS build supports it) and IVF
+            # lists are paged in on demand, not copied
+            flags = {"ivf": faiss.IO_FLAG_MMAP, "flat": getattr(faiss, "IO_FLAG_MMAP_IFC", 0)}.get(manifest["kind"], 0)
+            path = directory / manifest["base"]
+            try:
+                base = faiss.read_index(str(path), flags)
+            except RuntimeError:
+                if path.exists():
+                    raise
+                raise FileNotFoundError(path)
+
+        # Only deltas added since the previous view are read, when it had the same base
+        names = [name for name, _ in manifest["deltas"]]
+        state, start = _empty_delta_state(), 0
+        if previous.base_name == manifest["base"] and names[:len(previous.deltas)] == previous.deltas:
+            state, start = previous.delta_state, len(previous.deltas)
+        deltas = [_load_delta(owner.delta_dir / name) for name in names[start:]]
+        state = _extend_delta_state(state, manifest["base_documents"], deltas)
+        return cls(manifest, mtime, base, state)
+
+    def selector(self, document_ids: list[int] | None):
+        import faiss
+        if document_ids is None:
+            return None
+
+        known = [d for d in set(document_ids) if str(d) in self.documents]
+        if not known:
+            return False
+
+        if len(known) <= _MAX_RANGE_FILTERS:
+            # Each document owns a contiguous id range
+            selector = None
+            for document_id in known:
+                r = faiss.IDSelectorRange(make_vector_id(document_id, 0), make_vector_id(document_id + 1, 0))
+                selector = r if selector is None else _keep(faiss.IDSelectorOr(selector, r), selector, r)
+            return selector
+
+        ids = np.concatenate([
+            make_vector_id(d, np.arange(self.documents[str(d)], dtype="int64")) for d in known
+        ])
+        return _keep(faiss.IDSelectorBatch(ids), ids)
+
+
+def _with_defaults(manifest: dict) -> dict:
+    # documents: id -> chunk id bound (every chunk_index is below it); base_documents:
+    # the same for the base alone; deltas: [name, size] in write order
+    manifest.setdefault("documents", {})
+    manifest.setdefault("trained_on", 0)
+    manifest.setdefault("base", None)
+    manifest.setdefault("kind", "flat")
+    manifest.setdefault("base_documents", {})
+    manifest.setdefault("deltas", [])
+    return manifest
+
+
+def _write_manifest(path: Path, manifest: dict) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(manifest))
+    os.replace(tmp, path)
+
+
+def _load_delta(path: Path) -> dict:
+    with np.load(path) as delta:
+        return {name: delta[name] for name in ("ids", "vectors", "removed", "cleared")}
+
+
+def _empty_delta_state():
+    # (live delta ids, their vectors, deleted base ids)
+    return np.empty(0, dtype="int64"), None, np.empty(0, dtype="int64")
+
+
+def _extend_delta_state(state, base_documents: dict, deltas: list[dict]):
+    # Replay deltas in order over (live delta ids, vectors, deleted base ids)
+    ids, vectors, dead = state
+    dead = [dead]
+    for delta in deltas:
+        cleared = delta["cleared"]
+        if len(ids):
+            keep = ~(np.isin(ids, delta["removed"]) | np.isin(ids >> 32, cleared))
+            ids, vectors = ids[keep], vectors[keep]
+        if len(delta["ids"]):
+            ids = np.concatenate([ids, delta["ids"]])
+            vectors = delta["vectors"] if vectors is None or not len(vectors) else np.concatenate([vectors, delta["vectors"]])
+
+        # Base copies of removed chunks and of cleared documents are dead
+        dead.append(_in_base(delta["removed"], base_documents))
+        dead.extend(
+            make_vector_id(int(d), np.arange(base_documents.get(str(int(d)), 0), dtype="int64")) for d in cleared
+        )
+    return ids, vectors, np.unique(np.concatenate(dead))
+
+
+def _in_base(ids: np.ndarray, base_documents: dict) -> np.ndarray:
+    # The ids within their document's base id range
+    if not len(ids):
+        return ids
+    bounds = np.array([base_documents.get(str(int(d)), 0) for d in ids >> 32], dtype="int64")
+    return ids[(ids & 0xFFFFFFFF) < bounds]
+
+
+def _apply_deltas(base_documents: dict, deltas: list[dict]):
+    # (deleted base ids, live delta ids, live delta vectors) of a sequence of deltas
+    ids, vectors, dead = _extend_delta_state(_empty_delta_state(), base_documents, deltas)
+    return dead, ids, vectors
+
+
+def _remove_ids(index, ids: np.ndarray) -> None:
+    # IDMap2 scans every stored id against the selector: use a hashed set, O(N + ids).
+    # The IVF hashtable direct map only accepts an id array, looked up one by one
+    import faiss
+    if isinstance(index, faiss.IndexIVF):
+        index.remove_ids(faiss.IDSelectorArray(ids))
+    else:
+        index.remove_ids(faiss.IDSelectorBatch(ids))
+
+
+def _search(index, q_embs: np.ndarray, depth: int, selector):
+    import faiss
+    if isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=CORPUS_NPROBE)
+    elif selector is not None:
+        params = faiss.SearchParameters(sel=selector)
+    else:
+        params = None
+    similarities, ids = index.search(q_embs, depth, params=params)
+
+    batch = []
+    for row in range(len(q_embs)):
+        results = []
+        for rank, vector_id in enumerate(ids[row]):
+            if vector_id == -1:
+                continue
+            document_id, chunk_index = split_vector_id(int(vector_id))
+            results.append((document_id, chunk_index, float(similarities[row][rank])))
+        batch.append(results)
+    return batch
+
+
+def _all_vectors(index) -> tuple[np.ndarray, np.ndarray]:
+    # Collect every (id, vector) currently stored, sorted by id
+    import faiss
+    if isinstance(index, faiss.IndexIDMap2):
+        vectors = index.index.reconstruct_n(0, index.ntotal)
+        ids = faiss.vector_to_array(index.id_map)
+        order = np.argsort(ids)
+        return ids[order], vectors[order]
+
+    invlists = index.invlists
+    ids = np.sort(np.concatenate([
+        faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+        for l in range(index.nlist)
+    ]))
+    vectors = index.reconstruct_batch(ids)
+    if not is_exact(index):
+        # Compressed codes only reconstruct approximately; prefer the float16 copies
+        from app.core.index_cache import index_cache
+        documents, chunks = ids >> 32, ids & 0xFFFFFFFF
+        for document_id in np.unique(documents):
+            stored = index_cache.vectors(int(document_id))
+            rows = documents == document_id
+            if stored is not None and chunks[rows].max() < len(stored):
+                vectors[rows] = stored[chunks[rows]]
+    return ids, vectors
+
+
+def _maybe_retrain(index, trained_on: int, index_type: str = VECTOR_INDEX_TYPE, force: bool = False):
+    # (index, trained_on) after switching to or re-training IVF when due
+    import faiss
+    n = 0 if index is None else index.ntotal
+    if n < CORPUS_IVF_MIN_VECTORS:
+        return index, trained_on
+    if trained_on and n < trained_on * _RETRAIN_GROWTH and not (force and isinstance(index, faiss.IndexIVF)):
+        return index, trained_on
+
+    ids, vectors = _all_vectors(index)
+    d = vectors.shape[1]
+
+    # ~4*sqrt(N) lists keeps both list scans and centroid search cheap
+    nlist = max(1, int(4 * math.sqrt(n)))
+    ivf = make_ivf_index(d, nlist, index_type)
+    ivf.train(vectors)
+    # Hashtable direct map allows reconstruct and exact-id removal by arbitrary ids
+    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+    ivf.add_with_ids(vectors, ids)
+    return ivf, n
+
+
+def _rerank(q_emb: np.ndarray, results: list[tuple[int, int, float]]) -> list[tuple[int, int, float]]:
+    # Replace approximate scores with exact ones from each document's float16 vectors
+    from app.core.index_cache import index_cache
+    by_document = {}
+    for position, (document_id, chunk_index, _) in enumerate(results):
+        by_document.setdefault(document_id, []).append((position, chunk_index))
+
+    reranked = list(results)
+    for document_id, hits in by_document.items():
+        vectors = index_cache.vectors(document_id)
+        if vectors is None:
+            continue
+        chunks = np.array([chunk_index for _, chunk_index in hits])
+        if chunks.max() >= len(vectors):
+            continue
+        scores = vectors[chunks].astype("float32") @ q_emb[0]
+        for (position, chunk_index), score in zip(hits, scores):
+            reranked[position] = (document_id, chunk_index, float(score))
+    return sorted(reranked, key=lambda hit: hit[2], reverse=True)
+
+
+def _keep(selector, *refs):
+    # FAISS selectors hold raw pointers; keep their Python referents alive
+    selector.refs = refs
+    return selector
+
+
+def rebuild_from_document_indexes() -> int:
+    """
+    Backfill the corpus index from existing per-document indexes.
+    Returns the number of documents added.
+    """
+    batch, chunk_ids = {}, {}
+    for snapshot in current_snapshots():
+        document_id = snapshot.document_id
+        with lease_snapshot(document_id) as snapshot:
+            chunk_ids[document_id], batch[document_id] = document_vectors(snapshot.index_path)
+
+    if batch:
+        corpus_index.add_documents(batch, chunk_ids)
+        corpus_index.merge(force=True)
+    return len(batch)
+
+
+# Process-wide corpus index
+corpus_index = CorpusIndex(CORPUS_INDEX_PATH, CORPUS_MANIFEST_PATH)
+
+
+if __name__ == "__main__":
+    print(f"Added {rebuild_from_document_indexes()} documents to the corpus index")
@@ -0,0 +1,310 @@
+"""
+Embedding backends behind one small interface (the subset of SentenceTransformer
+the agents use): encode(), get_sentence_embedding_dimension(), tokenizer and
+max_seq_length.
+
+  torch  SentenceTransformer under PyTorch (default)
+  onnx   ONNX Runtime, optionally int8-quantized; needs `pip install onnxruntime onnx`
+
+Workers on a node with an embedding sidecar use either one through it
+(SidecarBackend, see app/core/embedding_sidecar.py).
+
+    python -m app.core.embedding_backend --quantized   # parity + speed vs PyTorch
+"""
+import argparse
+import json
+import sys
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import (
+    CACHE_DIR,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_THREADS,
+    EMBEDDING_ONNX_QUANTIZED,
+    EMBEDDING_ONNX_PATH,
+)
+
+
+class EmbeddingBackend(ABC):
+    """
+    Interface shared by all backends. encode() returns float32 (n, d) embeddings
+    in input order; tokenizer is a Hugging Face (fast) tokenizer.
+    """
+
+    backend = ""
+    tokenizer = None
+    max_seq_length = 256
+
+    @property
+    def variant(self) -> str:
+        # Identifies which vectors this backend produces, e.g. for embedding cache keys
+        return self.backend
+
+    @abstractmethod
+    def encode(self, texts: list[str], batch_size: int | None = None, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        ...
+
+    @abstractmethod
+    def get_sentence_embedding_dimension(self) -> int:
+        ...
+
+
+class TorchBackend(EmbeddingBackend):
+    backend = "torch"
+
+    def __init__(self, name: str, batch_size: int = EMBEDDING_BATCH_SIZE, threads: int = EMBEDDING_THREADS):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads > 0:
+            # Process-wide: caps intra-op parallelism so workers don't oversubscribe cores
+            torch.set_num_threads(threads)
+
+        self.model = SentenceTransformer(name)
+        self.batch_size = batch_size
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False, **kwargs):
+        # SentenceTransformer already sorts each call by length before batching
+        return self.model.encode(
+            texts,
+            batch_size=batch_size or self.batch_size,
+            show_progress_bar=show_progress_bar,
+            convert_to_numpy=True,
+            **kwargs,
+        ).astype("float32", copy=False)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+
+def _repo_id(name: str) -> str:
+    # Bare names resolve to the sentence-transformers organization, as SentenceTransformer does
+    return name if "/" in name else f"sentence-transformers/{name}"
+
+
+class OnnxBackend(EmbeddingBackend):
+    """
+    Transformer forward pass in ONNX Runtime, then mean pooling and L2
+    normalization (the all-MiniLM-L6-v2 pipeline).
+
+    Texts are tokenized once, sorted by token length and packed into batches
+    of up to batch_size * max_seq_length tokens after padding, so short texts
+    run in large batches and long ones don't pad the rest.
+    """
+
+    backend = "onnx"
+
+    def __init__(
+        self,
+        name: str,
+        quantized: bool = EMBEDDING_ONNX_QUANTIZED,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        threads: int = EMBEDDING_THREADS,
+        model_path: str = EMBEDDING_ONNX_PATH,
+    ):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_BACKEND=onnx requires onnxruntime (pip install onnxruntime onnx)") from e
+        from transformers import AutoTokenizer
+
+        repo_id = _repo_id(name)
+        self.tokenizer = AutoTokenizer.from_pretrained(repo_id)
+        self.max_seq_length = _max_seq_length(repo_id, self.tokenizer)
+        self.batch_size = batch_size
+        self.quantized = quantized
+
+        path = Path(model_path) if model_path else _onnx_model_path(repo_id, quantized)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.inter_op_num_threads = 1
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        self._dimension = None
+
+    @property
+    def variant(self) -> str:
+        # int8 vectors drift from fp32 ones, so they must not share a cache namespace
+        return "onnx:int8" if self.quantized else "onnx"
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False, **kwargs):
+        texts = list(texts)
+        token_budget = (batch_size or self.batch_size) * self.max_seq_length
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension() if texts else 0), dtype="float32")
+        if not texts:
+            return embeddings
+
+        input_ids = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)["input_ids"]
+        # Longest first, so each batch's first row sets its padded length
+        order = sorted(range(len(texts)), key=lambda i: len(input_ids[i]), reverse=True)
+
+        start = 0
+        while start < len(order):
+            longest = len(input_ids[order[start]])
+            end = start + max(1, token_budget // max(longest, 1))
+            batch = order[start:end]
+            embeddings[batch] = self._run([input_ids[i] for i in batch], longest)
+            start = end
+
+        return embeddings
+
+    def _run(self, batch_ids: list[list[int]], length: int) -> np.ndarray:
+        ids = np.zeros((len(batch_ids), length), dtype="int64")
+        mask = np.zeros((len(batch_ids), length), dtype="int64")
+        for row, token_ids in enumerate(batch_ids):
+            ids[row, :len(token_ids)] = token_ids
+            mask[row, :len(token_ids)] = 1
+
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean over real tokens, then unit length
+        weights = mask[..., None].astype("float32")
+        pooled = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dimension is None:
+            token_ids = self.tokenizer("x")["input_ids"]
+            self._dimension = int(self._run([token_ids], len(token_ids)).shape[1])
+        return self._dimension
+
+
+def _max_seq_length(repo_id: str, tokenizer) -> int:
+    # sentence-transformers' own limit (256 for MiniLM), else the tokenizer's
+    from huggingface_hub import hf_hub_download
+
+    try:
+        config = json.loads(Path(hf_hub_download(repo_id, "sentence_bert_config.json")).read_text())
+        return int(config["max_seq_length"])
+    except Exception:
+        return min(tokenizer.model_max_length, 512)
+
+
+def _onnx_model_path(repo_id: str, quantized: bool) -> Path:
+    """
+    The model's published ONNX export; the int8 variant is produced once with
+    dynamic quantization and kept in the cache directory.
+    """
+    from huggingface_hub import hf_hub_download
+
+    fp32_path = Path(hf_hub_download(repo_id, "onnx/model.onnx"))
+    if not quantized:
+        return fp32_path
+
+    int8_path = CACHE_DIR / "onnx" / f"{repo_id.replace('/', '--')}-int8.onnx"
+    if not int8_path.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = int8_path.with_name(int8_path.name + ".tmp")
+        quantize_dynamic(str(fp32_path), str(tmp_path), weight_type=QuantType.QInt8)
+        tmp_path.replace(int8_path)
+    return int8_path
+
+
+def load_backend(name: str = EMBEDDING_MODEL_NAME, backend: str = EMBEDDING_BACKEND) -> EmbeddingBackend:
+    if backend == "torch":
+        return TorchBackend(name)
+    if backend == "onnx":
+        return OnnxBackend(name)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}; expected 'torch' or 'onnx'")
+
+
+# --------------------------------------------------
+# Parity check
+# --------------------------------------------------
+
+_SAMPLE_TEXTS = [
+    "The agreement may be terminated by either party with thirty days written notice.",
+    "Revenue grew 12% year over year, driven by subscription renewals.",
+    "Part AB-1234 must be replaced after 5,000 operating hours.",
+    "Section 4.2 describes the indemnification obligations of the supplier.",
+    "Short text.",
+]
+
+
+def _sample_texts(limit: int) -> list[str]:
+    # Real chunks from indexed documents when there are any
+    from app.core.chunk_store import ChunkStore
+    from app.core.index_snapshots import current_snapshots, lease_snapshot
+
+    texts = []
+    for snapshot in current_snapshots():
+        if not snapshot.store_path.exists():
+            continue
+        # Read under the lease so GC can't remove the snapshot's files meanwhile
+        with lease_snapshot(snapshot.document_id) as snapshot:
+            store = ChunkStore(snapshot.store_path)
+            try:
+                texts.extend(store.get_many(store.chunk_ids()[:limit - len(texts)]))
+            finally:
+                store.close()
+        if len(texts) >= limit:
+            break
+    return texts or _SAMPLE_TEXTS * max(1, limit // len(_SAMPLE_TEXTS))
+
+
+def _timed_encode(model: EmbeddingBackend, texts: list[str]) -> tuple[np.ndarray, float]:
+    model.encode(texts[:8])
+    started = time.perf_counter()
+    embeddings = model.encode(texts)
+    return embeddings, time.perf_counter() - started
+
+
+def parity(texts: list[str], quantized: bool) -> dict:
+    """
+    Cosine similarity between ONNX and PyTorch embeddings of the same texts,
+    plus encode throughput of each.
+    """
+    reference, torch_seconds = _timed_encode(TorchBackend(EMBEDDING_MODEL_NAME), texts)
+    candidate, onnx_seconds = _timed_encode(OnnxBackend(EMBEDDING_MODEL_NAME, quantized=quantized), texts)
+
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    cosine = (reference * candidate).sum(axis=1)
+    return {
+        "texts": len(texts),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "torch_texts_per_s": round(len(texts) / torch_seconds, 1),
+        "onnx_texts_per_s": round(len(texts) / onnx_seconds, 1),
+        "speedup": round(torch_seconds / onnx_seconds, 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantized", action="store_true", help="check the int8 model instead of fp32")
+    parser.add_argument("--texts", type=int, default=512, help="texts to encode (indexed chunks if available)")
+    parser.add_argument("--min-cosine", type=float, help="fail below this (default: 0.99 int8, 0.9999 fp32)")
+    args = parser.parse_args(argv)
+
+    result = parity(_sample_texts(args.texts), args.quantized)
+    threshold = args.min_cosine or (0.99 if args.quantized else 0.9999)
+    for key, value in result.items():
+        print(f"{key:<20}{value}")
+
+    if result["min_cosine"] < threshold:
+        print(f"FAIL: min cosine {result['min_cosine']:.5f} < {threshold}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES
+
+# Evict in batches so the cache isn't trimmed on every write
+_EVICT_SLACK = 0.05
+
+
+def _key(namespace: str, text: str) -> bytes:
+    # Embeddings depend on the model, its backend and the exact chunk text
+    return hashlib.sha1(f"{namespace}\x00{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model and backend variant, chunk-text hash).
+
+    Vectors are stored as float16 blobs in a small SQLite database, so shared
+    boilerplate and re-indexed documents only encode chunks never seen before.
+    Least recently used rows are evicted past max_entries.
+    """
+
+    def __init__(self, path: Path, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._conn = None
+        self._lock = threading.Lock()
+        # Upper-bound estimate of the row count, so writes don't scan the table
+        self._approx_rows = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # WAL lets API and worker processes read while one of them writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            self._approx_rows = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get_many(self, namespace: str, texts: list[str]) -> dict[int, np.ndarray]:
+        """
+        Look up cached vectors. Returns {position in texts: float32 vector} for hits.
+        """
+        keys = [_key(namespace, t) for t in texts]
+        found = {}
+
+        with self._lock:
+            conn = self._connect()
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ):
+                    found[key] = blob
+
+            if found:
+                now = int(time.time())
+                conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, k) for k in found],
+                )
+                conn.commit()
+
+        hits = {
+            i: np.frombuffer(found[k], dtype="float16").astype("float32")
+            for i, k in enumerate(keys)
+            if k in found
+        }
+        self.hits += len(hits)
+        self.misses += len(texts) - len(hits)
+        return hits
+
+    def put_many(self, namespace: str, texts: list[str], vectors: np.ndarray) -> None:
+        now = int(time.time())
+        rows = [
+            (_key(namespace, t), np.asarray(v, dtype="float16").tobytes(), now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            conn.commit()
+            # Replaced keys and other processes' writes make this approximate
+            self._approx_rows += len(rows)
+            if self._approx_rows > self.max_entries:
+                self._evict(conn)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        # Only count exactly once the estimate says the cache may be full
+        count = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._approx_rows = count
+        if count <= self.max_entries:
+            return
+        # Trim a little below the limit to amortize eviction
+        excess = count - int(self.max_entries * (1 - _EVICT_SLACK))
+        conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        conn.commit()
+        self._approx_rows = count - excess
+
+
+# Process-wide embedding cache
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
@@ -0,0 +1,465 @@
+"""
+Shared embedding sidecar: one process per node owns the embedding model and
+serves every API and job worker over a UNIX socket, instead of each worker
+loading its own copy.
+
+Concurrent encode requests (from any worker) that arrive within
+EMBEDDING_SIDECAR_WINDOW_MS of each other are run as one model batch of up to
+EMBEDDING_SIDECAR_MAX_BATCH texts, so single-question encodes under load share
+forward passes. Clients send large encodes in slices of at most that size, so
+a query encode waits for at most one bulk batch rather than a whole document.
+
+Workers get a SidecarBackend from get_embedding_model() whenever the socket
+answers, and load the model in-process otherwise; a sidecar that goes away
+later is also covered by an in-process fallback.
+
+    python -m app.core.embedding_sidecar                # serve EMBEDDING_MODEL_NAME
+    python -m app.core.embedding_sidecar --stats        # request/batch counters of a running sidecar
+
+Wire format: each message is a frame of (header length, payload length) as two
+big-endian uint32, a JSON header, then a raw payload (float32 embeddings in
+encode responses, empty otherwise).
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from app.core.config import (
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_SIDECAR_SOCKET,
+    EMBEDDING_SIDECAR_WINDOW_MS,
+    EMBEDDING_SIDECAR_MAX_BATCH,
+    EMBEDDING_SIDECAR_TIMEOUT_SECONDS,
+    EMBEDDING_SIDECAR_QUERY_TIMEOUT_SECONDS,
+)
+from app.core.embedding_backend import EmbeddingBackend, load_backend
+
+logger = logging.getLogger(__name__)
+
+_FRAME = struct.Struct("!II")
+
+# After a failed call, workers encode in-process for this long before trying the sidecar again
+_RETRY_SECONDS = 30.0
+
+# Encodes of at most this many texts (questions) use the query timeout
+_QUERY_MAX_TEXTS = 16
+
+
+def _send(sock: socket.socket, header: dict, payload: bytes = b"") -> None:
+    data = json.dumps(header).encode("utf-8")
+    sock.sendall(_FRAME.pack(len(data), len(payload)) + data + payload)
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytearray:
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError("Embedding sidecar connection closed")
+        view = view[received:]
+    return buffer
+
+
+def _recv(sock: socket.socket) -> tuple[dict, bytearray]:
+    header_size, payload_size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size).decode("utf-8"))
+    return header, _recv_exact(sock, payload_size)
+
+
+# --------------------------------------------------
+# Client
+# --------------------------------------------------
+
+class SidecarError(RuntimeError):
+    # The sidecar answered, but with an error (as opposed to being unreachable)
+    pass
+
+
+class SidecarTimeout(SidecarError):
+    # The sidecar is up but did not answer in time (overloaded); the call is not retried
+    pass
+
+
+class SidecarTokenizer:
+    """
+    The subset of a Hugging Face tokenizer the chunker uses (__call__ returning
+    input_ids), served by the sidecar so workers don't load transformers.
+    """
+
+    def __init__(self, backend: "SidecarBackend"):
+        self.backend = backend
+
+    def __call__(self, texts, add_special_tokens: bool = True, **kwargs) -> dict:
+        single = isinstance(texts, str)
+        input_ids = self.backend.tokenize([texts] if single else list(texts), add_special_tokens)
+        return {"input_ids": input_ids[0] if single else input_ids}
+
+
+class SidecarBackend(EmbeddingBackend):
+    """
+    Embedding backend that forwards to the node's sidecar. Each (process,
+    thread) keeps its own connection. If the sidecar becomes unreachable,
+    calls fall back to a model loaded in this process, and the sidecar is
+    retried after a while. A call that times out raises SidecarTimeout: the
+    sidecar is alive but busy, so neither a resend nor a local model would help.
+    """
+
+    backend = "sidecar"
+
+    def __init__(
+        self,
+        name: str,
+        socket_path: str = EMBEDDING_SIDECAR_SOCKET,
+        timeout: float = EMBEDDING_SIDECAR_TIMEOUT_SECONDS,
+        query_timeout: float = EMBEDDING_SIDECAR_QUERY_TIMEOUT_SECONDS,
+    ):
+        self.name = name
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.query_timeout = query_timeout
+        self._local = threading.local()
+        self._fallback: EmbeddingBackend | None = None
+        self._fallback_lock = threading.Lock()
+        self._retry_at = 0.0
+
+        # Raises OSError when no sidecar is listening, SidecarError when it doesn't serve this model
+        info, _ = self._call({"op": "info"}, query_timeout)
+        self.served_backend = info["backend"]
+        self.served_variant = info.get("variant", self.served_backend)
+        self.max_seq_length = info["max_seq_length"]
+        self.max_batch = info.get("max_batch", EMBEDDING_SIDECAR_MAX_BATCH)
+        self._dimension = info["dimension"]
+        self.tokenizer = SidecarTokenizer(self)
+
+    def encode(self, texts, batch_size=None, show_progress_bar=False, **kwargs) -> np.ndarray:
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self._dimension), dtype="float32")
+        timeout = self.query_timeout if len(texts) <= _QUERY_MAX_TEXTS else self.timeout
+        if time.monotonic() >= self._retry_at:
+            try:
+                # One request per slice, so other workers' queries get batched in between
+                parts = []
+                for start in range(0, len(texts), self.max_batch):
+                    header, payload = self._call({"op": "encode", "texts": texts[start:start + self.max_batch]}, timeout)
+                    parts.append(np.frombuffer(payload, dtype="float32").reshape(header["shape"]))
+                return parts[0] if len(parts) == 1 else np.concatenate(parts)
+            except OSError as e:
+                self._down(e)
+        return self._local_backend().encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar, **kwargs)
+
+    def tokenize(self, texts: list[str], add_special_tokens: bool = True) -> list[list[int]]:
+        if time.monotonic() >= self._retry_at:
+            try:
+                header, _ = self._call(
+                    {"op": "tokenize", "texts": texts, "add_special_tokens": add_special_tokens}, self.query_timeout
+                )
+                return header["input_ids"]
+            except OSError as e:
+                self._down(e)
+        tokenizer = self._local_backend().tokenizer
+        return tokenizer(texts, add_special_tokens=add_special_tokens, verbose=False)["input_ids"]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self._dimension
+
+    def _call(self, header: dict, timeout: float) -> tuple[dict, bytearray]:
+        header = {**header, "model": self.name}
+        # A kept connection may be stale (sidecar restarted): retry once on a fresh one.
+        # A timeout is never retried; the connection is dropped since its answer may still come
+        for attempt in (0, 1):
+            sock = self._connection()
+            sock.settimeout(timeout)
+            try:
+                _send(sock, header)
+                response, payload = _recv(sock)
+                break
+            except socket.timeout as e:
+                self._disconnect()
+                raise SidecarTimeout(f"Embedding sidecar did not answer within {timeout:g}s") from e
+            except OSError:
+                self._disconnect()
+                if attempt:
+                    raise
+        if "error" in response:
+            raise SidecarError(response["error"])
+        return response, payload
+
+    def _connection(self) -> socket.socket:
+        # Connections are per thread, and never shared with a forked child
+        sock = getattr(self._local, "sock", None)
+        if sock is not None and self._local.pid == os.getpid():
+            return sock
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.query_timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self._local.sock, self._local.pid = sock, os.getpid()
+        return sock
+
+    def _disconnect(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None and self._local.pid == os.getpid():
+            sock.close()
+        self._local.sock = None
+
+    def _down(self, error: Exception) -> None:
+        logger.warning("Embedding sidecar unavailable (%s); encoding in-process for %.0fs", error, _RETRY_SECONDS)
+        self._retry_at = time.monotonic() + _RETRY_SECONDS
+
+    def _local_backend(self) -> EmbeddingBackend:
+        if self._fallback is None:
+            with self._fallback_lock:
+                if self._fallback is None:
+                    self._fallback = load_backend(self.name)
+        return self._fallback
+
+
+def connect(name: str = EMBEDDING_MODEL_NAME, socket_path: str = EMBEDDING_SIDECAR_SOCKET) -> SidecarBackend | None:
+    """
+    A backend served by the node's sidecar, or None if no sidecar serves the
+    model (no socket configured, nothing listening, or another model).
+    """
+    if not socket_path or not os.path.exists(socket_path):
+        return None
+    try:
+        return SidecarBackend(name, socket_path)
+    except (OSError, SidecarError) as e:
+        logger.info("Embedding sidecar at %s not used: %s", socket_path, e)
+        return None
+
+
+# --------------------------------------------------
+# Server
+# --------------------------------------------------
+
+class _Request:
+    def __init__(self, texts: list[str]):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result: np.ndarray | None = None
+        self.error: Exception | None = None
+
+
+class MicroBatcher:
+    """
+    Runs one model's encode requests on a single thread, merging requests that
+    arrive within window_seconds of the first into one batch of up to
+    max_batch texts.
+    """
+
+    def __init__(self, model: EmbeddingBackend, window_seconds: float, max_batch: int):
+        self.model = model
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self._queue: queue.Queue[_Request] = queue.Queue()
+        # A request that would have overflowed the last batch; it opens the next one
+        self._carry: _Request | None = None
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        request = _Request(texts)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_texts": round(self.texts / self.batches, 1) if self.batches else 0.0,
+        }
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                embeddings = np.asarray(self.model.encode(texts, show_progress_bar=False), dtype="float32")
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+
+            self.requests += len(batch)
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for request in batch:
+                request.result = embeddings[start:start + len(request.texts)]
+                start += len(request.texts)
+                request.done.set()
+
+    def _collect(self) -> list[_Request]:
+        # Block for the first request, then take whatever else arrives within the window
+        batch = [self._carry or self._queue.get()]
+        self._carry = None
+        size = len(batch[0].texts)
+        deadline = time.monotonic() + self.window_seconds
+        while size < self.max_batch:
+            try:
+                request = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if size + len(request.texts) > self.max_batch:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    # One connection: requests are answered in order until the client disconnects
+
+    def handle(self) -> None:
+        while True:
+            try:
+                header, _ = _recv(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                response, payload = self.server.answer(header)
+            except Exception as e:
+                response, payload = {"error": f"{type(e).__name__}: {e}"}, b""
+            try:
+                _send(self.request, response, payload)
+            except OSError:
+                return
+
+
+class SidecarServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Every worker thread connects on its first encode; a short backlog would refuse a burst
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, socket_path: str, models: dict[str, EmbeddingBackend], window_seconds: float, max_batch: int):
+        self.models = models
+        self.batchers = {name: MicroBatcher(model, window_seconds, max_batch) for name, model in models.items()}
+        # Fast tokenizers must not be called from several threads at once
+        self._tokenizer_lock = threading.Lock()
+        super().__init__(socket_path, _Handler)
+
+    def answer(self, header: dict) -> tuple[dict, bytes]:
+        op = header.get("op")
+        if op == "stats":
+            return {"models": {name: batcher.stats() for name, batcher in self.batchers.items()}}, b""
+
+        name = header.get("model")
+        model = self.models.get(name)
+        if model is None:
+            raise ValueError(f"Model {name!r} is not served here")
+
+        if op == "info":
+            return {
+                "backend": model.backend,
+                "variant": model.variant,
+                "dimension": model.get_sentence_embedding_dimension(),
+                "max_seq_length": model.max_seq_length,
+                "max_batch": self.batchers[name].max_batch,
+            }, b""
+        if op == "encode":
+            embeddings = np.ascontiguousarray(self.batchers[name].encode(header["texts"]), dtype="float32")
+            return {"shape": list(embeddings.shape)}, embeddings.tobytes()
+        if op == "tokenize":
+            with self._tokenizer_lock:
+                encoded = model.tokenizer(header["texts"], add_special_tokens=header.get("add_special_tokens", True), verbose=False)
+            return {"input_ids": [list(ids) for ids in encoded["input_ids"]]}, b""
+        raise ValueError(f"Unknown op {op!r}")
+
+
+def serve(
+    names: list[str],
+    socket_path: str = EMBEDDING_SIDECAR_SOCKET,
+    window_ms: float = EMBEDDING_SIDECAR_WINDOW_MS,
+    max_batch: int = EMBEDDING_SIDECAR_MAX_BATCH,
+) -> None:
+    if not socket_path:
+        raise ValueError("EMBEDDING_SIDECAR_SOCKET is empty")
+    if _is_listening(socket_path):
+        raise ValueError(f"An embedding sidecar is already listening on {socket_path}")
+
+    # Load and warm every model before the socket appears, so workers never wait on a load
+    models = {}
+    for name in names:
+        models[name] = load_backend(name)
+        models[name].encode(["warmup"], show_progress_bar=False)
+
+    # A socket file left behind by a sidecar that died
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+
+    server = SidecarServer(socket_path, models, window_ms / 1000, max_batch)
+    logger.info("Embedding sidecar serving %s on %s", ", ".join(names), socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def _is_listening(socket_path: str) -> bool:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def stats(socket_path: str = EMBEDDING_SIDECAR_SOCKET) -> dict:
+    # Counters of a running sidecar
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(EMBEDDING_SIDECAR_TIMEOUT_SECONDS)
+        sock.connect(socket_path)
+        _send(sock, {"op": "stats"})
+        return _recv(sock)[0]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", action="append", help=f"model to serve, repeatable (default {EMBEDDING_MODEL_NAME})")
+    parser.add_argument("--socket", default=EMBEDDING_SIDECAR_SOCKET, help="UNIX socket path")
+    parser.add_argument("--window-ms", type=float, default=EMBEDDING_SIDECAR_WINDOW_MS, help="micro-batching window")
+    parser.add_argument("--max-batch", type=int, default=EMBEDDING_SIDECAR_MAX_BATCH, help="texts per model batch")
+    parser.add_argument("--stats", action="store_true", help="print a running sidecar's counters and exit")
+    args = parser.parse_args(argv)
+
+    if args.stats:
+        print(json.dumps(stats(args.socket), indent=2))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    serve(args.model or [EMBEDDING_MODEL_NAME], args.socket, args.window_ms, args.max_batch)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
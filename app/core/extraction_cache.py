@@ -0,0 +1,69 @@
+import os
+import threading
+from pathlib import Path
+
+from app.core.config import CACHE_DIR, EXTRACT_CACHE_MAX_BYTES
+from app.core.text_store import link_or_copy
+
+# Bump when extraction or cleaning changes so stale results are not reused
+EXTRACTION_VERSION = 1
+
+
+class ExtractionCache:
+    """
+    Extracted text artifacts keyed by the SHA-256 of the source file.
+    Byte-identical uploads skip PyMuPDF/OCR entirely. Entries share the
+    per-document artifact format (and usually its inode, via hard links);
+    least recently used entries are deleted past max_bytes.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, content_hash: str) -> Path:
+        return self.directory / f"{content_hash}.v{EXTRACTION_VERSION}.jsonl.gz"
+
+    def lookup(self, content_hash: str) -> Path | None:
+        path = self._path(content_hash)
+        try:
+            # Refresh mtime so eviction treats this entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, content_hash: str, artifact_path: Path) -> None:
+        # Register a freshly written document artifact under its content hash
+        link_or_copy(artifact_path, self._path(content_hash))
+        self._evict()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+        }
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = [(p.stat(), p) for p in self.directory.glob("*.jsonl.gz")]
+            total = sum(st.st_size for st, _ in entries)
+            if total <= self.max_bytes:
+                return
+            # Oldest first
+            for st, path in sorted(entries, key=lambda e: e[0].st_mtime):
+                path.unlink(missing_ok=True)
+                total -= st.st_size
+                if total <= self.max_bytes:
+                    break
+
+
+# Process-wide extraction cache
+extraction_cache = ExtractionCache(CACHE_DIR / "extract", EXTRACT_CACHE_MAX_BYTES)
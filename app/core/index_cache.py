@@ -0,0 +1,232 @@
+import json
+import threading
+from collections import OrderedDict
+
+from app.core.chunk_store import ChunkStore, write_chunk_store
+from app.core.index_snapshots import LEGACY_VERSION, Snapshot, current_snapshot, lease_snapshot
+from app.core.lexical_index import LexicalIndex
+from app.core.metrics import stage
+from app.core.vector_index import load_vectors
+from app.core.config import (
+    INDEX_DIR,
+    CHUNK_STORE_COMPRESS,
+    CHUNK_STORE_BLOCK_SIZE,
+    INDEX_CACHE_MAX_BYTES,
+    INDEX_CACHE_MAX_ENTRIES,
+    INDEX_MMAP_MIN_BYTES,
+)
+
+
+def open_chunk_store(document_id: int) -> ChunkStore:
+    """
+    Open the chunk store of a document's current snapshot.
+    """
+    with lease_snapshot(document_id) as snapshot:
+        _convert_legacy_map(snapshot)
+        return ChunkStore(snapshot.store_path)
+
+
+def _convert_legacy_map(snapshot: Snapshot) -> None:
+    # Pre-snapshot indexes may still have a {id}_map.json instead of a chunk store
+    if snapshot.version != LEGACY_VERSION or snapshot.store_path.exists():
+        return
+    legacy_map_path = INDEX_DIR / f"{snapshot.document_id}_map.json"
+    if not legacy_map_path.exists():
+        raise ValueError("Vector index not found. Please index the document first.")
+    mapping = json.loads(legacy_map_path.read_text())
+    texts = [mapping[str(i)]["text"] for i in range(len(mapping))]
+    write_chunk_store(snapshot.store_path, texts, CHUNK_STORE_COMPRESS, CHUNK_STORE_BLOCK_SIZE)
+    legacy_map_path.unlink(missing_ok=True)
+
+
+def index_version(document_id: int) -> str | None:
+    """
+    Version of the document's current index snapshot, or None if not indexed.
+    Changes whenever the index is rebuilt, including by another process.
+    """
+    snapshot = current_snapshot(document_id)
+    return None if snapshot is None else snapshot.version
+
+
+class IndexCache:
+    """
+    LRU cache of (FAISS index, chunk store, re-ranking vectors, BM25 index) keyed
+    by document_id, all loaded from one snapshot.
+
+    Entries are bounded by count and approximate bytes, and are reloaded once a
+    new snapshot is published. Each entry holds a lease on its snapshot until it
+    is replaced or evicted. Large indexes are memory-mapped so a cold load costs
+    page faults rather than a full copy.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int, mmap_min_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.mmap_min_bytes = mmap_min_bytes
+
+        self._entries: OrderedDict[int, dict] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, document_id: int):
+        # (index, store, vectors, lexical) of the document's current snapshot
+        snapshot = current_snapshot(document_id)
+        if snapshot is None:
+            self.invalidate(document_id)
+            raise ValueError("Vector index not found. Please index the document first.")
+
+        with self._lock:
+            entry = self._entries.get(document_id)
+            # Entries made by vectors() hold nothing else and are reloaded in full
+            if entry is not None and entry["version"] == snapshot.version and entry["index"] is not None:
+                self._entries.move_to_end(document_id)
+                self.hits += 1
+                return entry["index"], entry["store"], entry["vectors"], entry["lexical"]
+            self.misses += 1
+
+        # Load outside the lock so slow reads don't block hits for other documents
+        with stage("index_load"):
+            entry = self._load(document_id)
+        self._put(document_id, entry)
+
+        return entry["index"], entry["store"], entry["vectors"], entry["lexical"]
+
+    def vectors(self, document_id: int):
+        """
+        Memory-mapped float16 vectors of the document's current snapshot (row ==
+        chunk_index), or None. For corpus re-ranking: a document not cached yet
+        gets an entry holding only its leased vectors file, not its whole index.
+        """
+        snapshot = current_snapshot(document_id)
+        if snapshot is None:
+            self.invalidate(document_id)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(document_id)
+            if entry is not None and entry["version"] == snapshot.version:
+                self._entries.move_to_end(document_id)
+                self.hits += 1
+                return entry["vectors"]
+            self.misses += 1
+
+        try:
+            lease = lease_snapshot(document_id)
+        except ValueError:
+            return None
+        entry = {
+            "index": None,
+            "store": None,
+            "vectors": load_vectors(lease.snapshot.vectors_path),
+            "lexical": None,
+            "version": lease.snapshot.version,
+            "lease": lease,
+            "bytes": 0,
+        }
+        self._put(document_id, entry)
+        return entry["vectors"]
+
+    def invalidate(self, document_id: int) -> None:
+        # Drop a document's entry (and its lease), e.g. after it has been re-indexed
+        with self._lock:
+            released = [self._remove(document_id)]
+        _release(released)
+
+    def clear(self) -> None:
+        with self._lock:
+            released = list(self._entries.values())
+            self._entries.clear()
+            self._bytes = 0
+        _release(released)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _load(self, document_id: int) -> dict:
+        # Every file comes from the same leased snapshot, opened up front
+        import faiss
+        lease = lease_snapshot(document_id)
+        try:
+            snapshot = lease.snapshot
+            _convert_legacy_map(snapshot)
+            index_size = snapshot.index_path.stat().st_size
+            mmapped = index_size >= self.mmap_min_bytes
+
+            if mmapped:
+                # Memory-map flat codes too where this FAISS build supports it
+                flags = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+                index = faiss.read_index(str(snapshot.index_path), flags)
+            else:
+                index = faiss.read_index(str(snapshot.index_path))
+
+            # Chunk texts, float16 re-ranking vectors (compressed indexes only) and
+            # BM25 postings are always memory-mapped; only the offsets array is resident
+            store = ChunkStore(snapshot.store_path)
+            vectors = load_vectors(snapshot.vectors_path)
+            lexical = LexicalIndex(snapshot.lexical_path) if snapshot.lexical_path.exists() else None
+        except BaseException:
+            lease.release()
+            raise
+
+        # Mapped pages belong to the OS page cache, so only count what we copied
+        size = 8 * (len(store) + 1) + (0 if mmapped else index_size)
+
+        return {
+            "index": index,
+            "store": store,
+            "vectors": vectors,
+            "lexical": lexical,
+            "version": snapshot.version,
+            "lease": lease,
+            "bytes": size,
+        }
+
+    def _put(self, document_id: int, entry: dict) -> None:
+        with self._lock:
+            released = [self._remove(document_id)]
+            self._entries[document_id] = entry
+            self._bytes += entry["bytes"]
+            released += self._evict()
+        _release(released)
+
+    def _remove(self, document_id: int) -> dict | None:
+        entry = self._entries.pop(document_id, None)
+        if entry is not None:
+            self._bytes -= entry["bytes"]
+        return entry
+
+    def _evict(self) -> list[dict]:
+        # Evict least recently used entries, always keeping the newest one
+        evicted = []
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry["bytes"]
+            self.evictions += 1
+            evicted.append(entry)
+        return evicted
+
+
+def _release(entries: list[dict | None]) -> None:
+    # Give up entries' snapshot leases (outside the cache lock: it may delete files)
+    for entry in entries:
+        if entry is not None:
+            entry["lease"].release()
+
+
+# Process-wide cache shared by all QAAgent instances
+index_cache = IndexCache(INDEX_CACHE_MAX_BYTES, INDEX_CACHE_MAX_ENTRIES, INDEX_MMAP_MIN_BYTES)
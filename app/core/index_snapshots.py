@@ -0,0 +1,237 @@
+"""
+Versioned, immutable per-document index snapshots.
+
+Every build writes a complete set of index files (vector index, chunk store,
+BM25 and float16 vectors) into a new directory, INDEX_DIR/{document_id}/{version}/,
+and then publishes it by atomically replacing the document's CURRENT pointer
+file. Readers resolve the pointer once and use that snapshot throughout, so
+they never see a half-written file or an index and chunk store from different
+builds, and they keep serving the previous version until the flip.
+
+Readers hold a lease on the snapshot they use: a shared flock on its lease
+file. A superseded snapshot is deleted once its lease can be taken
+exclusively, i.e. when no reader in any process holds it any more.
+
+Documents indexed before snapshots keep their flat INDEX_DIR/{id}.* files
+(version "legacy") until their first rebuild.
+"""
+import fcntl
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from app.core.config import INDEX_DIR
+from app.core.text_store import link_or_copy
+
+LEGACY_VERSION = "legacy"
+
+_POINTER = "CURRENT"
+_LEASE = "lease"
+
+# Index files a snapshot may hold, all named after index_path
+_SUFFIXES = (".faiss", ".chunks", ".bm25", ".f16")
+
+
+class Snapshot:
+    """
+    One published (or in-progress) set of a document's index files. The chunk
+    store, BM25 and float16 files sit next to index_path with their own suffixes.
+    """
+
+    def __init__(self, document_id: int, version: str, index_path: Path, store_path: Path):
+        self.document_id = document_id
+        self.version = version
+        self.index_path = index_path
+        self.store_path = store_path
+
+    @property
+    def directory(self) -> Path:
+        return self.index_path.parent
+
+    @property
+    def lexical_path(self) -> Path:
+        return self.index_path.with_suffix(".bm25")
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.index_path.with_suffix(".f16")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Snapshot) and (self.document_id, self.version) == (other.document_id, other.version)
+
+    def __repr__(self) -> str:
+        return f"Snapshot({self.document_id}, {self.version!r})"
+
+
+def document_dir(document_id: int) -> Path:
+    return INDEX_DIR / str(document_id)
+
+
+def _snapshot(document_id: int, version: str) -> Snapshot:
+    directory = document_dir(document_id) / version
+    return Snapshot(document_id, version, directory / "index.faiss", directory / "index.chunks")
+
+
+def _legacy(document_id: int) -> Snapshot:
+    return Snapshot(document_id, LEGACY_VERSION, INDEX_DIR / f"{document_id}.faiss", INDEX_DIR / f"{document_id}.chunks")
+
+
+def current_snapshot(document_id: int) -> Snapshot | None:
+    # The published snapshot of a document (or its pre-snapshot files), None if never indexed
+    try:
+        version = (document_dir(document_id) / _POINTER).read_text().strip()
+    except FileNotFoundError:
+        legacy = _legacy(document_id)
+        return legacy if legacy.index_path.exists() else None
+    return _snapshot(document_id, version)
+
+
+def current_snapshots() -> list[Snapshot]:
+    # Published snapshots of every indexed document, by document id
+    document_ids = {int(p.name) for p in INDEX_DIR.glob("*") if p.is_dir() and p.name.isdigit()}
+    document_ids |= {int(p.stem) for p in INDEX_DIR.glob("*.faiss") if p.stem.isdigit()}
+    return [s for s in map(current_snapshot, sorted(document_ids)) if s is not None]
+
+
+class Lease:
+    """
+    A reader's hold on a snapshot: its files are not deleted until released.
+    Files opened (memory-mapped) under a lease stay readable after release.
+    """
+
+    def __init__(self, snapshot: Snapshot, fd: int | None):
+        self.snapshot = snapshot
+        self._fd = fd
+
+    def release(self) -> None:
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+        # This may have been the last reader of a superseded snapshot
+        collect_garbage(self.snapshot.document_id)
+
+    def __enter__(self) -> Snapshot:
+        return self.snapshot
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def lease_snapshot(document_id: int) -> Lease:
+    """
+    Lease the current snapshot of a document.
+    Raises ValueError if the document has never been indexed.
+    """
+    while True:
+        snapshot = current_snapshot(document_id)
+        if snapshot is None:
+            raise ValueError("Vector index not found. Please index the document first.")
+        if snapshot.version == LEGACY_VERSION:
+            return Lease(snapshot, None)
+
+        try:
+            fd = os.open(snapshot.directory / _LEASE, os.O_RDONLY)
+        except FileNotFoundError:
+            fd = None
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            # Collected while we waited for the lock: the lease file is gone
+            if (snapshot.directory / _LEASE).exists():
+                return Lease(snapshot, fd)
+            os.close(fd)
+
+        # Superseded between reading the pointer and leasing it; read the pointer again
+        if current_snapshot(document_id) == snapshot:
+            raise ValueError("Vector index not found. Please re-index the document.")
+
+
+@contextmanager
+def index_snapshot(document_id: int) -> Iterator[Snapshot]:
+    """
+    A new, empty snapshot to write a document's index files into. It becomes
+    the current snapshot when the block completes, and is deleted if it raises.
+    Callers commit the matching database rows inside the block, so the snapshot
+    is only published once they are durable.
+    """
+    version = f"{time.time_ns():020d}-{os.getpid()}"
+    snapshot = _snapshot(document_id, version)
+    snapshot.directory.mkdir(parents=True)
+
+    # The builder leases its own snapshot so garbage collection leaves it alone;
+    # the lease file only appears under its final name once it is locked
+    tmp_lease = snapshot.directory / f"{_LEASE}.tmp"
+    fd = os.open(tmp_lease, os.O_CREAT | os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    os.replace(tmp_lease, snapshot.directory / _LEASE)
+
+    try:
+        yield snapshot
+        _publish(snapshot)
+    except BaseException:
+        shutil.rmtree(snapshot.directory, ignore_errors=True)
+        raise
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    collect_garbage(document_id)
+
+
+def _publish(snapshot: Snapshot) -> None:
+    # Atomically point the document at the snapshot
+    pointer = document_dir(snapshot.document_id) / _POINTER
+    tmp = pointer.with_name(f"{_POINTER}.{snapshot.version}.tmp")
+    tmp.write_text(snapshot.version)
+    os.replace(tmp, pointer)
+
+
+def link_files(source: Snapshot, target: Snapshot, *suffixes: str) -> None:
+    # Snapshot files never change, so a new snapshot shares unchanged ones by hard link
+    for suffix in suffixes:
+        path = source.index_path.with_suffix(suffix)
+        if path.exists():
+            link_or_copy(path, target.index_path.with_suffix(suffix))
+
+
+def collect_garbage(document_id: int) -> int:
+    """
+    Delete a document's superseded snapshots that no reader holds (and its
+    pre-snapshot files once a snapshot is published). Returns the number of
+    snapshots deleted.
+    """
+    current = current_snapshot(document_id)
+    if current is None or current.version == LEGACY_VERSION:
+        return 0
+
+    deleted = 0
+    for directory in document_dir(document_id).iterdir():
+        if not directory.is_dir() or directory.name == current.version:
+            continue
+        try:
+            fd = os.open(directory / _LEASE, os.O_RDONLY)
+        except FileNotFoundError:
+            # Still being created, or already being deleted
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        try:
+            # Drop the lease file first, so readers queued on it re-read the pointer
+            (directory / _LEASE).unlink(missing_ok=True)
+            shutil.rmtree(directory, ignore_errors=True)
+            deleted += 1
+        finally:
+            os.close(fd)
+
+    legacy = _legacy(document_id)
+    for suffix in _SUFFIXES:
+        legacy.index_path.with_suffix(suffix).unlink(missing_ok=True)
+    (INDEX_DIR / f"{document_id}_map.json").unlink(missing_ok=True)
+    return deleted
@@ -0,0 +1,660 @@
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import uuid
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from app.core.config import CORPUS_LEXICAL_DIR, LEXICAL_MERGE_FACTOR, LEXICAL_MAX_DEAD
+from app.core.index_snapshots import current_snapshots, index_snapshot, lease_snapshot, link_files
+from app.core.corpus_index import make_vector_id, split_vector_id
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Reciprocal-rank fusion constant (Cormack et al.)
+RRF_K = 60
+
+# Header: magic, version, flags, docs, terms, postings, total document length (tokens)
+_HEADER = struct.Struct("<4sHHIIQd")
+_MAGIC = b"BM25"
+_VERSION = 1
+
+# Identifiers such as "12.3(b)", "AB-1234" or "v2/api" stay whole; their parts are indexed too
+_TOKEN = re.compile(r"[a-z0-9]+(?:[._/\-][a-z0-9]+)*")
+_TOKEN_PARTS = re.compile(r"[._/\-]")
+
+_STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have in is it its of on or that the their "
+    "there these this to was were what when where which who will with does do did how".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(p for p in _TOKEN_PARTS.split(token) if p and p not in _STOPWORDS)
+    return tokens
+
+
+@lru_cache(maxsize=200_000)
+def term_hash(term: str) -> int:
+    # Stable 64-bit term id (Python's hash() is salted per process)
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def write_lexical_index(path: Path, token_lists: list[list[str]], ids) -> int:
+    """
+    Write an inverted index over token lists (one per chunk), atomically.
+
+    Layout after the header, each array 8-byte aligned:
+      term hashes uint64[terms] (sorted), posting offsets uint64[terms + 1],
+      posting rows uint32[postings], term frequencies uint16[postings],
+      document lengths uint32[docs], external ids int64[docs]
+    Returns the number of postings.
+    """
+    postings = PostingsBuilder()
+    for tokens in token_lists:
+        postings.add(tokens)
+    return postings.write(path, ids)
+
+
+class PostingsBuilder:
+    """
+    Postings accumulated one chunk at a time in compact arrays (14 bytes per
+    distinct term per chunk), so a large document's token lists never have to
+    be held at once. write() produces the write_lexical_index layout.
+    """
+
+    def __init__(self):
+        self.hashes = array("Q")
+        self.rows = array("I")
+        self.tfs = array("H")
+        self.lengths = array("I")
+
+    def add(self, tokens: list[str]) -> None:
+        row = len(self.lengths)
+        self.lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self.hashes.append(term_hash(term))
+            self.rows.append(row)
+            self.tfs.append(min(tf, 0xFFFF))
+
+    @classmethod
+    def from_index(cls, index: "LexicalIndex", removed_ids) -> tuple["PostingsBuilder", np.ndarray]:
+        """
+        Postings of an existing index without the rows whose external ids are in
+        removed_ids, renumbered densely, so a document can be updated without
+        re-tokenizing its unchanged chunks. Returns (builder, kept external ids).
+        """
+        live = ~np.isin(index.ids, np.asarray(removed_ids, dtype="<i8"))
+        new_row = np.cumsum(live) - 1
+        row_terms = np.repeat(index.terms, np.diff(index.offsets).astype("int64"))
+        keep = live[index.rows]
+
+        postings = cls()
+        postings.hashes.frombytes(np.ascontiguousarray(row_terms[keep], dtype="<u8").tobytes())
+        postings.rows.frombytes(new_row[index.rows[keep]].astype("<u4").tobytes())
+        postings.tfs.frombytes(np.ascontiguousarray(index.tfs[keep], dtype="<u2").tobytes())
+        postings.lengths.frombytes(np.ascontiguousarray(index.lengths[live], dtype="<u4").tobytes())
+        return postings, index.ids[live].astype("int64")
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    @property
+    def total_length(self) -> int:
+        return sum(self.lengths)
+
+    def write(self, path: Path, ids) -> int:
+        # ids: external id per chunk, in add() order
+        return _write_arrays(
+            path,
+            np.array(self.hashes, dtype="<u8"),
+            np.array(self.rows, dtype="<u4"),
+            np.array(self.tfs, dtype="<u2"),
+            np.array(self.lengths, dtype="<u4"),
+            np.asarray(ids, dtype="<i8"),
+        )
+
+
+def _write_arrays(path: Path, hashes, rows, tfs, lengths, ids) -> int:
+    # Sort postings by (term, row) and lay them out term by term
+    order = np.lexsort((rows, hashes))
+    hashes, rows, tfs = hashes[order], rows[order], tfs[order]
+    terms, starts = np.unique(hashes, return_index=True)
+    offsets = np.append(starts, len(hashes)).astype("<u8")
+
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, 0, len(lengths), len(terms), len(rows), float(lengths.sum())))
+        for array in (terms, offsets, rows, tfs, lengths, ids):
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp, path)
+    return len(rows)
+
+
+class LexicalIndex:
+    """
+    Read-only, memory-mapped BM25 inverted index (one per document, or one
+    corpus segment). Looking up a term is a binary search over sorted term
+    hashes; its postings are contiguous slices of the row and tf arrays.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _, docs, terms, postings, total_length = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Not a lexical index: {path}")
+
+        self.docs = docs
+        self.total_length = total_length
+
+        pos = _HEADER.size
+        arrays = []
+        for dtype, count in (("<u8", terms), ("<u8", terms + 1), ("<u4", postings),
+                             ("<u2", postings), ("<u4", docs), ("<i8", docs)):
+            pos = _align(pos)
+            arrays.append(np.frombuffer(self._mm, dtype=dtype, count=count, offset=pos))
+            pos += arrays[-1].nbytes
+        self.terms, self.offsets, self.rows, self.tfs, self.lengths, self.ids = arrays
+
+    def postings(self, h: int) -> tuple[np.ndarray, np.ndarray]:
+        i = int(np.searchsorted(self.terms, np.uint64(h)))
+        if i == len(self.terms) or int(self.terms[i]) != h:
+            return self.rows[:0], self.tfs[:0]
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.rows[start:end], self.tfs[start:end]
+
+    def document_frequency(self, h: int) -> int:
+        return len(self.postings(h)[0])
+
+    def score(self, query_hashes: dict[int, float], avgdl: float) -> tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 scores for every row matching any query term, given per-term idf.
+        Returns (rows, scores); work is proportional to the postings touched.
+        """
+        all_rows, all_scores = [], []
+        for h, idf in query_hashes.items():
+            rows, tfs = self.postings(h)
+            if not len(rows):
+                continue
+            tf = tfs.astype("float32")
+            norm = K1 * (1 - B + B * self.lengths[rows] / avgdl)
+            all_rows.append(rows)
+            all_scores.append(idf * tf * (K1 + 1) / (tf + norm))
+
+        if not all_rows:
+            return np.empty(0, dtype="<u4"), np.empty(0, dtype="float32")
+
+        rows = np.concatenate(all_rows)
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        return unique_rows, np.bincount(inverse, weights=np.concatenate(all_scores)).astype("float32")
+
+    def search(self, query: str, top_k: int) -> list[tuple[int, float]]:
+        # [(external id, score)] best first, using this index's own statistics
+        hashes = {term_hash(t) for t in tokenize(query)}
+        idf = {h: _idf(self.docs, self.document_frequency(h)) for h in hashes}
+        rows, scores = self.score(idf, self.total_length / max(self.docs, 1))
+        best = _top(scores, top_k)
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in best]
+
+    def close(self) -> None:
+        self.terms = self.offsets = self.rows = self.tfs = self.lengths = self.ids = None
+        self._mm.close()
+
+
+def _idf(docs: int, df: int) -> float:
+    return math.log(1 + (docs - df + 0.5) / (df + 0.5))
+
+
+def _top(scores: np.ndarray, top_k: int) -> np.ndarray:
+    # Indices of the top_k scores, best first
+    if len(scores) > top_k:
+        candidates = np.argpartition(-scores, top_k)[:top_k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def reciprocal_rank_fusion(*rankings: list, k: int = RRF_K) -> list[tuple[object, float]]:
+    """
+    Merge ranked lists of keys; each key scores sum(1 / (k + rank)) over the
+    lists it appears in. Returns [(key, score)] best first.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class CorpusLexicalIndex:
+    """
+    BM25 over every indexed document, stored as immutable segments.
+
+    Each write adds a segment holding the written chunks (external id = corpus
+    vector id). A document lives in the segments its manifest entry lists: a
+    re-indexed document in its newest segment only, an incrementally updated
+    one also in the segments of its unchanged chunks, with its removed chunks
+    tombstoned. Rows of documents a segment is no longer listed for, and
+    tombstoned rows, are skipped at query time. Segments of similar size are
+    merged once LEXICAL_MERGE_FACTOR accumulate, so the segment count stays
+    logarithmic in corpus size, and a segment whose dead rows pass
+    LEXICAL_MAX_DEAD is rewritten without them.
+    """
+
+    def __init__(self, directory: Path, merge_factor: int, max_dead: float = LEXICAL_MAX_DEAD):
+        self.directory = directory
+        self.manifest_path = directory / "manifest.json"
+        self.lock_path = directory / "manifest.lock"
+        self.merge_factor = merge_factor
+        self.max_dead = max_dead
+
+        # segments: name -> rows; documents: id -> [segments, chunks, total length, removed chunk ids]
+        self._manifest = {"segments": {}, "documents": {}}
+        self._loaded_mtime = None
+        self._segments: dict[str, LexicalIndex] = {}
+        # segment -> (document ids not listed for it, tombstoned external ids)
+        self._stale: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        self._lock = threading.RLock()
+
+    # --------------------------------------------------
+    # Writes
+    # --------------------------------------------------
+
+    def add_documents(self, batch: dict[int, list[list[str]]], chunk_ids: dict[int, list[int]] | None = None) -> None:
+        """
+        Index (or replace) documents given their chunks' tokens (see tokenize),
+        one list per chunk_index in chunk_ids (default: 0, 1, 2, ...).
+        """
+        postings, ids, totals = PostingsBuilder(), [], {}
+        for document_id, tokens in batch.items():
+            for chunk_tokens in tokens:
+                postings.add(chunk_tokens)
+            document_chunk_ids = (chunk_ids or {}).get(document_id)
+            if document_chunk_ids is None:
+                document_chunk_ids = range(len(tokens))
+            ids.extend(make_vector_id(document_id, int(i)) for i in document_chunk_ids)
+            totals[document_id] = (len(tokens), sum(map(len, tokens)))
+
+        self._add_segment(postings, ids, totals)
+
+    def add_postings(self, document_id: int, postings: PostingsBuilder, chunk_ids=None) -> None:
+        # Index (or replace) one document from postings built chunk by chunk;
+        # chunk_ids (one per row) default to the row numbers
+        if chunk_ids is None:
+            chunk_ids = np.arange(len(postings), dtype="int64")
+        ids = make_vector_id(document_id, np.asarray(chunk_ids, dtype="int64"))
+        self._add_segment(postings, ids, {document_id: (len(postings), postings.total_length)})
+
+    def update_postings(
+        self,
+        document_id: int,
+        added: PostingsBuilder,
+        added_ids,
+        removed_ids,
+        postings: PostingsBuilder,
+        chunk_ids,
+    ) -> None:
+        """
+        Apply a chunk diff to an indexed document: only the added chunks'
+        postings are written (as a new segment) and the removed chunks are
+        tombstoned where they are. postings/chunk_ids describe the whole updated
+        document; they give its new totals, and are indexed in full instead if
+        the document is not in the corpus index yet.
+        """
+        with self._write_lock():
+            document = self._manifest["documents"].get(str(document_id))
+            if document is None:
+                self._write_segment(postings, make_vector_id(document_id, np.asarray(chunk_ids, dtype="int64")),
+                                    {document_id: (len(postings), postings.total_length)})
+            else:
+                name = None
+                if len(added):
+                    name = f"{uuid.uuid4().hex}.bm25"
+                    added.write(self.directory / name, make_vector_id(document_id, np.asarray(added_ids, dtype="int64")))
+                    self._manifest["segments"][name] = len(added)
+                if len(postings):
+                    segments, _, _, removed = document
+                    removed = sorted(set(removed) | {int(i) for i in removed_ids})
+                    self._manifest["documents"][str(document_id)] = [
+                        segments + [name] if name else segments, len(postings), postings.total_length, removed,
+                    ]
+                else:
+                    self._manifest["documents"].pop(str(document_id))
+            self._maybe_merge()
+            self._save()
+
+    def _add_segment(self, postings: PostingsBuilder, ids, totals: dict[int, tuple[int, int]]) -> None:
+        with self._write_lock():
+            self._write_segment(postings, ids, totals)
+            self._maybe_merge()
+            self._save()
+
+    def _write_segment(self, postings: PostingsBuilder, ids, totals: dict[int, tuple[int, int]]) -> None:
+        # Write the postings as one new segment and point each document at it alone
+        name = None
+        if len(postings):
+            name = f"{uuid.uuid4().hex}.bm25"
+            postings.write(self.directory / name, ids)
+            self._manifest["segments"][name] = len(postings)
+
+        for document_id, (chunks, length) in totals.items():
+            if chunks:
+                self._manifest["documents"][str(document_id)] = [[name], chunks, length, []]
+            else:
+                self._manifest["documents"].pop(str(document_id), None)
+
+    def add_document(self, document_id: int, tokens: list[list[str]]) -> None:
+        self.add_documents({document_id: tokens})
+
+    def remove_document(self, document_id: int) -> None:
+        with self._write_lock():
+            if self._manifest["documents"].pop(str(document_id), None) is not None:
+                self._save()
+
+    # --------------------------------------------------
+    # Reads
+    # --------------------------------------------------
+
+    def search(self, query: str, top_k: int, document_ids: list[int] | None = None):
+        """
+        BM25 search across the corpus. Returns [(document_id, chunk_index, score)] best first.
+        """
+        with self._lock:
+            self._refresh()
+            documents = self._manifest["documents"]
+            if not documents:
+                return []
+
+            live_docs = sum(d[1] for d in documents.values())
+            avgdl = sum(d[2] for d in documents.values()) / max(live_docs, 1)
+            segments = list(self._segments.items())
+            stale = dict(self._stale)
+
+        wanted = None
+        if document_ids is not None:
+            wanted = np.array(sorted({d for d in document_ids if str(d) in documents}), dtype="<i8")
+            if not len(wanted):
+                return []
+
+        # Corpus-wide document frequencies (dead rows count until their segment is rewritten)
+        hashes = {term_hash(t) for t in tokenize(query)}
+        idf = {
+            h: _idf(live_docs, min(live_docs, sum(seg.document_frequency(h) for _, seg in segments)))
+            for h in hashes
+        }
+
+        ids, scores = [], []
+        for name, segment in segments:
+            rows, row_scores = segment.score(idf, avgdl)
+            if not len(rows):
+                continue
+            row_ids = segment.ids[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            owners = row_ids >> 32
+            stale_documents, removed = stale.get(name, (_NONE, _NONE))
+            if len(stale_documents):
+                keep &= ~np.isin(owners, stale_documents)
+            if len(removed):
+                keep &= ~np.isin(row_ids, removed)
+            if wanted is not None:
+                keep &= np.isin(owners, wanted)
+            ids.append(row_ids[keep])
+            scores.append(row_scores[keep])
+
+        if not ids:
+            return []
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        results = []
+        for i in _top(scores, top_k):
+            document_id, chunk_index = split_vector_id(int(ids[i]))
+            results.append((document_id, chunk_index, float(scores[i])))
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {
+                "documents": len(self._manifest["documents"]),
+                "segments": len(self._manifest["segments"]),
+                "rows": sum(self._manifest["segments"].values()),
+            }
+
+    # --------------------------------------------------
+    # Internals
+    # --------------------------------------------------
+
+    @contextmanager
+    def _write_lock(self):
+        # Serialize writers across threads and worker processes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self._refresh(locked=True)
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _refresh(self, locked: bool = False) -> None:
+        # Reload the manifest (and open new segments) after writes from any process
+        try:
+            mtime = self.manifest_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+
+        fd = None if locked else os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+            manifest = _upgrade_manifest(json.loads(self.manifest_path.read_text()))
+            segments = {
+                name: self._segments.get(name) or LexicalIndex(self.directory / name)
+                for name in manifest["segments"]
+            }
+            self._loaded_mtime = self.manifest_path.stat().st_mtime_ns
+        finally:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+        self._manifest = manifest
+        self._segments = segments
+        self._stale = self._stale_rows()
+
+    def _stale_rows(self) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+        # Per segment, the documents it holds that now live elsewhere (or nowhere),
+        # and the external ids of tombstoned rows of the documents it is still listed for
+        stale = {}
+        documents = self._manifest["documents"]
+        for name, segment in self._segments.items():
+            present = np.unique(segment.ids >> 32)
+            dead, removed = [], []
+            for d in present:
+                document = documents.get(str(int(d)))
+                if document is None or name not in document[0]:
+                    dead.append(int(d))
+                elif document[3]:
+                    removed.append(make_vector_id(int(d), np.asarray(document[3], dtype="int64")))
+            if dead or removed:
+                stale[name] = (
+                    np.array(dead, dtype="<i8"),
+                    np.concatenate(removed).astype("<i8") if removed else _NONE,
+                )
+        return stale
+
+    def _dead_rows(self, name: str) -> np.ndarray:
+        # Mask of a segment's rows that no longer count
+        segment = self._segments[name]
+        stale_documents, removed = self._stale.get(name, (_NONE, _NONE))
+        return np.isin(segment.ids >> 32, stale_documents) | np.isin(segment.ids, removed)
+
+    def _save(self) -> None:
+        tmp = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        tmp.write_text(json.dumps(self._manifest))
+        os.replace(tmp, self.manifest_path)
+
+        # Delete segments no longer referenced (readers keep their mmaps until they refresh)
+        referenced = set(self._manifest["segments"])
+        for path in self.directory.glob("*.bm25"):
+            if path.name not in referenced:
+                path.unlink(missing_ok=True)
+
+        self._loaded_mtime = None
+        self._refresh(locked=True)
+
+    def _maybe_merge(self) -> None:
+        # Merge segments whose rows are within the same power of merge_factor,
+        # and rewrite segments that are mostly dead rows
+        self._segments = {
+            name: self._segments.get(name) or LexicalIndex(self.directory / name)
+            for name in self._manifest["segments"]
+        }
+        self._stale = self._stale_rows()
+
+        # Drop segments with no live documents at all
+        live_segments = {name for d in self._manifest["documents"].values() for name in d[0]}
+        for name in list(self._manifest["segments"]):
+            if name not in live_segments:
+                del self._manifest["segments"][name]
+
+        compact = [
+            name for name, rows in self._manifest["segments"].items()
+            if name in self._stale and self._dead_rows(name).sum() > self.max_dead * rows
+        ]
+
+        tiers: dict[int, list[str]] = {}
+        for name, rows in self._manifest["segments"].items():
+            tiers.setdefault(int(math.log(max(rows, 1), self.merge_factor)), []).append(name)
+
+        for names in tiers.values():
+            if len(names) >= self.merge_factor:
+                self._merge(names)
+        for name in compact:
+            if name in self._manifest["segments"]:
+                self._merge([name])
+
+    def _merge(self, names: list[str]) -> None:
+        # Rewrite the live postings of one or more segments as one segment
+        parts = []
+        for name in names:
+            segment = self._segments[name]
+            row_terms = np.repeat(segment.terms, np.diff(segment.offsets).astype("int64"))
+            parts.append((segment, row_terms, ~self._dead_rows(name)))
+
+        hashes, rows, tfs, lengths, ids = [], [], [], [], []
+        base = 0
+        for segment, row_terms, live in parts:
+            # Renumber live rows densely after the rows of earlier segments
+            new_row = np.cumsum(live) - 1 + base
+            keep = live[segment.rows]
+            hashes.append(row_terms[keep])
+            rows.append(new_row[segment.rows[keep]].astype("<u4"))
+            tfs.append(segment.tfs[keep])
+            lengths.append(segment.lengths[live])
+            ids.append(segment.ids[live])
+            base += int(live.sum())
+
+        name = f"{uuid.uuid4().hex}.bm25"
+        _write_arrays(
+            self.directory / name,
+            np.concatenate(hashes), np.concatenate(rows), np.concatenate(tfs),
+            np.concatenate(lengths), np.concatenate(ids),
+        )
+
+        merged = set(names)
+        for document in self._manifest["documents"].values():
+            if merged.isdisjoint(document[0]):
+                continue
+            kept = [segment for segment in document[0] if segment not in merged]
+            document[0] = kept + [name]
+            # Tombstoned rows were left out; none remain once all its segments are rewritten
+            if not kept:
+                document[3] = []
+        for old in names:
+            del self._manifest["segments"][old]
+        self._manifest["segments"][name] = base
+
+
+_NONE = np.empty(0, dtype="<i8")
+
+
+def _upgrade_manifest(manifest: dict) -> dict:
+    # Manifests from before incremental updates: documents -> [segment, chunks, total length]
+    for document in manifest["documents"].values():
+        if not isinstance(document[0], list):
+            document[0] = [] if document[0] is None else [document[0]]
+        if len(document) < 4:
+            document.append([])
+    return manifest
+
+
+def rebuild_from_chunk_stores() -> int:
+    """
+    Backfill per-document BM25 files and the corpus segments from existing chunk stores.
+    Each document gets a new snapshot sharing its other index files. Only chunks
+    still in the document's vector index are indexed (removed chunks may keep
+    their slot in the store). Returns the number of documents indexed.
+    """
+    import faiss
+    from app.core.chunk_store import ChunkStore
+    from app.core.vector_index import vector_ids
+
+    batch, chunk_ids = {}, {}
+    for current in current_snapshots():
+        if not current.store_path.exists():
+            continue
+        document_id = current.document_id
+        with lease_snapshot(document_id) as current, index_snapshot(document_id) as snapshot:
+            store = ChunkStore(current.store_path)
+            try:
+                ids = np.sort(vector_ids(faiss.read_index(str(current.index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)))
+                chunks = store.get_many(ids)
+            finally:
+                store.close()
+            tokens = [tokenize(chunk) for chunk in chunks]
+            link_files(current, snapshot, ".faiss", ".chunks", ".f16")
+            write_lexical_index(snapshot.lexical_path, tokens, ids)
+        batch[document_id], chunk_ids[document_id] = tokens, ids
+
+    if batch:
+        corpus_lexical_index.add_documents(batch, chunk_ids)
+    return len(batch)
+
+
+# Process-wide corpus lexical index
+corpus_lexical_index = CorpusLexicalIndex(CORPUS_LEXICAL_DIR, LEXICAL_MERGE_FACTOR)
+
+
+if __name__ == "__main__":
+    print(f"Built lexical indexes for {rebuild_from_chunk_stores()} documents")
@@ -0,0 +1,378 @@
+import atexit
+import fcntl
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.core.config import METRICS_DIR, METRICS_FLUSH_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets (seconds): sub-millisecond searches up to multi-minute extractions
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000)
+
+# Per-request stage breakdown; set by the timing middleware, None otherwise
+_request_timings: ContextVar[dict | None] = ContextVar("request_timings", default=None)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        registry.ensure_flushing()
+        # Strings, as they come back from other processes' files
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def snapshot(self) -> dict[tuple, object]:
+        with self._lock:
+            return {key: _copy(value) for key, value in self._values.items()}
+
+    def render(self, values: dict[tuple, object] | None = None) -> list[str]:
+        # values: samples to render, default this process's own
+        return self.header() + self._samples(self.snapshot() if values is None else values)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    @staticmethod
+    def combine(a: float, b: float) -> float:
+        return a + b
+
+    def _samples(self, values: dict) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., sum, count]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @staticmethod
+    def combine(a: list, b: list) -> list:
+        return [x + y for x, y in zip(a, b)]
+
+    def _samples(self, values: dict) -> list[str]:
+        lines = []
+        for key, state in values.items():
+            for bound, count in zip(self.buckets + (math.inf,), state[:len(self.buckets)] + [state[-1]]):
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+class Registry:
+    """
+    Process-wide set of metrics plus collectors that report values owned elsewhere
+    (e.g. cache hit counters) at scrape time.
+
+    Counters and histograms are aggregated across the node's processes: each
+    process that records anything writes its values to its own file in
+    directory every METRICS_FLUSH_SECONDS (and at exit), and render() sums every
+    file with the live values of the calling process. Files of exited processes
+    are folded into one archive file, so totals survive restarts without the
+    directory growing. Collector values (caches) stay per process.
+    """
+
+    def __init__(self, directory=METRICS_DIR, flush_seconds: float = METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._metrics: list[_Metric] = []
+        self._collectors = []
+        self._pid = None
+        self._token = None
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics.append(metric)
+
+    @property
+    def _path(self):
+        return self.directory / f"{socket.gethostname()}__{os.getpid()}__{self._token}.json"
+
+    def ensure_flushing(self) -> None:
+        # Start this process's flusher on its first observation (again after a fork)
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # Distinguishes this process from an earlier one that had the same pid
+            self._token = time.time_ns()
+            threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+            atexit.register(self.flush)
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def flush(self) -> None:
+        # Write this process's values for other processes' scrapes
+        if self._pid != os.getpid():
+            return
+        data = {metric.name: [[list(key), value] for key, value in metric.snapshot().items()] for metric in self._metrics}
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            tmp = self._path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", self.directory, e)
+
+    def _aggregate(self) -> dict[str, dict[tuple, object]]:
+        # Values of every metric summed over this process (live) and every other process's file
+        totals = {metric.name: metric.snapshot() for metric in self._metrics}
+        own = self._path.name if self._pid == os.getpid() else None
+        for data in self._read_files(exclude=own):
+            _merge(self._metrics, totals, data)
+        return totals
+
+    def _read_files(self, exclude: str | None) -> list[dict]:
+        if not self.directory.is_dir():
+            return []
+        lock = os.open(self.directory / "archive.lock", os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = self.directory / "archive.json"
+            archive = _load(archive_path) or {}
+            files, exited = [], []
+            for path in self.directory.glob("*__*.json"):
+                if path.name == exclude:
+                    continue
+                data = _load(path)
+                if data is None:
+                    continue
+                if _exited(path.name):
+                    exited.append(path)
+                    archive = _merge_files(self._metrics, archive, data)
+                else:
+                    files.append(data)
+
+            # Fold exited processes into the archive so their totals are kept once
+            if exited:
+                tmp = archive_path.with_suffix(".tmp")
+                tmp.write_text(json.dumps(archive))
+                os.replace(tmp, archive_path)
+                for path in exited:
+                    path.unlink(missing_ok=True)
+            return files + [archive]
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            os.close(lock)
+
+    def register_collector(self, collector) -> None:
+        """
+        collector() returns [(name, type, help, [(labels_dict, value), ...]), ...].
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        totals = self._aggregate()
+        for metric in self._metrics:
+            lines.extend(metric.render(totals[metric.name]))
+        for collector in self._collectors:
+            for name, type_name, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _load(path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _exited(name: str) -> bool:
+    # Whether the process that wrote a file named host__pid__token.json has exited
+    host, pid, _ = name.split("__", 2)
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        pass
+    return False
+
+
+def _merge(metrics: list[_Metric], totals: dict, data: dict) -> None:
+    # Add one file's samples into totals ({name: {label tuple: value}})
+    for metric in metrics:
+        values = totals[metric.name]
+        for key, value in data.get(metric.name, []):
+            key = tuple(key)
+            values[key] = value if key not in values else metric.combine(values[key], value)
+
+
+def _merge_files(metrics: list[_Metric], a: dict, b: dict) -> dict:
+    totals = {metric.name: {tuple(key): value for key, value in a.get(metric.name, [])} for metric in metrics}
+    _merge(metrics, totals, b)
+    return {name: [[list(key), value] for key, value in values.items()] for name, values in totals.items()}
+
+
+registry = Registry()
+
+# --------------------------------------------------
+# Metrics
+# --------------------------------------------------
+
+STAGE_SECONDS = Histogram(
+    "docai_stage_seconds", "Time spent in each pipeline stage.", ("stage",)
+)
+EXTRACT_SECONDS_PER_PAGE = Histogram(
+    "docai_extract_seconds_per_page", "Text extraction time per page.", ("file_type",)
+)
+CHUNKS_PER_DOCUMENT = Histogram(
+    "docai_chunks_per_document", "Chunks produced per indexed document.", buckets=COUNT_BUCKETS
+)
+EMBED_BATCH_SECONDS = Histogram(
+    "docai_embed_batch_seconds", "Embedding model encode() call time.", ("source",)
+)
+EMBED_TEXTS = Counter(
+    "docai_embed_texts_total", "Texts encoded by the embedding model.", ("source",)
+)
+SEARCH_SECONDS = Histogram(
+    "docai_search_seconds", "Vector search time by scope and top_k bucket (top_k <= label).", ("scope", "top_k")
+)
+LLM_SECONDS = Histogram(
+    "docai_llm_seconds", "LLM completion time (full stream for streaming calls).", ("mode",)
+)
+LLM_TOKENS = Counter(
+    "docai_llm_tokens_total", "LLM tokens reported by the API.", ("kind",)
+)
+LLM_ERRORS = Counter(
+    "docai_llm_errors_total", "Failed LLM calls.", ("mode",)
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "docai_http_request_seconds", "HTTP request latency.", ("method", "route", "status")
+)
+
+
+def top_k_label(top_k: int) -> str:
+    # Bucket top_k so arbitrary client values can't create unbounded label sets
+    for bound in (1, 5, 10, 20, 50, 100):
+        if top_k <= bound:
+            return str(bound)
+    return "+Inf"
+
+
+class _Timer:
+    seconds = 0.0
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block into docai_stage_seconds{stage=name} and the current request's
+    breakdown. The yielded timer's .seconds is set on exit for extra observations.
+    """
+    timer = _Timer()
+    started = time.perf_counter()
+    try:
+        yield timer
+    finally:
+        timer.seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(timer.seconds, stage=name)
+        record_timing(name, timer.seconds)
+
+
+def record_timing(name: str, seconds: float) -> None:
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+def start_request_timing():
+    # Begin collecting a stage breakdown for the current request; returns (timings, token)
+    timings = {}
+    return timings, _request_timings.set(timings)
+
+
+def stop_request_timing(token) -> None:
+    _request_timings.reset(token)
+
+
+def server_timing_header(timings: dict) -> str:
+    # Server-Timing header value, durations in milliseconds
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
@@ -0,0 +1,110 @@
+import logging
+import os
+import resource
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from app.core.config import EMBEDDING_MODEL_NAME
+from app.core.embedding_backend import EmbeddingBackend, load_backend
+from app.core.embedding_sidecar import connect as connect_sidecar
+from app.core.metrics import stage
+
+if TYPE_CHECKING:
+    from openai import OpenAI, AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Loaded models keyed by name, shared by every agent in this process
+_models: dict[str, EmbeddingBackend] = {}
+_model_stats: dict[str, dict] = {}
+# The openai package takes ~1s to import, so clients are created (and imported) on first use
+_openai_client: "OpenAI | None" = None
+_async_openai_client: "AsyncOpenAI | None" = None
+
+# Guards model loading; encode() itself is safe to call from many threads
+_lock = threading.Lock()
+
+
+def _rss_bytes() -> int:
+    # Current resident set size (Linux), falling back to peak RSS elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_embedding_model(name: str = EMBEDDING_MODEL_NAME) -> EmbeddingBackend:
+    """
+    Return the process-wide instance of an embedding model: the node's embedding
+    sidecar when one serves it, otherwise the model loaded on first use with the
+    configured EMBEDDING_BACKEND.
+    """
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _lock:
+        # Another thread may have finished loading while we waited
+        model = _models.get(name)
+        if model is not None:
+            return model
+
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        with stage("model_load"):
+            model = connect_sidecar(name) or load_backend(name)
+        load_seconds = time.perf_counter() - started
+        rss_delta = _rss_bytes() - rss_before
+
+        _model_stats[name] = {
+            "backend": model.backend,
+            "load_seconds": round(load_seconds, 3),
+            "rss_delta_bytes": rss_delta,
+        }
+        logger.info(
+            "Loaded embedding model %s (%s) in %.2fs (+%.1f MB RSS)",
+            name, model.backend, load_seconds, rss_delta / (1024 * 1024),
+        )
+
+        _models[name] = model
+        return model
+
+
+def get_openai_client() -> "OpenAI":
+    # One client per process so HTTP connections are pooled across requests
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _openai_client
+
+
+def get_async_openai_client() -> "AsyncOpenAI":
+    # Async client for streaming endpoints; reuses its connection pool on the event loop
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _lock:
+            if _async_openai_client is None:
+                from openai import AsyncOpenAI
+                _async_openai_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _async_openai_client
+
+
+def warmup(names: tuple[str, ...] = (EMBEDDING_MODEL_NAME,)) -> None:
+    """
+    Load models and run one encode so the first request pays no initialization cost.
+    """
+    for name in names:
+        get_embedding_model(name).encode(["warmup"], show_progress_bar=False)
+
+
+def model_stats() -> dict:
+    # Load time and memory footprint of every loaded model
+    return {
+        "models": dict(_model_stats),
+        "rss_bytes": _rss_bytes(),
+    }
@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """
+    Startup warmup steps run in a background thread, so the server binds its port
+    (and answers /health) before models and caches are loaded. GET /ready
+    reports each step as pending, ready or failed.
+    """
+
+    def __init__(self):
+        self._steps: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, steps: list[tuple[str, callable]]) -> None:
+        # Run steps in order; a failed step is recorded and the rest still run
+        with self._lock:
+            for name, _ in steps:
+                self._steps[name] = {"status": "pending", "seconds": None, "error": None}
+        self._thread = threading.Thread(target=self._run, args=(steps,), name="warmup", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        # Block until warmup has finished (for tests and scripts); True if it did
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.status()["ready"]
+
+    def status(self) -> dict:
+        with self._lock:
+            steps = {name: dict(state) for name, state in self._steps.items()}
+        return {
+            "ready": bool(steps) and all(s["status"] == "ready" for s in steps.values()),
+            "steps": steps,
+        }
+
+    def _run(self, steps) -> None:
+        for name, step in steps:
+            started = time.perf_counter()
+            try:
+                step()
+                state = {"status": "ready", "error": None}
+            except Exception as e:
+                logger.exception("Warmup step %s failed", name)
+                state = {"status": "failed", "error": str(e)}
+            state["seconds"] = round(time.perf_counter() - started, 3)
+            with self._lock:
+                self._steps[name] = state
+
+
+# Process-wide startup state
+readiness = Readiness()
@@ -0,0 +1,56 @@
+import gzip
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from app.core.config import TEXT_DIR
+
+
+def text_path(document_id: int) -> Path:
+    return TEXT_DIR / f"{document_id}.jsonl.gz"
+
+
+def write_pages(path: Path, pages: Iterable[tuple[int, str]]) -> tuple[int, int]:
+    """
+    Write (page_number, text) pairs as gzip'd JSON lines, atomically.
+    Accepts any iterable so pages can be written as they are extracted.
+    Returns (pages, characters) written.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    count = chars = 0
+    try:
+        with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as f:
+            for page_number, text in pages:
+                f.write(json.dumps({"page": page_number, "text": text}, ensure_ascii=False))
+                f.write("\n")
+                count += 1
+                chars += len(text)
+    except BaseException:
+        # A streamed extraction can fail part way through
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    return count, chars
+
+
+def iter_pages(path: Path) -> Iterator[tuple[int, str]]:
+    # Stream pages back one at a time; memory stays at one page
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            yield record["page"], record["text"]
+
+
+def link_or_copy(src: Path, dest: Path) -> None:
+    # Artifacts are immutable once written, so a hard link is as good as a copy
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
@@ -0,0 +1,470 @@
+"""
+Per-document vector indexes: flat, 8-bit scalar quantized or IVF-PQ.
+
+Indexes are ID-mapped: a vector's id is its chunk's stable chunk_index, so
+chunks can be added and removed without renumbering (update_document_index).
+
+Compressed indexes are searched with over-fetch: VECTOR_RERANK_FACTOR x top_k
+candidates come from the compressed codes and are re-scored exactly against
+float16 copies of the vectors kept next to the index (index.f16 in the
+document's snapshot, memory-mapped).
+
+    python -m app.core.vector_index recall --top-k 10   # recall vs memory on stored vectors
+    python -m app.core.vector_index migrate --type sq8  # convert existing indexes (as new snapshots)
+"""
+import argparse
+import math
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.core.index_snapshots import current_snapshots, index_snapshot, lease_snapshot, link_files
+from app.core.config import (
+    VECTOR_INDEX_TYPE,
+    VECTOR_RERANK_FACTOR,
+    VECTOR_PQ_M,
+    VECTOR_PQ_NBITS,
+    VECTOR_NPROBE,
+    VECTOR_IVFPQ_MIN_VECTORS,
+)
+
+INDEX_TYPES = ("flat", "sq8", "ivfpq")
+
+
+def vectors_path(index_path: Path) -> Path:
+    # float16 re-ranking vectors stored next to a compressed index
+    return index_path.with_suffix(".f16")
+
+
+def _check_type(index_type: str) -> None:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+
+
+def _nlist(n: int) -> int:
+    # ~4*sqrt(N) lists, as for the corpus IVF index
+    return max(1, int(4 * math.sqrt(n)))
+
+
+def _pq_m(d: int) -> int:
+    # Largest sub-quantizer count <= VECTOR_PQ_M that divides the dimension
+    m = min(VECTOR_PQ_M, d)
+    while d % m:
+        m -= 1
+    return m
+
+
+def make_ivf_index(d: int, nlist: int, index_type: str):
+    """
+    Untrained inner-product IVF index storing flat, sq8 or PQ codes in its lists.
+    """
+    import faiss
+    _check_type(index_type)
+    quantizer = faiss.IndexFlatIP(d)
+    if index_type == "flat":
+        return faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "sq8":
+        return faiss.IndexIVFScalarQuantizer(
+            quantizer, d, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
+    return faiss.IndexIVFPQ(quantizer, d, nlist, _pq_m(d), VECTOR_PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+
+
+def effective_type(n: int, index_type: str, min_pq_vectors: int = VECTOR_IVFPQ_MIN_VECTORS) -> str:
+    # IVF-PQ falls back to sq8 below min_pq_vectors, where its codebooks can't be trained well
+    _check_type(index_type)
+    if n == 0:
+        return "flat"
+    if index_type == "ivfpq" and n < max(min_pq_vectors, 2 ** VECTOR_PQ_NBITS):
+        return "sq8"
+    return index_type
+
+
+def build_vector_index(
+    embeddings: np.ndarray,
+    index_type: str = VECTOR_INDEX_TYPE,
+    min_pq_vectors: int = VECTOR_IVFPQ_MIN_VECTORS,
+    ids: np.ndarray | None = None,
+):
+    """
+    Train (if needed) and fill an ID-mapped index of the given type with normalized
+    float32 embeddings. ids (one per row) default to the row numbers.
+    """
+    import faiss
+    n, d = embeddings.shape
+    index_type = effective_type(n, index_type, min_pq_vectors)
+
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(d)
+    elif index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(embeddings)
+    else:
+        index = make_ivf_index(d, _nlist(n), "ivfpq")
+        index.train(embeddings)
+        index.nprobe = VECTOR_NPROBE
+
+    index = faiss.IndexIDMap2(index)
+    index.add_with_ids(embeddings, np.arange(n, dtype="int64") if ids is None else np.asarray(ids, dtype="int64"))
+    return index
+
+
+def base_index(index):
+    # The index under an id map (indexes built before ids were stable have none)
+    import faiss
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def vector_ids(index) -> np.ndarray:
+    # Stored ids in storage order; without an id map they are the row numbers
+    import faiss
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype("int64")
+    return np.arange(index.ntotal, dtype="int64")
+
+
+def is_exact(index) -> bool:
+    # Flat codes score exactly; quantized codes need re-ranking
+    import faiss
+    return isinstance(base_index(index), (faiss.IndexFlat, faiss.IndexIVFFlat))
+
+
+# Rows converted per step when writing vectors, so memory-mapped input is never copied whole
+_WRITE_BLOCK_ROWS = 65536
+
+
+def write_vectors(path: Path, *parts: np.ndarray) -> None:
+    # Write float16 re-ranking vectors (.npy layout, so they can be memory-mapped),
+    # row == vector id; parts are concatenated (e.g. existing rows, then new ones)
+    tmp_path = path.with_name(path.name + ".tmp")
+    shape = (sum(len(part) for part in parts), parts[0].shape[1])
+    with open(tmp_path, "wb") as f:
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype("float16")), "fortran_order": False, "shape": shape}
+        np.lib.format.write_array_header_1_0(f, header)
+        for part in parts:
+            for start in range(0, len(part), _WRITE_BLOCK_ROWS):
+                f.write(np.asarray(part[start:start + _WRITE_BLOCK_ROWS], dtype="float16").tobytes())
+    os.replace(tmp_path, path)
+
+
+class VectorSpill:
+    """
+    Float32 embeddings appended batch by batch to a scratch file and read back
+    memory-mapped, for documents too large to hold all their embeddings in
+    memory. Building indexes from the mapped array (build_vector_index,
+    write_vectors, corpus adds) reads it without copying it whole.
+    """
+
+    def __init__(self, path: Path, dimension: int):
+        self.path = path
+        self.dimension = dimension
+        self.rows = 0
+        self._file = open(path, "wb")
+
+    def add(self, embeddings: np.ndarray) -> None:
+        self._file.write(np.ascontiguousarray(embeddings, dtype="float32").tobytes())
+        self.rows += len(embeddings)
+
+    def open(self) -> np.ndarray:
+        # Everything added so far as a read-only (rows, dimension) array
+        self._file.flush()
+        if not self.rows:
+            return np.empty((0, self.dimension), dtype="float32")
+        return np.memmap(self.path, dtype="float32", mode="r", shape=(self.rows, self.dimension))
+
+    def discard(self) -> None:
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+def load_vectors(path: Path) -> np.ndarray | None:
+    # Memory-mapped float16 vectors, or None if the index has none
+    try:
+        return np.load(path, mmap_mode="r")
+    except FileNotFoundError:
+        return None
+
+
+def rerank(q_emb: np.ndarray, candidates: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    # Exact inner products of candidate rows against a (1, d) query
+    return vectors[candidates].astype("float32") @ q_emb[0]
+
+
+def search_index(index, q_emb: np.ndarray, top_k: int, vectors: np.ndarray | None = None, rerank_factor: int = VECTOR_RERANK_FACTOR):
+    """
+    index.search for any index type and (n, d) queries, returning (scores, ids) of
+    shape (n, top_k), padded with -1 ids. Compressed indexes with vectors over-fetch
+    and re-rank exactly.
+    """
+    import faiss
+    params = faiss.SearchParametersIVF(nprobe=VECTOR_NPROBE) if isinstance(base_index(index), faiss.IndexIVF) else None
+    if vectors is None or is_exact(index):
+        return index.search(q_emb, top_k, params=params)
+
+    _, ids = index.search(q_emb, top_k * rerank_factor, params=params)
+    scores = np.full((len(ids), top_k), -np.inf, dtype="float32")
+    reranked = np.full((len(ids), top_k), -1, dtype="int64")
+    for row, row_ids in enumerate(ids):
+        candidates = row_ids[row_ids != -1]
+        exact = rerank(q_emb[row:row + 1], candidates, vectors)
+        order = np.argsort(-exact, kind="stable")[:top_k]
+        scores[row, :len(order)] = exact[order]
+        reranked[row, :len(order)] = candidates[order]
+    return scores, reranked
+
+
+def document_vectors(index_path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (ids, float32 vectors) of a stored index: vectors come from its float16 copy
+    when present, otherwise reconstructed from the index codes (exact for flat indexes).
+    """
+    import faiss
+    index = faiss.read_index(str(index_path))
+    ids = vector_ids(index)
+    vectors = load_vectors(vectors_path(index_path))
+    if vectors is not None:
+        return ids, np.asarray(vectors[ids], dtype="float32")
+    return ids, base_index(index).reconstruct_n(0, index.ntotal)
+
+
+def write_document_index(
+    index_path: Path,
+    embeddings: np.ndarray,
+    index_type: str = VECTOR_INDEX_TYPE,
+    ids: np.ndarray | None = None,
+):
+    """
+    Build and persist a document index (write then rename, so a partial file is
+    never left under the final name). Compressed indexes also get their float16
+    vectors. ids (one per row) default to the row numbers.
+    """
+    index = build_vector_index(embeddings, index_type, ids=ids)
+
+    f16_path = vectors_path(index_path)
+    if is_exact(index):
+        f16_path.unlink(missing_ok=True)
+    elif ids is None:
+        write_vectors(f16_path, embeddings)
+    else:
+        # Rows of ids no longer in use stay zero
+        rows = np.zeros((int(ids.max()) + 1 if len(ids) else 0, embeddings.shape[1]), dtype="float16")
+        rows[ids] = embeddings
+        write_vectors(f16_path, rows)
+
+    _write_index(index, index_path)
+    return index
+
+
+def is_updatable(index_path: Path) -> bool:
+    # Whether update_document_index can apply to a stored index: it has an id map
+    # (built since ids are stable) and, if compressed, its float16 vectors
+    import faiss
+    index = faiss.read_index(str(index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    if not isinstance(index, faiss.IndexIDMap2):
+        return False
+    return is_exact(index) or vectors_path(index_path).exists()
+
+
+def update_document_index(
+    source_path: Path,
+    index_path: Path,
+    embeddings: np.ndarray,
+    ids: np.ndarray,
+    removed_ids: np.ndarray,
+):
+    """
+    Write the document index at source_path, minus the vectors with removed_ids
+    and plus new ones, to index_path without rebuilding it. New ids must
+    continue after every id used so far, so the float16 rows of a compressed
+    index are appended rather than rewritten. The index must be is_updatable.
+    """
+    import faiss
+    index = faiss.read_index(str(source_path))
+    if not isinstance(index, faiss.IndexIDMap2):
+        raise ValueError(f"Index has no id map: {source_path}")
+
+    stored = None
+    if not is_exact(index):
+        stored = load_vectors(vectors_path(source_path))
+        if stored is None or (len(ids) and len(stored) > ids[0]):
+            raise ValueError(f"Float16 vectors don't match index ids: {source_path}")
+
+    if len(removed_ids):
+        removed = np.asarray(removed_ids, dtype="int64")
+        index.remove_ids(faiss.IDSelectorArray(removed))
+    if len(ids):
+        index.add_with_ids(embeddings, np.asarray(ids, dtype="int64"))
+    if stored is not None:
+        # Rows of ids no longer in use (e.g. trailing ones dropped by a migration) stay zero
+        gap = np.zeros((int(ids[0]) - len(stored) if len(ids) else 0, stored.shape[1]), dtype="float16")
+        write_vectors(vectors_path(index_path), stored, gap, embeddings)
+
+    _write_index(index, index_path)
+    return index
+
+
+def _write_index(index, index_path: Path) -> None:
+    import faiss
+    tmp_index_path = index_path.with_name(index_path.name + ".tmp")
+    faiss.write_index(index, str(tmp_index_path))
+    os.replace(tmp_index_path, index_path)
+
+
+def index_type_name(index) -> str:
+    # Configuration name of a built index
+    import faiss
+    index = base_index(index)
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    return "flat"
+
+
+def migrate(index_type: str = VECTOR_INDEX_TYPE) -> int:
+    """
+    Rewrite existing document indexes as index_type, keeping vector ids. Each
+    rewritten index is published as a new snapshot sharing the document's chunk
+    store and BM25 files. Indexes without an id map are rewritten with one.
+    Returns the number of indexes rewritten.
+    """
+    import faiss
+    _check_type(index_type)
+    migrated = 0
+    for current in current_snapshots():
+        if not current.store_path.exists():
+            # Chunk map not converted to a store yet (happens on its first query)
+            continue
+        with lease_snapshot(current.document_id) as current:
+            ids, vectors = document_vectors(current.index_path)
+            target = effective_type(len(vectors), index_type)
+            stored = faiss.read_index(str(current.index_path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            id_mapped = isinstance(stored, faiss.IndexIDMap2)
+            if id_mapped and index_type_name(stored) == target and (target == "flat" or current.vectors_path.exists()):
+                continue
+            with index_snapshot(current.document_id) as snapshot:
+                link_files(current, snapshot, ".chunks", ".bm25")
+                write_document_index(snapshot.index_path, vectors, index_type, ids)
+        migrated += 1
+    return migrated
+
+
+def _leased_vectors(document_id: int) -> np.ndarray:
+    with lease_snapshot(document_id) as snapshot:
+        return document_vectors(snapshot.index_path)[1]
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f[f != -1]) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def recall_report(top_k: int = 10, queries: int = 200, questions: list[str] | None = None, seed: int = 0) -> list[dict]:
+    """
+    Recall@top_k against exact search and memory per index type, over the vectors
+    of every indexed document. Queries are question embeddings when given,
+    otherwise stored vectors held out of the searched set.
+    """
+    import faiss
+    snapshots = current_snapshots()
+    if not snapshots:
+        raise ValueError("No document indexes found.")
+    base = np.concatenate([_leased_vectors(s.document_id) for s in snapshots])
+    if len(base) < 2:
+        raise ValueError("Not enough indexed vectors to measure recall.")
+
+    if questions:
+        from app.core.model_registry import get_embedding_model
+
+        query_vectors = np.asarray(get_embedding_model().encode(questions, show_progress_bar=False), dtype="float32")
+        faiss.normalize_L2(query_vectors)
+    else:
+        rng = np.random.default_rng(seed)
+        held_out = rng.choice(len(base), size=min(queries, len(base) // 2), replace=False)
+        query_vectors = base[held_out]
+        base = np.delete(base, held_out, axis=0)
+
+    n = len(base)
+    _, truth = _exact(base, query_vectors, top_k)
+    rerank_vectors = base.astype("float16")
+
+    report = []
+    for index_type in INDEX_TYPES:
+        # The tool measures IVF-PQ whenever its codebooks can be trained at all
+        index = build_vector_index(base, index_type, min_pq_vectors=0)
+        if index_type_name(index) != index_type:
+            continue
+        index_bytes = len(faiss.serialize_index(index))
+        row = {
+            "type": index_type,
+            "vectors": n,
+            "index_bytes": index_bytes,
+            "bytes_per_vector": round(index_bytes / n, 1),
+            "rerank_bytes": 0 if index_type == "flat" else rerank_vectors.nbytes,
+        }
+
+        started = time.perf_counter()
+        found = np.vstack([search_index(index, q[None], top_k)[1] for q in query_vectors])
+        row["recall"] = round(_recall(found, truth), 4)
+        row["query_ms"] = round((time.perf_counter() - started) * 1000 / len(query_vectors), 3)
+
+        if index_type != "flat":
+            started = time.perf_counter()
+            found = np.vstack([search_index(index, q[None], top_k, rerank_vectors)[1] for q in query_vectors])
+            row["recall_reranked"] = round(_recall(found, truth), 4)
+            row["query_ms_reranked"] = round((time.perf_counter() - started) * 1000 / len(query_vectors), 3)
+        report.append(row)
+    return report
+
+
+def _exact(base: np.ndarray, query_vectors: np.ndarray, top_k: int):
+    import faiss
+    index = faiss.IndexFlatIP(base.shape[1])
+    index.add(base)
+    return index.search(query_vectors, top_k)
+
+
+def _print_report(report: list[dict], top_k: int) -> None:
+    print(f"{'type':<8}{'vectors':>10}{'bytes/vec':>12}{'index MB':>10}{'f16 MB':>9}"
+          f"{f'recall@{top_k}':>12}{'reranked':>10}{'ms/query':>10}{'reranked':>10}")
+    for row in report:
+        print(f"{row['type']:<8}{row['vectors']:>10}{row['bytes_per_vector']:>12}"
+              f"{row['index_bytes'] / 2**20:>10.1f}{row['rerank_bytes'] / 2**20:>9.1f}"
+              f"{row['recall']:>12.4f}{row.get('recall_reranked', row['recall']):>10.4f}"
+              f"{row['query_ms']:>10.3f}{row.get('query_ms_reranked', row['query_ms']):>10.3f}")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    recall = commands.add_parser("recall", help="report recall vs memory for each index type")
+    recall.add_argument("--top-k", type=int, default=10)
+    recall.add_argument("--queries", type=int, default=200, help="held-out stored vectors used as queries")
+    recall.add_argument("--questions", type=Path, help="file with one question per line to embed as queries")
+
+    convert = commands.add_parser("migrate", help="rewrite existing document indexes in place")
+    convert.add_argument("--type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE)
+    convert.add_argument("--corpus", action="store_true", help="also re-quantize the corpus IVF index")
+
+    args = parser.parse_args(argv)
+    if args.command == "recall":
+        questions = None
+        if args.questions:
+            questions = [q.strip() for q in args.questions.read_text().splitlines() if q.strip()]
+        _print_report(recall_report(args.top_k, args.queries, questions), args.top_k)
+    else:
+        print(f"Migrated {migrate(args.type)} document indexes to {args.type}")
+        if args.corpus:
+            from app.core.corpus_index import corpus_index
+
+            corpus_index.requantize(args.type)
+            print(f"Corpus index: {corpus_index.stats()['type']}")
+
+
+if __name__ == "__main__":
+    main()
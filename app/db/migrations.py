@@ -0,0 +1,89 @@
+from sqlalchemy import Engine, inspect, text
+from sqlalchemy.engine import Connection
+
+from app.db.base import Base
+from app.db import models  # noqa: F401  (registers tables on Base.metadata)
+
+
+def _columns(conn: Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+
+
+def _add_column(conn: Connection, table: str, column: str, ddl: str) -> None:
+    # Idempotent ALTER TABLE ... ADD COLUMN
+    if column not in _columns(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _m001_document_content_hash(conn: Connection) -> None:
+    _add_column(conn, "documents", "content_hash", "VARCHAR")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_documents_content_hash ON documents (content_hash)"
+    ))
+
+
+def _m002_chunk_lookup_index(conn: Connection) -> None:
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chunks_document_id_chunk_index ON chunks (document_id, chunk_index)"
+    ))
+
+
+def _m003_document_text_path(conn: Connection) -> None:
+    _add_column(conn, "documents", "text_path", "VARCHAR")
+
+
+def _m004_chunk_provenance(conn: Connection) -> None:
+    # Existing chunks keep NULLs until their document is re-indexed
+    for column in ("page_start", "page_end", "char_start", "char_end"):
+        _add_column(conn, "chunks", column, "INTEGER")
+
+
+def _m005_job_owner(conn: Connection) -> None:
+    # Jobs from before ownership have no heartbeat, so the sweeper treats them as orphaned
+    _add_column(conn, "jobs", "owner", "VARCHAR")
+    _add_column(conn, "jobs", "heartbeat_at", "DATETIME")
+
+
+def _m006_one_active_job_per_document(conn: Connection) -> None:
+    # Racing enqueues may already have left duplicates; keep the newest active job
+    conn.execute(text(
+        "UPDATE jobs SET status = 'FAILED', error = 'Superseded by a newer job for the same document' "
+        "WHERE status IN ('QUEUED', 'RUNNING') AND id < "
+        "(SELECT MAX(j.id) FROM jobs j WHERE j.document_id = jobs.document_id AND j.status IN ('QUEUED', 'RUNNING'))"
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_jobs_active_document ON jobs (document_id) "
+        "WHERE status IN ('QUEUED', 'RUNNING')"
+    ))
+
+
+# Ordered schema migrations; the applied count is stored in PRAGMA user_version
+MIGRATIONS = [
+    _m001_document_content_hash,
+    _m002_chunk_lookup_index,
+    _m003_document_text_path,
+    _m004_chunk_provenance,
+    _m005_job_owner,
+    _m006_one_active_job_per_document,
+]
+
+
+def init_db(engine: Engine) -> None:
+    """
+    Create missing tables and bring existing databases up to the current schema.
+    """
+    is_new = not inspect(engine).has_table("documents")
+
+    # Create all database tables defined in SQLAlchemy models
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        if is_new:
+            # Fresh databases already have the latest schema from create_all
+            conn.execute(text(f"PRAGMA user_version = {len(MIGRATIONS)}"))
+            return
+
+        version = conn.execute(text("PRAGMA user_version")).scalar()
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(text(f"PRAGMA user_version = {number}"))
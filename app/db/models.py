@@ -1,4 +1,4 @@
-from sqlalchemy import String, DateTime, Integer, ForeignKey, Text
+from sqlalchemy import String, DateTime, Integer, ForeignKey, Text, Index, text
 from sqlalchemy.orm import Mapped, mapped_column
 from datetime import datetime
 from app.db.base import Base
@@ -22,6 +22,12 @@ class Document(Base):
     
     # Processing status
     status: Mapped[str] = mapped_column(String, nullable=False, default="UPLOADED")
+
+    # SHA-256 of the uploaded file (hex)
+    content_hash: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
+
+    # Persisted extracted text (page-segmented, gzip'd JSON lines)
+    text_path: Mapped[str | None] = mapped_column(String, nullable=True)
     
     # Creation timestamp
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
@@ -31,6 +37,9 @@ class Chunk(Base):
     # Text chunk table
     __tablename__ = "chunks"
 
+    # Retrieval looks chunks up by (document_id, chunk_index)
+    __table_args__ = (Index("ix_chunks_document_id_chunk_index", "document_id", "chunk_index"),)
+
     # Primary chunk identifier
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
     
@@ -42,3 +51,79 @@ class Chunk(Base):
     
     # Chunk text content
     text: Mapped[str] = mapped_column(Text, nullable=False)
+
+    # Provenance: pages spanned and character offsets into the joined document text
+    page_start: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    page_end: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    char_start: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    char_end: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+
+class Job(Base):
+    # Background processing job table
+    __tablename__ = "jobs"
+    # At most one active job per document, so concurrent enqueues can't both insert
+    __table_args__ = (
+        Index(
+            "uq_jobs_active_document",
+            "document_id",
+            unique=True,
+            sqlite_where=text("status IN ('QUEUED', 'RUNNING')"),
+        ),
+    )
+
+    # Primary job identifier
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+
+    # Document being processed
+    document_id: Mapped[int] = mapped_column(ForeignKey("documents.id"), nullable=False, index=True)
+
+    # Job state (QUEUED, RUNNING, SUCCEEDED, FAILED)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="QUEUED", index=True)
+
+    # Result of a successful run
+    chunks_indexed: Mapped[int | None] = mapped_column(Integer, nullable=True)
+
+    # Failure reason
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    # "host:pid" of the process responsible for an active job, and its last sign of life
+    owner: Mapped[str | None] = mapped_column(String, nullable=True)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    # Lifecycle timestamps
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+
+class BulkRun(Base):
+    # Bulk ingestion run table (progress is saved by the process running it)
+    __tablename__ = "bulk_runs"
+
+    # Run identifier (hex)
+    id: Mapped[str] = mapped_column(String, primary_key=True)
+
+    # Run state (QUEUED, RUNNING, SUCCEEDED, FAILED)
+    status: Mapped[str] = mapped_column(String, nullable=False, default="QUEUED")
+
+    # Progress counts
+    documents: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    extracted: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    indexed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    failed: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    pages: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    chunks: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+    # Stage failure, and per-document failures (JSON list)
+    error: Mapped[str | None] = mapped_column(Text, nullable=True)
+    errors: Mapped[str | None] = mapped_column(Text, nullable=True)
+
+    # "host:pid" of the process running it, and when it last saved progress
+    owner: Mapped[str | None] = mapped_column(String, nullable=True)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+
+    # Lifecycle timestamps
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    started_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    finished_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
@@ -1,11 +1,41 @@
-from sqlalchemy import create_engine
+import threading
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 from app.core.config import DB_PATH
+from app.db.migrations import init_db
+
+engine = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False, "timeout": 30})
+
+@event.listens_for(engine, "connect")
+def _configure_sqlite(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer (API + job worker processes);
+    # NORMAL sync is durable across app crashes and much cheaper per commit;
+    # mmap serves reads from the page cache without extra copies.
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
 
-engine = create_engine(f"sqlite:///{DB_PATH}", connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+_db_ready = threading.Event()
+_db_lock = threading.Lock()
+
+def ensure_db() -> None:
+    # Create tables and apply migrations once per process: during startup warmup,
+    # or on the first request if that arrives earlier
+    if _db_ready.is_set():
+        return
+    with _db_lock:
+        if not _db_ready.is_set():
+            init_db(engine)
+            _db_ready.set()
+
 def get_db():
+    ensure_db()
     db = SessionLocal()
     try:
         yield db
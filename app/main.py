@@ -1,23 +1,109 @@
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env file
-from fastapi import FastAPI
-from app.db.base import Base
-from app.db.session import engine
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import time
+from app.core.config import MAX_FILE_SIZE_BYTES, DEBUG_TIMING
+from app.core.metrics import HTTP_REQUEST_SECONDS, start_request_timing, stop_request_timing, server_timing_header
+from app.db.session import ensure_db
 from app.api.routes import router
+from app.core.corpus_index import corpus_index
+from app.core.lexical_index import corpus_lexical_index
+from app.core.model_registry import warmup
+from app.core.readiness import readiness
+from app.services.job_queue import job_queue
+from app.services.bulk_ingest import shutdown_extract_pool
+
+
+def _warm_indexes() -> None:
+    # Load the corpus vector index and BM25 manifest from disk
+    corpus_index.stats()
+    corpus_lexical_index.stats()
+
+
+def _import_llm_client() -> None:
+    # Pay the openai import here rather than on the first question; clients are
+    # still created on first use, so a missing API key only fails requests
+    import openai  # noqa: F401
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up in the background so the port binds (and /health answers) immediately;
+    # GET /ready reports when every step has finished
+    readiness.start([
+        # Create tables / apply migrations before anything reads the database
+        ("database", ensure_db),
+        # Start background processing workers and resume jobs left over from a restart
+        ("job_queue", job_queue.start),
+        # Load the embedding model so the first request skips model initialization
+        ("embedding_model", warmup),
+        ("llm_client", _import_llm_client),
+        ("indexes", _warm_indexes),
+    ])
+    yield
+    job_queue.shutdown()
+    shutdown_extract_pool()
+
+
+# Allowance for multipart boundaries and part headers around the file itself
+MAX_UPLOAD_REQUEST_BYTES = MAX_FILE_SIZE_BYTES + 64 * 1024
 
 
 def create_app() -> FastAPI:
     # Create and configure the FastAPI application instance
-    app = FastAPI(title="Document AI Backend (Backend-only)")
-    
-    # Create all database tables defined in SQLAlchemy models
-    # This binds the metadata to the engine and ensures tables exist at startup
-    Base.metadata.create_all(bind=engine)
-    
+    app = FastAPI(title="Document AI Backend (Backend-only)", lifespan=lifespan)
+
+    # Reject uploads whose declared size is already over the limit, before the body is read
+    @app.middleware("http")
+    async def reject_oversized_uploads(request: Request, call_next):
+        length = request.headers.get("content-length")
+        if request.url.path != "/documents/upload" or not length:
+            return await call_next(request)
+
+        try:
+            length = int(length)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            return JSONResponse(
+                status_code=400,
+                content={"detail": {"code": "INVALID_CONTENT_LENGTH", "message": "Content-Length must be a non-negative integer."}}
+            )
+        if length > MAX_UPLOAD_REQUEST_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": {"code": "FILE_TOO_LARGE", "message": f"File exceeds {MAX_FILE_SIZE_BYTES} bytes limit."}}
+            )
+        return await call_next(request)
+
+    # Request latency histogram, plus an optional per-stage Server-Timing header
+    @app.middleware("http")
+    async def record_request_timing(request: Request, call_next):
+        timings, token = start_request_timing()
+        started = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            stop_request_timing(token)
+
+        # Label by route template (e.g. /documents/{document_id}/index) to keep cardinality bounded
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=response.status_code,
+        )
+
+        if timings and (DEBUG_TIMING or request.headers.get("x-debug-timing") == "1"):
+            response.headers["Server-Timing"] = server_timing_header(timings)
+        return response
+
     # Register all API routes with the FastAPI application
     app.include_router(router)
-    
-    
+
     return app
 
 
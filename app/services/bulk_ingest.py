@@ -0,0 +1,613 @@
+"""
+Bulk ingestion: extract, chunk, embed and index many documents as one pipeline.
+
+    extract (shared process pool) -> chunk -> embed -> write
+
+Stages are connected by bounded queues, so a slow stage holds back the ones
+before it instead of buffering the whole archive in memory. The embed stage
+packs chunks from many documents into full encoder batches, and the writer
+updates the corpus indexes once per group of documents. Document status moves
+through the usual PROCESSING_TEXT -> TEXT_EXTRACTED -> PROCESSING_INDEX ->
+INDEXED as each document advances. Run progress is saved to the bulk_runs
+table, so any API process can report it.
+
+    python -m app.services.bulk_ingest /data/archive --recursive
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.agents import ingestion_agent
+from app.agents.indexing_agent import IndexingAgent
+from app.core.config import (
+    ALLOWED_EXTENSIONS,
+    MAX_FILE_SIZE_BYTES,
+    BULK_EXTRACT_WORKERS,
+    BULK_EMBED_BATCH,
+    BULK_WRITE_BATCH,
+    BULK_QUEUE_SIZE,
+    BULK_PROGRESS_SECONDS,
+    JOB_STALE_SECONDS,
+)
+from app.core.metrics import registry, stage
+from app.db.models import BulkRun, Document
+from app.db.session import SessionLocal, ensure_db
+from app.services.indexing_service import index_documents, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP
+from app.services.ingestion_service import extract_document, load_document_pages
+from app.services.job_queue import owner_id
+from app.services.storage import infer_file_type, save_local_file
+
+logger = logging.getLogger(__name__)
+
+# End-of-input marker passed down the stage queues
+_DONE = object()
+
+# Errors kept per run (the failed count covers the rest)
+MAX_REPORTED_ERRORS = 100
+
+# Extraction processes shared by every run in this process
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
+# Runs in this process take turns writing: concurrent writers only queue up on
+# the SQLite write lock and the corpus index lock
+_write_lock = threading.Lock()
+
+
+def _init_extract_worker() -> None:
+    # Documents are already extracted in parallel; keep each PDF's pages in this process
+    ingestion_agent._init_worker()
+    ingestion_agent.PDF_EXTRACT_WORKERS = 1
+
+
+def _extract_document(document_id: int) -> None:
+    # Extraction worker: runs in its own process with its own session
+    db = SessionLocal()
+    try:
+        doc = db.get(Document, document_id)
+        if not doc:
+            raise ValueError("Document not found")
+        doc.status = "PROCESSING_TEXT"
+        db.commit()
+        extract_document(document_id, db)
+    finally:
+        db.close()
+        # Pool processes exit without running atexit handlers
+        registry.flush()
+
+
+def _extract_executor(max_workers: int, broken: ProcessPoolExecutor | None = None) -> ProcessPoolExecutor:
+    # The first run creates the pool at its size; pass a broken pool to replace it
+    global _extract_pool
+    with _extract_pool_lock:
+        if broken is not None and _extract_pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _extract_pool = None
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_extract_worker,
+            )
+        return _extract_pool
+
+
+def shutdown_extract_pool() -> None:
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown(wait=False, cancel_futures=True)
+            _extract_pool = None
+
+
+class BulkIngestion:
+    """
+    One bulk run over documents that are already registered (uploaded).
+    A document that fails is marked FAILED_TEXT_EXTRACTION or FAILED_INDEXING
+    and the rest of the run continues.
+    """
+
+    def __init__(
+        self,
+        document_ids: list[int],
+        extract_workers: int = BULK_EXTRACT_WORKERS,
+        embed_batch: int = BULK_EMBED_BATCH,
+        write_batch: int = BULK_WRITE_BATCH,
+        queue_size: int = BULK_QUEUE_SIZE,
+    ):
+        self.id = uuid.uuid4().hex[:12]
+        self.document_ids = list(document_ids)
+        self.owner = owner_id()
+        self.extract_workers = max(1, extract_workers)
+        self.embed_batch = max(1, embed_batch)
+        self.write_batch = max(1, write_batch)
+
+        # extract -> document_id -> chunk -> {document_id, pages, spans} -> embed -> (+ embeddings) -> write
+        self._extracted = queue.Queue(queue_size)
+        self._chunked = queue.Queue(queue_size)
+        self._embedded = queue.Queue(queue_size)
+
+        self._lock = threading.Lock()
+        self._counts = {"extracted": 0, "indexed": 0, "failed": 0, "pages": 0, "chunks": 0}
+        self.errors = []
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._started = None
+        self._finished = None
+
+    # --------------------------------------------------
+    # Run
+    # --------------------------------------------------
+
+    def start(self) -> threading.Thread:
+        # Run in the background; progress() can be polled meanwhile
+        thread = threading.Thread(target=self.run, name=f"bulk-{self.id}", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self) -> dict:
+        self.started_at = datetime.utcnow()
+        self._started = time.perf_counter()
+        self._save_safely()
+
+        # Progress is saved periodically while the stages run; the saves double as a heartbeat
+        stop = threading.Event()
+        saver = threading.Thread(target=self._save_progress, args=(stop,), name=f"bulk-{self.id}-progress", daemon=True)
+        saver.start()
+
+        stages = [
+            ("extract", self._extract_stage, None, self._extracted, 1),
+            ("chunk", self._chunk_stage, self._extracted, self._chunked, 1),
+            ("embed", self._embed_stage, self._chunked, self._embedded, 1),
+            ("write", self._write_stage, self._embedded, None, 0),
+        ]
+        threads = [
+            threading.Thread(target=self._run_stage, args=args, name=f"bulk-{self.id}-{args[0]}", daemon=True)
+            for args in stages
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self._finished = time.perf_counter()
+        self.finished_at = datetime.utcnow()
+        stop.set()
+        saver.join()
+        self._save_safely()
+
+        progress = self.progress()
+        logger.info(
+            "Bulk ingestion %s: %d indexed, %d failed, %.1f pages/s, %.1f chunks/s",
+            self.id, progress["indexed"], progress["failed"],
+            progress["pages_per_second"], progress["chunks_per_second"],
+        )
+        return progress
+
+    def progress(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            errors = list(self.errors)
+
+        if self._started is None:
+            elapsed = 0.0
+        else:
+            elapsed = (self._finished or time.perf_counter()) - self._started
+
+        if self._finished is None:
+            status = "QUEUED" if self._started is None else "RUNNING"
+        else:
+            status = "FAILED" if self.error else "SUCCEEDED"
+
+        return _progress_dict(
+            self.id, status, len(self.document_ids), counts, elapsed,
+            self.error, errors, self.started_at, self.finished_at,
+        )
+
+    def save(self) -> None:
+        # Write the current progress to this run's bulk_runs row
+        progress = self.progress()
+        db = SessionLocal()
+        try:
+            row = db.get(BulkRun, self.id)
+            if row is None:
+                row = BulkRun(id=self.id, owner=self.owner)
+                db.add(row)
+            row.status = progress["status"]
+            row.documents = progress["documents"]
+            for key in _COUNTS:
+                setattr(row, key, progress[key])
+            row.error = progress["error"]
+            row.errors = json.dumps(progress["errors"])
+            row.started_at = self.started_at
+            row.finished_at = self.finished_at
+            row.heartbeat_at = datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
+
+    def _save_safely(self) -> None:
+        # A failed save only delays what GET /documents/bulk/{id} shows
+        try:
+            self.save()
+        except Exception:
+            logger.exception("Bulk ingestion %s: saving progress failed", self.id)
+
+    def _save_progress(self, stop: threading.Event) -> None:
+        while not stop.wait(BULK_PROGRESS_SECONDS):
+            self._save_safely()
+
+    # --------------------------------------------------
+    # Stages
+    # --------------------------------------------------
+
+    def _run_stage(self, name: str, target, inbox: queue.Queue | None, outbox: queue.Queue | None, sentinels: int) -> None:
+        try:
+            target()
+        except Exception as e:
+            logger.exception("Bulk ingestion %s: %s stage failed", self.id, name)
+            self.error = f"{name} stage failed: {e}"
+            # Keep consuming so earlier stages don't block on a full queue
+            if inbox is not None:
+                while (item := inbox.get()) is not _DONE:
+                    self._fail(item if isinstance(item, int) else item["document_id"], name, self.error)
+        finally:
+            # Tell the next stage (each of its threads) that no more input is coming
+            for _ in range(sentinels):
+                outbox.put(_DONE)
+
+    def _extract_stage(self) -> None:
+        pool = _extract_executor(self.extract_workers)
+        pending = iter(self.document_ids)
+        running = {}
+        try:
+            while True:
+                # At most two documents per worker in flight from this run
+                while len(running) < self.extract_workers * 2:
+                    document_id = next(pending, None)
+                    if document_id is None:
+                        break
+                    try:
+                        future = pool.submit(_extract_document, document_id)
+                    except BrokenProcessPool:
+                        # A worker died and took the pool with it; start a fresh one
+                        pool = _extract_executor(self.extract_workers, broken=pool)
+                        future = pool.submit(_extract_document, document_id)
+                    running[future] = document_id
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    document_id = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self._fail(document_id, "extract", e)
+                        continue
+                    self._count(extracted=1)
+                    # Blocks while chunking is behind
+                    self._extracted.put(document_id)
+        finally:
+            # The pool is shared; only drop this run's documents that haven't started
+            for future in running:
+                future.cancel()
+
+    def _chunk_stage(self) -> None:
+        agent = IndexingAgent()
+        db = SessionLocal()
+        try:
+            while (document_id := self._extracted.get()) is not _DONE:
+                try:
+                    doc = db.get(Document, document_id)
+                    doc.status = "PROCESSING_INDEX"
+                    db.commit()
+
+                    pages = list(load_document_pages(document_id, db))
+                    with stage("chunk"):
+                        spans = list(agent.chunk_pages(pages, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP))
+                except Exception as e:
+                    db.rollback()
+                    self._fail(document_id, "chunk", e)
+                    continue
+                self._chunked.put({"document_id": document_id, "pages": len(pages), "spans": spans})
+        finally:
+            db.close()
+
+    def _embed_stage(self) -> None:
+        """
+        Encode chunks in batches of embed_batch texts regardless of document
+        boundaries. A partial batch is encoded as soon as the chunk stage has
+        nothing more ready, so a slow extractor doesn't stall finished documents.
+        """
+        agent = IndexingAgent()
+        dimension = agent.model.get_sentence_embedding_dimension()
+        # Next batch: chunk texts and the (document entry, row) each belongs to
+        texts, rows = [], []
+        finished = False
+
+        while not finished or texts:
+            item = None
+            if not finished:
+                try:
+                    item = self._chunked.get(block=not texts)
+                except queue.Empty:
+                    pass
+
+            if item is _DONE:
+                finished = True
+            elif item is not None:
+                spans = item["spans"]
+                item["embeddings"] = np.empty((len(spans), dimension), dtype="float32")
+                item["remaining"] = len(spans)
+                item["failed"] = False
+                if not spans:
+                    self._embedded.put(item)
+                for row, span in enumerate(spans):
+                    texts.append(span["text"])
+                    rows.append((item, row))
+
+            # Full batches go immediately; a partial one once the chunk stage has nothing ready
+            while len(texts) >= self.embed_batch:
+                self._embed_batch(agent, texts[:self.embed_batch], rows[:self.embed_batch])
+                del texts[:self.embed_batch], rows[:self.embed_batch]
+            if texts and (item is None or finished):
+                self._embed_batch(agent, texts, rows)
+                texts, rows = [], []
+
+    def _embed_batch(self, agent: IndexingAgent, texts: list[str], rows: list[tuple[dict, int]]) -> None:
+        entries = [entry for entry, _ in rows if not entry["failed"]]
+        if not entries:
+            return
+        try:
+            embeddings = agent.embed_chunks(texts)
+        except Exception as e:
+            for entry in entries:
+                if not entry["failed"]:
+                    entry["failed"] = True
+                    self._fail(entry["document_id"], "embed", e)
+            return
+
+        for (entry, row), vector in zip(rows, embeddings):
+            if entry["failed"]:
+                continue
+            entry["embeddings"][row] = vector
+            entry["remaining"] -= 1
+            if entry["remaining"] == 0:
+                # Blocks while the writer is behind
+                self._embedded.put(entry)
+
+    def _write_stage(self) -> None:
+        db = SessionLocal()
+        try:
+            finished = False
+            while not finished:
+                # Group whatever is ready so the corpus indexes are written once per group
+                group = []
+                item = self._embedded.get()
+                while item is not _DONE:
+                    group.append(item)
+                    if len(group) >= self.write_batch:
+                        break
+                    try:
+                        item = self._embedded.get_nowait()
+                    except queue.Empty:
+                        break
+                finished = item is _DONE
+                if group:
+                    self._write_group(group, db)
+        finally:
+            db.close()
+
+    def _write_group(self, group: list[dict], db: Session) -> None:
+        try:
+            with _write_lock:
+                index_documents([(e["document_id"], e["spans"], e["embeddings"]) for e in group], db)
+            written = group
+        except Exception as e:
+            db.rollback()
+            if len(group) == 1:
+                self._fail(group[0]["document_id"], "write", e)
+                written = []
+            else:
+                # Retry one document at a time so one bad document doesn't fail the group
+                written = [entry for entry in group if self._write_one(entry, db)]
+
+        self._count(
+            indexed=len(written),
+            pages=sum(entry["pages"] for entry in written),
+            chunks=sum(len(entry["spans"]) for entry in written),
+        )
+
+    def _write_one(self, entry: dict, db: Session) -> bool:
+        try:
+            with _write_lock:
+                index_documents([(entry["document_id"], entry["spans"], entry["embeddings"])], db)
+            return True
+        except Exception as e:
+            db.rollback()
+            self._fail(entry["document_id"], "write", e)
+            return False
+
+    # --------------------------------------------------
+    # Bookkeeping
+    # --------------------------------------------------
+
+    def _count(self, **deltas: int) -> None:
+        with self._lock:
+            for key, delta in deltas.items():
+                self._counts[key] += delta
+
+    def _fail(self, document_id: int, stage_name: str, error) -> None:
+        logger.warning("Bulk ingestion %s: document %s failed in %s: %s", self.id, document_id, stage_name, error)
+        with self._lock:
+            self._counts["failed"] += 1
+            if len(self.errors) < MAX_REPORTED_ERRORS:
+                self.errors.append({"document_id": document_id, "stage": stage_name, "error": str(error)})
+
+        db = SessionLocal()
+        try:
+            doc = db.get(Document, document_id)
+            if doc:
+                doc.status = "FAILED_TEXT_EXTRACTION" if stage_name == "extract" else "FAILED_INDEXING"
+                db.commit()
+        finally:
+            db.close()
+
+
+# --------------------------------------------------
+# Runs
+# --------------------------------------------------
+
+_COUNTS = ("extracted", "indexed", "failed", "pages", "chunks")
+
+
+def _progress_dict(run_id, status, documents, counts, elapsed, error, errors, started_at, finished_at) -> dict:
+    return {
+        "id": run_id,
+        "status": status,
+        "documents": documents,
+        **counts,
+        "seconds": round(elapsed, 2),
+        "pages_per_second": round(counts["pages"] / elapsed, 1) if elapsed else 0.0,
+        "chunks_per_second": round(counts["chunks"] / elapsed, 1) if elapsed else 0.0,
+        "error": error,
+        "errors": errors,
+        "started_at": started_at.isoformat() if started_at else None,
+        "finished_at": finished_at.isoformat() if finished_at else None,
+    }
+
+
+def start_bulk_ingestion(document_ids: list[int]) -> BulkIngestion:
+    run = BulkIngestion(document_ids)
+    # Saved before it starts, so the run can be looked up as soon as its id is returned
+    run.save()
+    run.start()
+    return run
+
+
+def get_bulk_ingestion(run_id: str, db: Session) -> dict | None:
+    """
+    Progress of a bulk run started by any process, or None if there is no such run.
+    An unfinished run whose process stopped saving progress is reported as FAILED.
+    """
+    row = db.get(BulkRun, run_id)
+    if row is None:
+        return None
+
+    status, error, end = row.status, row.error, row.finished_at or datetime.utcnow()
+    stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+    if status in ("QUEUED", "RUNNING") and (row.heartbeat_at is None or row.heartbeat_at < stale_before):
+        status, error = "FAILED", "Interrupted: the process running it stopped"
+        end = row.heartbeat_at or end
+    elapsed = max(0.0, (end - row.started_at).total_seconds()) if row.started_at else 0.0
+
+    return _progress_dict(
+        row.id, status, row.documents, {key: getattr(row, key) for key in _COUNTS}, elapsed,
+        error, json.loads(row.errors or "[]"), row.started_at, row.finished_at,
+    )
+
+
+def register_files(paths: list[Path], db: Session) -> tuple[list[int], list[dict]]:
+    """
+    Copy local files into the upload directory and create their documents.
+    Returns (document ids, skipped files as {"path", "reason"}).
+    """
+    document_ids, skipped = [], []
+    for path in paths:
+        ext = path.suffix.lower()
+        if ext not in ALLOWED_EXTENSIONS:
+            skipped.append({"path": str(path), "reason": f"unsupported file type '{ext}'"})
+            continue
+        size = path.stat().st_size
+        if size == 0 or size > MAX_FILE_SIZE_BYTES:
+            skipped.append({"path": str(path), "reason": "empty" if size == 0 else f"larger than {MAX_FILE_SIZE_BYTES} bytes"})
+            continue
+
+        dest, size, content_hash = save_local_file(path)
+        doc = Document(
+            filename=path.name,
+            file_type=infer_file_type(ext),
+            path=str(dest),
+            status="UPLOADED",
+            content_hash=content_hash,
+        )
+        db.add(doc)
+        db.flush()
+        document_ids.append(doc.id)
+
+    db.commit()
+    return document_ids, skipped
+
+
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
+
+def _progress_line(progress: dict) -> str:
+    return (
+        f"{progress['indexed']}/{progress['documents']} indexed, {progress['failed']} failed, "
+        f"{progress['pages']} pages ({progress['pages_per_second']}/s), "
+        f"{progress['chunks']} chunks ({progress['chunks_per_second']}/s), {progress['seconds']} s"
+    )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", type=Path, help="directory of PDFs and images to ingest")
+    parser.add_argument("--recursive", action="store_true", help="include subdirectories")
+    parser.add_argument("--extract-workers", type=int, default=BULK_EXTRACT_WORKERS)
+    parser.add_argument("--embed-batch", type=int, default=BULK_EMBED_BATCH, help="chunks per encoder call")
+    args = parser.parse_args(argv)
+
+    if not args.directory.is_dir():
+        parser.error(f"not a directory: {args.directory}")
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    ensure_db()
+
+    files = sorted(p for p in (args.directory.rglob("*") if args.recursive else args.directory.iterdir()) if p.is_file())
+    db = SessionLocal()
+    try:
+        document_ids, skipped = register_files(files, db)
+    finally:
+        db.close()
+    for item in skipped:
+        print(f"skipped {item['path']}: {item['reason']}", file=sys.stderr)
+    print(f"registered {len(document_ids)} documents")
+
+    run = BulkIngestion(
+        document_ids,
+        extract_workers=args.extract_workers,
+        embed_batch=args.embed_batch,
+    )
+    thread = run.start()
+    while thread.is_alive():
+        thread.join(5)
+        print(_progress_line(run.progress()))
+
+    progress = run.progress()
+    for error in progress["errors"]:
+        print(f"document {error['document_id']} failed in {error['stage']}: {error['error']}", file=sys.stderr)
+    if progress["error"]:
+        print(f"FAIL: {progress['error']}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
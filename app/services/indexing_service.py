@@ -1,13 +1,38 @@
-from pathlib import Path
+import hashlib
+from collections import deque
+from contextlib import ExitStack
+from typing import Iterable
+import numpy as np
+from sqlalchemy import insert, update
 from sqlalchemy.orm import Session
+from app.core.chunk_store import ChunkStore
+from app.core.config import INDEX_DIR, INDEX_UPDATE_MAX_CHANGE, STREAM_EMBED_BATCH
+from app.core.answer_cache import answer_cache
+from app.core.corpus_index import corpus_index
+from app.core.lexical_index import corpus_lexical_index
+from app.core.index_cache import index_cache
+from app.core.index_snapshots import current_snapshot, index_snapshot, lease_snapshot
+from app.core.metrics import stage, CHUNKS_PER_DOCUMENT
+from app.core.vector_index import is_updatable
 from app.db.models import Document, Chunk
 from app.agents.indexing_agent import IndexingAgent
 
+# Chunking defaults (embedding model tokens; MiniLM embeds at most 254 per chunk)
+DEFAULT_CHUNK_SIZE = 200
+DEFAULT_CHUNK_OVERLAP = 32
+
+_PROVENANCE = ("page_start", "page_end", "char_start", "char_end")
+
 # Directory for FAISS indexes and metadata
-INDEX_DIR = Path("storage/indexes")
 INDEX_DIR.mkdir(parents=True, exist_ok=True)
 
-def index_document(document_id: int, text: str, db: Session) -> int:
+def index_document(
+    document_id: int,
+    pages: Iterable[tuple[int, str]],
+    db: Session,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> int:
     # Fetch document record
     doc = db.get(Document, document_id)
     if not doc:
@@ -16,26 +41,262 @@ def index_document(document_id: int, text: str, db: Session) -> int:
     # Initialize indexing agent
     agent = IndexingAgent()
     
-    # Split document text into chunks
-    chunks = agent.chunk_text(text)
+    # Split page-segmented text into chunks (with page and offset provenance)
+    with stage("chunk"):
+        spans = list(agent.chunk_pages(pages, chunk_size=chunk_size, overlap=overlap))
+    chunks = [span["text"] for span in spans]
+    CHUNKS_PER_DOCUMENT.observe(len(chunks))
+
+    # Build and persist vector index into a new snapshot; queries keep using the
+    # current one until it is published at the end of the block. No write
+    # transaction is open while embedding, so other writers are not locked out
+    with index_snapshot(document_id) as snapshot:
+        with stage("build_index"):
+            count = agent.build_index(chunks, snapshot.index_path, snapshot.store_path, document_id=document_id)
+
+        # Replace chunk rows and update document status in one short transaction,
+        # committed before the snapshot is published so readers never see it without its rows
+        with stage("sql"):
+            _replace_chunks(document_id, spans, db)
+            doc.status = "INDEXED"
+            db.commit()
+
+    # Release this process's hold on the old snapshot (others see the new pointer)
+    index_cache.invalidate(document_id)
+    answer_cache.invalidate_document(document_id)
+
+    # Return indexed chunk count
+    return count
+
+
+def index_document_streaming(
+    document_id: int,
+    pages: Iterable[tuple[int, str]],
+    db: Session,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> int:
+    """
+    index_document with memory bounded by STREAM_EMBED_BATCH chunks instead of
+    the document size: pages are chunked lazily, and each batch of chunks is
+    embedded and written to the index files before the next batch is read.
+
+    Chunk provenance is spilled to a file in the new snapshot as batches go by;
+    once the index is built, the chunk rows are written from it and the chunk
+    store in one short transaction, so no write transaction is open during the build.
+    """
+    doc = db.get(Document, document_id)
+    if not doc:
+        raise ValueError("Document not found")
+
+    agent = IndexingAgent()
+
+    with index_snapshot(document_id) as snapshot:
+        provenance_path = snapshot.directory / "provenance.tmp"
+        with open(provenance_path, "wb") as provenance:
+
+            def spill_batch(first: int, batch: list[dict]) -> None:
+                _provenance(batch).tofile(provenance)
+
+            # Chunking runs inside the build as batches are pulled from the generator
+            spans = agent.chunk_pages(pages, chunk_size=chunk_size, overlap=overlap)
+            with stage("build_index"):
+                count = agent.build_index_streaming(
+                    spans, snapshot.index_path, snapshot.store_path, document_id=document_id, on_batch=spill_batch
+                )
+
+        with stage("sql"):
+            _replace_chunks_streaming(document_id, snapshot.store_path, provenance_path, db)
+            doc.status = "INDEXED"
+            db.commit()
+        provenance_path.unlink()
+    CHUNKS_PER_DOCUMENT.observe(count)
+
+    # Release this process's hold on the old snapshot (others see the new pointer)
+    index_cache.invalidate(document_id)
+    answer_cache.invalidate_document(document_id)
+    return count
+
+
+def update_document_index(
+    document_id: int,
+    pages: Iterable[tuple[int, str]],
+    db: Session,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    overlap: int = DEFAULT_CHUNK_OVERLAP,
+) -> int | None:
+    """
+    Re-index an already indexed document by diffing its new chunks against the
+    stored ones. chunk_index is a stable chunk id: unchanged chunks keep their
+    id, vector and row (provenance is updated if it moved), removed chunks are
+    deleted and only inserted chunks are embedded and written, so the cost
+    follows the size of the edit rather than of the document.
+
+    Returns the chunk count, or None (having changed nothing) when the document
+    should be rebuilt with index_document instead: it has no stored chunks, its
+    index predates stable ids or BM25, or more than INDEX_UPDATE_MAX_CHANGE of its
+    chunks changed.
+    """
+    doc = db.get(Document, document_id)
+    if not doc:
+        raise ValueError("Document not found")
 
+    current = current_snapshot(document_id)
+    if current is None or not current.lexical_path.exists() or not is_updatable(current.index_path):
+        return None
+
+    # Stored chunks by text digest; duplicate texts queue up in chunk_index order
+    stored: dict[bytes, deque] = {}
+    rows = {}
+    with stage("sql"):
+        for row in (
+            db.query(Chunk.id, Chunk.chunk_index, Chunk.text, Chunk.page_start, Chunk.page_end, Chunk.char_start, Chunk.char_end)
+            .filter(Chunk.document_id == document_id)
+            .order_by(Chunk.chunk_index)
+        ):
+            stored.setdefault(_digest(row.text), deque()).append(row.chunk_index)
+            rows[row.chunk_index] = (row.id, row.page_start, row.page_end, row.char_start, row.char_end)
+    if not rows or INDEX_UPDATE_MAX_CHANGE <= 0:
+        return None
+    max_change = INDEX_UPDATE_MAX_CHANGE * len(rows)
+
+    # Match new chunks to stored ones; stop early once the change is too large
+    agent = IndexingAgent()
+    inserted, moved, count = [], [], 0
+    with stage("chunk"):
+        for span in agent.chunk_pages(pages, chunk_size=chunk_size, overlap=overlap):
+            count += 1
+            matches = stored.get(_digest(span["text"]))
+            if not matches:
+                inserted.append(span)
+                if len(inserted) > max_change:
+                    return None
+                continue
+
+            chunk_index = matches.popleft()
+            row_id, *provenance = rows[chunk_index]
+            if provenance != [span["page_start"], span["page_end"], span["char_start"], span["char_end"]]:
+                moved.append({"id": row_id, **_chunk_row(document_id, chunk_index, span)})
+
+    removed = sorted(chunk_index for matches in stored.values() for chunk_index in matches)
+    if len(inserted) + len(removed) > max_change:
+        return None
+
+    def apply_rows(ids=()) -> None:
+        with stage("sql"):
+            if removed:
+                db.query(Chunk).filter(Chunk.document_id == document_id, Chunk.chunk_index.in_(removed)).delete()
+            if inserted:
+                db.execute(insert(Chunk), [_chunk_row(document_id, int(i), span) for i, span in zip(ids, inserted)])
+            if moved:
+                db.execute(update(Chunk), moved)
+            doc.status = "INDEXED"
+            db.commit()
+
+    if inserted or removed:
+        # The updated files form a new snapshot, derived from the current one; the
+        # rows are committed before it is published at the end of the block
+        with lease_snapshot(document_id) as current, index_snapshot(document_id) as snapshot:
+            with stage("build_index"):
+                ids = agent.update_index(
+                    [span["text"] for span in inserted],
+                    removed,
+                    (current.index_path, current.store_path),
+                    snapshot.index_path,
+                    snapshot.store_path,
+                    document_id=document_id,
+                )
+            apply_rows(ids)
+        index_cache.invalidate(document_id)
+    else:
+        apply_rows()
+
+    if inserted or removed or moved:
+        answer_cache.invalidate_document(document_id)
+    CHUNKS_PER_DOCUMENT.observe(count)
+    return count
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def index_documents(batch: list[tuple[int, list[dict], np.ndarray]], db: Session) -> None:
+    """
+    Persist several already chunked and embedded documents, given as
+    [(document_id, spans, embeddings)] with one embedding row per span.
+    The corpus vector and BM25 indexes are written once for the whole batch.
+    """
+    agent = IndexingAgent()
+    vectors, tokens = {}, {}
+
+    # Every document's snapshot is published when the stack unwinds, after the commit
+    with ExitStack() as snapshots:
+        for document_id, spans, embeddings in batch:
+            CHUNKS_PER_DOCUMENT.observe(len(spans))
+            snapshot = snapshots.enter_context(index_snapshot(document_id))
+            with stage("build_index"):
+                vectors[document_id], tokens[document_id] = agent.write_document_files(
+                    [span["text"] for span in spans], snapshot.index_path, snapshot.store_path, embeddings
+                )
+
+        with stage("build_index"):
+            corpus_index.add_documents(vectors)
+            corpus_lexical_index.add_documents(tokens)
+
+        # All chunk rows and statuses in one short transaction once the files are written
+        with stage("sql"):
+            for document_id, spans, _ in batch:
+                _replace_chunks(document_id, spans, db)
+                db.get(Document, document_id).status = "INDEXED"
+            db.commit()
+
+    for document_id, _, _ in batch:
+        index_cache.invalidate(document_id)
+        answer_cache.invalidate_document(document_id)
+
+
+def _replace_chunks(document_id: int, spans: list[dict], db: Session) -> None:
     # Remove existing chunks for document
     db.query(Chunk).filter(Chunk.document_id == document_id).delete()
-    
-    # Persist new chunks
-    for i, chunk in enumerate(chunks):
-        db.add(Chunk(document_id=document_id, chunk_index=i, text=chunk))
 
-    # Resolve index storage paths
-    index_path = INDEX_DIR / f"{document_id}.faiss"
-    map_path = INDEX_DIR / f"{document_id}_map.json"
+    # Persist new chunks in one executemany
+    if spans:
+        db.execute(insert(Chunk), [_chunk_row(document_id, i, span) for i, span in enumerate(spans)])
 
-    # Build and persist vector index
-    count = agent.build_index(chunks, index_path, map_path)
 
-    # Update document status
-    doc.status = "INDEXED"
-    db.commit()
+def _provenance(spans: list[dict]) -> np.ndarray:
+    # (page_start, page_end, char_start, char_end) per span, -1 for None
+    return np.asarray(
+        [[-1 if span[k] is None else span[k] for k in _PROVENANCE] for span in spans], dtype="int64"
+    ).reshape(-1, len(_PROVENANCE))
 
-    # Return indexed chunk count
-    return count
+
+def _replace_chunks_streaming(document_id: int, store_path, provenance_path, db: Session) -> None:
+    # Chunk rows from a built chunk store and its spilled provenance, STREAM_EMBED_BATCH rows at a time
+    db.query(Chunk).filter(Chunk.document_id == document_id).delete()
+
+    provenance = np.fromfile(provenance_path, dtype="int64").reshape(-1, len(_PROVENANCE))
+    store = ChunkStore(store_path)
+    try:
+        for first in range(0, len(store), STREAM_EMBED_BATCH):
+            rows = []
+            for i in range(first, min(first + STREAM_EMBED_BATCH, len(store))):
+                span = {k: (None if v < 0 else int(v)) for k, v in zip(_PROVENANCE, provenance[i])}
+                rows.append(_chunk_row(document_id, i, {"text": store.get(i), **span}))
+            db.execute(insert(Chunk), rows)
+    finally:
+        del provenance
+        store.close()
+
+
+def _chunk_row(document_id: int, chunk_index: int, span: dict) -> dict:
+    return {
+        "document_id": document_id,
+        "chunk_index": chunk_index,
+        "text": span["text"],
+        "page_start": span["page_start"],
+        "page_end": span["page_end"],
+        "char_start": span["char_start"],
+        "char_end": span["char_end"],
+    }
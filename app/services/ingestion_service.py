@@ -1,28 +1,82 @@
+from pathlib import Path
+from typing import Iterator
 from sqlalchemy.orm import Session
 from app.db.models import Document
 from app.agents.ingestion_agent import IngestionAgent
+from app.core.extraction_cache import extraction_cache
+from app.core.metrics import stage, EXTRACT_SECONDS_PER_PAGE
+from app.core.text_store import text_path, write_pages, iter_pages, link_or_copy
 
 def ingest_document(document_id: int, db: Session) -> str:
+    # Extract (or reuse) the document's text artifact and return the joined text
+    extract_document(document_id, db)
+    return IngestionAgent.join_pages(iter_pages(text_path(document_id)))
+
+
+def extract_document(document_id: int, db: Session, streaming: bool = False) -> int:
+    """
+    Extract a document into its page-per-line text artifact and mark it
+    TEXT_EXTRACTED. With streaming, pages are written as they are extracted
+    instead of being collected first. Returns the number of characters extracted.
+    """
     # Fetch document record
     doc = db.get(Document, document_id)
     if not doc:
         raise ValueError("Document not found")
 
-    # Initialize ingestion agent
-    agent = IngestionAgent()
-    
-    # Extract text from document
-    extracted_text = agent.extract_text(doc.path, doc.file_type)
+    artifact_path = text_path(document_id)
+
+    # Byte-identical uploads reuse a previous extraction
+    cached_path = extraction_cache.lookup(doc.content_hash) if doc.content_hash else None
+
+    if cached_path:
+        link_or_copy(cached_path, artifact_path)
+        chars = sum(len(text) for _, text in iter_pages(artifact_path))
+    else:
+        # Initialize ingestion agent
+        agent = IngestionAgent()
+
+        # Extract text from document and persist it page by page; streaming writes
+        # each page as soon as it is extracted instead of collecting them first
+        with stage("extract") as timer:
+            if streaming:
+                pages = agent.iter_pages(doc.path, doc.file_type)
+            else:
+                pages = agent.extract_pages(doc.path, doc.file_type)
+            page_count, chars = write_pages(artifact_path, pages)
+        if page_count:
+            EXTRACT_SECONDS_PER_PAGE.observe(timer.seconds / page_count, file_type=doc.file_type)
+
+        if doc.content_hash:
+            extraction_cache.put(doc.content_hash, artifact_path)
 
     # Handle extraction failure
-    if not extracted_text:
+    if not chars:
         doc.status = "FAILED_TEXT_EXTRACTION"
         db.commit()
         raise ValueError("No text could be extracted from document")
 
-    # Update document status
+    # Update document status and link the text artifact
+    doc.text_path = str(artifact_path)
     doc.status = "TEXT_EXTRACTED"
     db.commit()
 
-    # Return extracted content
-    return extracted_text
+    return chars
+
+
+def load_document_text(document_id: int, db: Session) -> str:
+    """
+    Read a document's persisted text artifact without re-running extraction.
+    """
+    return IngestionAgent.join_pages(load_document_pages(document_id, db))
+
+
+def load_document_pages(document_id: int, db: Session) -> Iterator[tuple[int, str]]:
+    # Stream (page_number, text) pairs from the persisted text artifact
+    doc = db.get(Document, document_id)
+    if not doc:
+        raise ValueError("Document not found")
+    if not doc.text_path:
+        raise ValueError("Document has no extracted text. Please extract or process it first.")
+
+    return iter_pages(Path(doc.text_path))
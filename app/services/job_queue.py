@@ -0,0 +1,341 @@
+import fcntl
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import (
+    JOB_WORKERS,
+    JOB_MAX_QUEUE_DEPTH,
+    JOB_HEARTBEAT_SECONDS,
+    JOB_STALE_SECONDS,
+    JOB_LOCK_PATH,
+)
+from app.core.metrics import registry
+from app.db.models import Document, Job
+from app.db.session import SessionLocal
+from app.services.orchestrator import Orchestrator
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("QUEUED", "RUNNING")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def owner_id() -> str:
+    # Identity recorded as a job's owner
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner: str | None) -> bool | None:
+    # Whether an owner process still exists: None when that can't be told from here
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _heartbeat(job_ids, owner: str, status: str) -> None:
+    # Refresh the heartbeat of jobs this owner still holds in the given status
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(Job)
+            .where(Job.id.in_(list(job_ids)), Job.owner == owner, Job.status == status)
+            .values(heartbeat_at=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_job(job_id: int, submitter: str) -> None:
+    """
+    Worker-process entry point: claim a queued job and run the orchestrated pipeline.
+    """
+    worker = owner_id()
+    db = SessionLocal()
+    try:
+        # Claim atomically, and only while the process that submitted it still owns it
+        # (a job swept to another process meanwhile runs there instead)
+        claimed = db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == "QUEUED", Job.owner == submitter)
+            .values(status="RUNNING", started_at=datetime.utcnow(), owner=worker, heartbeat_at=datetime.utcnow())
+        ).rowcount
+        db.commit()
+        if not claimed:
+            return
+
+        # The worker itself keeps the job alive while it runs
+        stop = threading.Event()
+        beat = threading.Thread(target=_beat, args=(job_id, worker, stop), name="job-heartbeat", daemon=True)
+        beat.start()
+
+        job = db.get(Job, job_id)
+        try:
+            result = Orchestrator().process_document(job.document_id, db)
+            job.status = "SUCCEEDED"
+            job.chunks_indexed = result["chunks_indexed"]
+        except Exception as e:
+            db.rollback()
+            job = db.get(Job, job_id)
+            job.status = "FAILED"
+            job.error = str(e)
+        finally:
+            stop.set()
+            beat.join()
+
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+        # Make this job's observations visible to GET /metrics without waiting for the next flush
+        registry.flush()
+
+
+def _beat(job_id: int, worker: str, stop: threading.Event) -> None:
+    while not stop.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            _heartbeat([job_id], worker, "RUNNING")
+        except Exception:
+            logger.exception("Job %s heartbeat failed", job_id)
+
+
+def _warm_worker() -> None:
+    # Load the embedding model once per worker process, not per job.
+    # A failure here must not break the pool; the job itself will report it.
+    from app.core.model_registry import warmup
+    try:
+        warmup()
+    except Exception:
+        logger.exception("Worker warmup failed")
+
+
+def _active_job(document_id: int, db: Session) -> Job | None:
+    return (
+        db.query(Job)
+        .filter(Job.document_id == document_id, Job.status.in_(ACTIVE_STATUSES))
+        .order_by(Job.id.desc())
+        .first()
+    )
+
+
+class JobQueue:
+    """
+    Persistent job queue backed by the jobs table and a bounded process pool.
+
+    Every active job has an owner: the API process that queued it (which
+    heartbeats it until a worker claims it), then the worker process running it.
+    One process per node, holding JOB_LOCK_PATH, sweeps jobs whose owner has
+    exited or gone quiet for JOB_STALE_SECONDS, and takes them over; jobs that
+    another live process is running are left alone.
+    """
+
+    def __init__(self, max_workers: int, max_queue_depth: int, lock_path=JOB_LOCK_PATH):
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.lock_path = lock_path
+        self.owner = owner_id()
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending: set[int] = set()
+        self._lock_fd = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._ensure_executor()
+        self._stop.clear()
+        self._tick()
+        self._thread = threading.Thread(target=self._run, name="job-sweeper", daemon=True)
+        self._thread.start()
+
+    def _ensure_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Spawned workers avoid inheriting locks and threads from the API process
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_worker,
+                )
+            return self._executor
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def enqueue(self, document_id: int, db: Session) -> Job:
+        doc = db.get(Document, document_id)
+        if not doc:
+            raise ValueError("Document not found")
+
+        # Reuse an in-flight job for the same document
+        active = _active_job(document_id, db)
+        if active:
+            return active
+
+        depth = db.query(Job).filter(Job.status == "QUEUED").count()
+        if depth >= self.max_queue_depth:
+            raise QueueFullError(f"Job queue is full ({depth} jobs queued)")
+
+        job = Job(document_id=document_id, status="QUEUED", owner=self.owner, heartbeat_at=datetime.utcnow())
+        db.add(job)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another request queued the document after the check above (unique active job)
+            db.rollback()
+            active = _active_job(document_id, db)
+            if active:
+                return active
+            raise
+        db.refresh(job)
+
+        self._submit(job.id)
+        return job
+
+    def _submit(self, job_id: int) -> None:
+        with self._lock:
+            self._pending.add(job_id)
+        try:
+            future = self._ensure_executor().submit(run_job, job_id, self.owner)
+        except BrokenProcessPool:
+            # A worker died and took the pool with it; start a fresh one
+            with self._lock:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            future = self._ensure_executor().submit(run_job, job_id, self.owner)
+        future.add_done_callback(lambda f: self._on_done(job_id, f))
+
+    def _on_done(self, job_id: int, future) -> None:
+        with self._lock:
+            self._pending.discard(job_id)
+        # run_job records its own failures; this only catches a crashed worker
+        if future.cancelled() or future.exception() is None:
+            return
+        logger.error("Job %s worker crashed: %s", job_id, future.exception())
+        db = SessionLocal()
+        try:
+            job = db.get(Job, job_id)
+            if job and job.status in ACTIVE_STATUSES:
+                job.status = "FAILED"
+                job.error = f"Worker crashed: {future.exception()}"
+                job.finished_at = datetime.utcnow()
+                db.commit()
+        finally:
+            db.close()
+
+    def _run(self) -> None:
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                self._tick()
+            except Exception:
+                logger.exception("Job queue heartbeat/sweep failed")
+
+    def _tick(self) -> None:
+        # Keep this process's queued jobs alive, then sweep if this is the node's sweeper
+        with self._lock:
+            pending = list(self._pending)
+        if pending:
+            _heartbeat(pending, self.owner, "QUEUED")
+        if self._is_sweeper():
+            self.sweep()
+
+    def _is_sweeper(self) -> bool:
+        # The first process to lock the file sweeps until it exits; the others retry each tick
+        if self._lock_fd is not None:
+            return True
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def sweep(self) -> int:
+        """
+        Take over active jobs whose owner has exited (on this host) or stopped
+        heartbeating, and resubmit them here. Returns the number taken over.
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        db = SessionLocal()
+        try:
+            candidates = (
+                db.query(Job.id, Job.status, Job.owner, Job.heartbeat_at)
+                .filter(Job.status.in_(ACTIVE_STATUSES), or_(Job.owner.is_(None), Job.owner != self.owner))
+                .order_by(Job.id)
+                .all()
+            )
+            job_ids = []
+            for job in candidates:
+                stale = job.heartbeat_at is None or job.heartbeat_at < stale_before
+                if not stale and _owner_alive(job.owner) is not False:
+                    continue
+
+                # Only if nobody else changed it meanwhile; interrupted runs start over
+                taken = db.execute(
+                    update(Job)
+                    .where(
+                        Job.id == job.id,
+                        Job.status == job.status,
+                        Job.owner.is_(None) if job.owner is None else Job.owner == job.owner,
+                    )
+                    .values(status="QUEUED", started_at=None, owner=self.owner, heartbeat_at=datetime.utcnow())
+                ).rowcount
+                db.commit()
+                if taken:
+                    job_ids.append(job.id)
+        finally:
+            db.close()
+
+        for job_id in job_ids:
+            self._submit(job_id)
+        if job_ids:
+            logger.info("Took over %d orphaned jobs", len(job_ids))
+        return len(job_ids)
+
+
+def job_to_dict(job: Job, document_status: str | None = None) -> dict:
+    return {
+        "id": job.id,
+        "document_id": job.document_id,
+        "status": job.status,
+        "document_status": document_status,
+        "chunks_indexed": job.chunks_indexed,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# Process-wide job queue
+job_queue = JobQueue(JOB_WORKERS, JOB_MAX_QUEUE_DEPTH)
@@ -1,7 +1,10 @@
 from sqlalchemy.orm import Session
 from app.db.models import Document
-from app.services.ingestion_service import ingest_document
-from app.services.indexing_service import index_document
+from app.agents.ingestion_agent import IngestionAgent
+from app.core.config import STREAMING_MIN_PAGES
+from app.core.metrics import stage
+from app.services.ingestion_service import extract_document, load_document_pages
+from app.services.indexing_service import index_document, index_document_streaming, update_document_index
 
 class Orchestrator:
     """
@@ -9,23 +12,41 @@ class Orchestrator:
     Agents never call each other directly; APIs call the Orchestrator.
     """
 
-    def process_document(self, document_id: int, db: Session) -> dict:
+    def process_document(self, document_id: int, db: Session, streaming: bool | None = None) -> dict:
+        """
+        streaming: bounded-memory mode, where pages flow from extraction to the
+        index one at a time and chunks are embedded in fixed-size batches.
+        None picks it for documents with at least STREAMING_MIN_PAGES pages.
+
+        A document that was indexed before is updated incrementally (only the
+        chunks that changed are embedded and written) when its index allows it.
+        """
         doc = db.get(Document, document_id)
         if not doc:
             raise ValueError("Document not found")
 
-        # Step 1: Extract text (IngestionAgent via service)
-        doc.status = "PROCESSING_TEXT"
-        db.commit()
-        text = ingest_document(document_id, db)
+        if streaming is None:
+            streaming = IngestionAgent().page_count(doc.path, doc.file_type) >= STREAMING_MIN_PAGES
+
+        with stage("process"):
+            # Step 1: Extract text (IngestionAgent via service)
+            doc.status = "PROCESSING_TEXT"
+            db.commit()
+            extract_document(document_id, db, streaming=streaming)
 
-        # Step 2: Index text (IndexingAgent via service)
-        doc.status = "PROCESSING_INDEX"
-        db.commit()
-        chunks_count = index_document(document_id, text, db)
+            # Step 2: Index text (IndexingAgent via service)
+            doc.status = "PROCESSING_INDEX"
+            db.commit()
+            chunks_count = update_document_index(document_id, load_document_pages(document_id, db), db)
+            incremental = chunks_count is not None
+            if not incremental:
+                index = index_document_streaming if streaming else index_document
+                chunks_count = index(document_id, load_document_pages(document_id, db), db)
 
         return {
             "document_id": document_id,
             "status": "INDEXED",
             "chunks_indexed": chunks_count,
+            "streaming": streaming,
+            "incremental": incremental,
         }
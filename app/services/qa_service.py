@@ -1,41 +1,317 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
 from app.db.models import Document, Chunk
-from app.agents.qa_agent import QAAgent
+from app.agents.qa_agent import QAAgent, AnswerGenerationError
+from app.core.answer_cache import answer_cache
+from app.core.corpus_index import corpus_index
+from app.core.index_cache import index_version
+from app.core.config import RETRIEVAL_MODE, QA_BATCH_CONCURRENCY
+from app.core.metrics import stage
+
+def ask_question(document_id: int, question: str, db: Session, top_k: int = 5, mode: str | None = None):
+    _check_indexed(document_id, db)
+
+    # Repeated questions against the same index version skip retrieval and the LLM
+    scope = (document_id, index_version(document_id), top_k, mode or RETRIEVAL_MODE)
+    cached = answer_cache.get_exact(scope, question)
+    if cached:
+        return cached
+
+    agent = QAAgent()
+    q_emb = None
+    if _uses_embeddings(mode):
+        q_emb = agent.embed_question(question)
+        cached = answer_cache.get_similar(scope, q_emb)
+        if cached:
+            return cached
+
+    contexts, sources = retrieve_contexts(document_id, question, db, top_k=top_k, q_emb=q_emb, mode=mode)
+    # Raises AnswerGenerationError, so failures are never cached
+    answer = agent.answer_from_context(question, contexts)
+    answer_cache.put(scope, question, q_emb, answer, sources)
+
+    return answer, sources
+
+
+def ask_corpus_question(
+    question: str,
+    db: Session,
+    top_k: int = 5,
+    document_ids: list[int] | None = None,
+    mode: str | None = None,
+):
+    """
+    Answer a question from the corpus-wide index.
+    document_ids=None searches every indexed document.
+    """
+    scope = _corpus_scope(top_k, document_ids, mode)
+    cached = answer_cache.get_exact(scope, question)
+    if cached:
+        return cached
+
+    agent = QAAgent()
+    q_emb = None
+    if _uses_embeddings(mode):
+        q_emb = agent.embed_question(question)
+        cached = answer_cache.get_similar(scope, q_emb)
+        if cached:
+            return cached
+
+    contexts, sources = retrieve_corpus_contexts(
+        question, db, top_k=top_k, document_ids=document_ids, q_emb=q_emb, mode=mode
+    )
+    answer = agent.answer_from_context(question, contexts)
+    answer_cache.put(scope, question, q_emb, answer, sources)
+
+    return answer, sources
+
+
+def ask_questions(
+    questions: list[str],
+    db: Session,
+    top_k: int = 5,
+    document_id: int | None = None,
+    document_ids: list[int] | None = None,
+    mode: str | None = None,
+) -> list[dict]:
+    """
+    Answer several questions about one document (or, without document_id, the
+    corpus restricted to document_ids) with one index load, one batched encode
+    and one multi-query search. LLM calls run concurrently, at most
+    QA_BATCH_CONCURRENCY at a time.
+
+    Returns one result per question, in order:
+    {"question", "success": True, "answer", "sources"} or
+    {"question", "success": False, "error": {"code", "message"}} (plus "sources"
+    when only the LLM call failed).
+    """
+    if document_id is not None:
+        _check_indexed(document_id, db)
+        scope = (document_id, index_version(document_id), top_k, mode or RETRIEVAL_MODE)
+    else:
+        _check_corpus_documents(document_ids, db)
+        scope = _corpus_scope(top_k, document_ids, mode)
+
+    results = [None] * len(questions)
+    for i, question in enumerate(questions):
+        cached = answer_cache.get_exact(scope, question)
+        if cached:
+            results[i] = _answered(question, *cached)
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    agent = QAAgent()
+    embeddings = {}
+    if _uses_embeddings(mode):
+        q_embs = agent.embed_questions([questions[i] for i in pending])
+        for i, q_emb in zip(pending, q_embs):
+            embeddings[i] = q_emb
+            cached = answer_cache.get_similar(scope, q_emb)
+            if cached:
+                results[i] = _answered(questions[i], *cached)
+
+    indices = [i for i in pending if results[i] is None]
+    if not indices:
+        return results
+    texts = [questions[i] for i in indices]
+    remaining_embs = np.stack([embeddings[i] for i in indices]) if embeddings else None
+
+    try:
+        if document_id is not None:
+            retrieved = agent.retrieve_many(document_id, texts, top_k=top_k, q_embs=remaining_embs, mode=mode)
+            contexts = _document_contexts(document_id, retrieved, db)
+        else:
+            retrieved = agent.retrieve_corpus_many(
+                texts, top_k=top_k, document_ids=document_ids, q_embs=remaining_embs, mode=mode
+            )
+            contexts = _corpus_contexts(retrieved, db)
+    except Exception as e:
+        # Retrieval shares one index, so a failure applies to every remaining question
+        for i in indices:
+            results[i] = _failed(questions[i], "QA_FAILED", str(e))
+        return results
+
+    # Fan the LLM calls out; each task runs in a copy of the request context so its
+    # stage timings still reach the request's Server-Timing breakdown
+    with ThreadPoolExecutor(max_workers=min(QA_BATCH_CONCURRENCY, len(indices))) as pool:
+        futures = [
+            pool.submit(contextvars.copy_context().run, agent.answer_from_context, question, question_contexts)
+            for question, (question_contexts, _) in zip(texts, contexts)
+        ]
+
+    for i, (_, sources), future in zip(indices, contexts, futures):
+        try:
+            answer = future.result()
+        except AnswerGenerationError as e:
+            results[i] = _failed(questions[i], "LLM_FAILED", str(e), sources)
+            continue
+        answer_cache.put(scope, questions[i], embeddings.get(i), answer, sources)
+        results[i] = _answered(questions[i], answer, sources)
+
+    return results
+
 
-def ask_question(document_id: int, question: str, db: Session, top_k: int = 5):
+def _uses_embeddings(mode: str | None) -> bool:
+    # Lexical retrieval needs no question embedding, and the semantic cache would
+    # conflate identifiers that differ by a character ("AB-1234" vs "AB-1235")
+    return (mode or RETRIEVAL_MODE) != "lexical"
+
+
+def _answered(question: str, answer: str, sources: list) -> dict:
+    return {"question": question, "success": True, "answer": answer, "sources": sources}
+
+
+def _failed(question: str, code: str, message: str, sources: list | None = None) -> dict:
+    result = {"question": question, "success": False, "error": {"code": code, "message": message}}
+    if sources is not None:
+        result["sources"] = sources
+    return result
+
+
+def _corpus_scope(top_k: int, document_ids: list[int] | None, mode: str | None) -> tuple:
+    # Answer cache scope for a corpus question
+    return (
+        "corpus",
+        corpus_index.version(),
+        top_k,
+        "all" if document_ids is None else tuple(sorted(set(document_ids))),
+        mode or RETRIEVAL_MODE,
+    )
+
+
+def _check_indexed(document_id: int, db: Session) -> None:
     doc = db.get(Document, document_id)
     if not doc:
         raise ValueError("Document not found")
 
-    if doc.status != "INDEXED":
+    # A document being re-processed keeps answering from its current snapshot
+    if doc.status != "INDEXED" and index_version(document_id) is None:
         raise ValueError("Document must be indexed before asking questions")
 
+
+def stream_answer(question: str, contexts: list[str], usage: dict | None = None):
+    # Async iterator of answer tokens for the SSE endpoint; usage is filled in at the end
+    return QAAgent().stream_answer(question, contexts, usage)
+
+
+def retrieve_contexts(
+    document_id: int,
+    question: str,
+    db: Session,
+    top_k: int = 5,
+    q_emb=None,
+    mode: str | None = None,
+):
+    # Retrieval half of ask_question: (contexts, sources) without calling the LLM
+    _check_indexed(document_id, db)
+
     agent = QAAgent()
-    retrieved = agent.retrieve(document_id, question, top_k=top_k)
-
-    # Resolve retrieved vector_ids -> chunk_index -> chunk text
-    contexts = []
-    sources = []
-
-    for r in retrieved:
-        # vector_id == chunk_index by our design
-        chunk_index = r["vector_id"]
-
-        chunk = (
-            db.query(Chunk)
-            .filter(Chunk.document_id == document_id, Chunk.chunk_index == chunk_index)
-            .first()
-        )
-        if not chunk:
-            continue
+    retrieved = agent.retrieve(document_id, question, top_k=top_k, q_emb=q_emb, mode=mode)
+    return _document_contexts(document_id, [retrieved], db)[0]
 
-        contexts.append(chunk.text)
-        sources.append({
-            "chunk_id": chunk.id,
-            "chunk_index": chunk.chunk_index,
-            "preview": chunk.text[:200]
-        })
 
-    answer = agent.answer_from_context(question, contexts)
+def _document_contexts(document_id: int, batch: list[list[dict]], db: Session) -> list[tuple[list, list]]:
+    # (contexts, sources) per retrieved list of one document
+    # Chunk text comes from the chunk store; the database only supplies chunk ids
 
-    return answer, sources
+    # vector_id == chunk_index by our design; fetch all chunk ids in one query
+    wanted = {r["vector_id"] for retrieved in batch for r in retrieved}
+    with stage("sql"):
+        rows = {
+            row.chunk_index: row
+            for row in db.query(Chunk.chunk_index, Chunk.id, Chunk.page_start, Chunk.page_end)
+            .filter(Chunk.document_id == document_id, Chunk.chunk_index.in_(wanted))
+        }
+
+    results = []
+    for retrieved in batch:
+        contexts = []
+        sources = []
+        for r in retrieved:
+            chunk_index = r["vector_id"]
+            row = rows.get(chunk_index)
+            if row is None:
+                continue
+
+            contexts.append(r["text"])
+            sources.append({
+                "chunk_id": row.id,
+                "chunk_index": chunk_index,
+                "page_start": row.page_start,
+                "page_end": row.page_end,
+                "preview": r["preview"]
+            })
+        results.append((contexts, sources))
+
+    return results
+
+
+def retrieve_corpus_contexts(
+    question: str,
+    db: Session,
+    top_k: int = 5,
+    document_ids: list[int] | None = None,
+    q_emb=None,
+    mode: str | None = None,
+):
+    # Retrieval half of ask_corpus_question
+    _check_corpus_documents(document_ids, db)
+
+    agent = QAAgent()
+    retrieved = agent.retrieve_corpus(question, top_k=top_k, document_ids=document_ids, q_emb=q_emb, mode=mode)
+    return _corpus_contexts([retrieved], db)[0]
+
+
+def _check_corpus_documents(document_ids: list[int] | None, db: Session) -> None:
+    if document_ids is None:
+        return
+    # Only search documents that exist and are indexed (or being re-indexed)
+    indexed = {
+        d.id for d in db.query(Document.id, Document.status).filter(Document.id.in_(document_ids))
+        if d.status == "INDEXED" or index_version(d.id) is not None
+    }
+    missing = sorted(set(document_ids) - indexed)
+    if missing:
+        raise ValueError(f"Documents not found or not indexed: {missing}")
+
+
+def _corpus_contexts(batch: list[list[dict]], db: Session) -> list[tuple[list, list]]:
+    # (contexts, sources) per retrieved list of corpus hits
+
+    # One query for every hit's chunk id, keyed by (document_id, chunk_index)
+    keys = list({(r["document_id"], r["chunk_index"]) for retrieved in batch for r in retrieved})
+    with stage("sql"):
+        rows = {
+            (row.document_id, row.chunk_index): row
+            for row in db.query(Chunk.document_id, Chunk.chunk_index, Chunk.id, Chunk.page_start, Chunk.page_end)
+            .filter(tuple_(Chunk.document_id, Chunk.chunk_index).in_(keys))
+        } if keys else {}
+
+    results = []
+    for retrieved in batch:
+        contexts = []
+        sources = []
+        for r in retrieved:
+            row = rows.get((r["document_id"], r["chunk_index"]))
+            if row is None:
+                continue
+
+            contexts.append(r["text"])
+            sources.append({
+                "document_id": r["document_id"],
+                "chunk_id": row.id,
+                "chunk_index": r["chunk_index"],
+                "page_start": row.page_start,
+                "page_end": row.page_end,
+                "similarity": r["similarity"],
+                "preview": r["text"][:200]
+            })
+        results.append((contexts, sources))
+
+    return results
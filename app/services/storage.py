@@ -1,7 +1,11 @@
+import hashlib
+import os
 import uuid
 from pathlib import Path
 from fastapi import UploadFile
-from app.core.config import UPLOAD_DIR
+from fastapi.concurrency import run_in_threadpool
+from app.core.config import UPLOAD_DIR, UPLOAD_CHUNK_BYTES
+from app.services.validators import validate_size, validate_not_empty
 
 def ensure_storage_dirs():
     UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
@@ -14,14 +18,63 @@ def safe_filename(original_name: str) -> str:
     ext = Path(original_name).suffix.lower()
     return f"{uuid.uuid4().hex}{ext}"
 
-async def save_upload(file: UploadFile) -> Path:
-    ensure_storage_dirs()
+async def save_upload(file: UploadFile) -> tuple[Path, int, str]:
+    """
+    Stream an upload to UPLOAD_DIR in fixed-size chunks.
+    Size limits are enforced as bytes arrive and the SHA-256 is computed in the same pass.
+    Disk I/O runs in the threadpool so other requests keep being served meanwhile.
+    Returns (path, size_bytes, sha256_hex).
+    """
+    await run_in_threadpool(ensure_storage_dirs)
     filename = safe_filename(file.filename)
     dest = UPLOAD_DIR / filename
 
-    content = await file.read()
-    dest.write_bytes(content)
+    # Write to a temp name in the same directory, then rename atomically
+    tmp = UPLOAD_DIR / f".{filename}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        out = await run_in_threadpool(open, tmp, "wb")
+        try:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                validate_size(size)
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        finally:
+            await run_in_threadpool(out.close)
+        validate_not_empty(size)
+        await run_in_threadpool(os.replace, tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    return dest, size, digest.hexdigest()
+
+
+def save_local_file(source: Path) -> tuple[Path, int, str]:
+    """
+    Copy a local file into UPLOAD_DIR, hashing it in the same pass (bulk ingestion
+    from a directory). Returns (path, size_bytes, sha256_hex) like save_upload.
+    """
+    ensure_storage_dirs()
+    filename = safe_filename(source.name)
+    dest = UPLOAD_DIR / filename
+
+    tmp = UPLOAD_DIR / f".{filename}.part"
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(source, "rb") as src, open(tmp, "wb") as out:
+            while chunk := src.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
-    # reset pointer (good habit)
-    file.file.seek(0)
-    return dest
+    return dest, size, digest.hexdigest()
@@ -17,15 +17,14 @@ def validate_upload(file: UploadFile) -> str:
         )
     return ext
 
-async def validate_size(file: UploadFile) -> None:
-    # Read file into memory once in Phase 1 for simplicity; later we can stream if needed.
-    data = await file.read()
-    if len(data) == 0:
-        raise HTTPException(status_code=400, detail={"code": "EMPTY_FILE", "message": "Uploaded file is empty."})
-    if len(data) > MAX_FILE_SIZE_BYTES:
+def validate_size(size: int) -> None:
+    # Called as bytes arrive, so oversized uploads are rejected before they are fully written
+    if size > MAX_FILE_SIZE_BYTES:
         raise HTTPException(
             status_code=413,
             detail={"code": "FILE_TOO_LARGE", "message": f"File exceeds {MAX_FILE_SIZE_BYTES} bytes limit."}
         )
-    # Put pointer back for subsequent reads
-    file.file.seek(0)
+
+def validate_not_empty(size: int) -> None:
+    if size == 0:
+        raise HTTPException(status_code=400, detail={"code": "EMPTY_FILE", "message": "Uploaded file is empty."})
@@ -0,0 +1,5 @@
+"""
+End-to-end performance benchmarks.
+
+Run with `python -m bench.run`; see README.md ("Benchmarks") for options.
+"""
@@ -0,0 +1,74 @@
+import random
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+# Small fixed vocabulary so chunking, embedding and retrieval see realistic prose
+_WORDS = (
+    "contract agreement party termination fee payment invoice delivery schedule "
+    "warranty liability clause notice period renewal service level report revenue "
+    "quarter growth margin customer supplier audit compliance policy risk model "
+    "training dataset accuracy validation deployment monitoring drift latency "
+    "throughput memory storage index retrieval question answer document page "
+    "section appendix figure table summary conclusion method result analysis"
+).split()
+
+LINES_PER_PAGE = 40
+
+
+def sentence(rng: random.Random) -> str:
+    words = rng.choices(_WORDS, k=rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def page_lines(rng: random.Random, lines: int = LINES_PER_PAGE) -> list[str]:
+    # Wrap a paragraph of sentences to ~90 characters per line
+    text = " ".join(sentence(rng) for _ in range(lines // 2))
+    out, line = [], ""
+    for word in text.split():
+        if len(line) + len(word) + 1 > 90:
+            out.append(line)
+            line = word
+        else:
+            line = f"{line} {word}".strip()
+    out.append(line)
+    return out[:lines]
+
+
+def questions(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return [
+        f"What does the document say about {' and '.join(rng.sample(_WORDS, 2))}?"
+        for _ in range(count)
+    ]
+
+
+def make_pdf(path: Path, pages: int, scanned: bool = False, seed: int = 0) -> Path:
+    """
+    Write a synthetic PDF. Text PDFs carry a text layer; scanned PDFs contain
+    only a rendered image per page, so extraction has to go through OCR.
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=612, height=792)
+        page.insert_text((50, 60), "\n".join(page_lines(rng)), fontsize=9)
+        if scanned:
+            pix = page.get_pixmap(dpi=150)
+            doc.delete_page(-1)
+            page = doc.new_page(width=612, height=792)
+            page.insert_image(page.rect, pixmap=pix)
+    doc.save(str(path), garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def make_image(path: Path, seed: int = 0) -> Path:
+    # Single scanned page saved as PNG
+    rng = random.Random(seed)
+    doc = fitz.open()
+    page = doc.new_page(width=612, height=792)
+    page.insert_text((50, 60), "\n".join(page_lines(rng)), fontsize=9)
+    page.get_pixmap(dpi=150).save(str(path))
+    doc.close()
+    return path
@@ -0,0 +1,294 @@
+"""
+End-to-end benchmark: synthetic corpora -> per-stage timings -> JSON results.
+
+    python -m bench.run --pdf-pages 10,100 --out bench/results.json
+    python -m bench.run --baseline bench/baseline.json   # exit 1 on regression
+    python -m bench.run --save-baseline bench/baseline.json
+
+Each run uses a fresh storage directory and a stub OpenAI client, so results
+only depend on this codebase, the embedding model and the host.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from bench import corpus
+
+STAGES = ("process", "extract", "chunk", "embed", "build_index", "retrieve", "ask")
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def _peak_rss_bytes() -> int:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def summarize(samples: list[float], units: float, unit_name: str) -> dict:
+    """
+    Latency percentiles (ms) over per-call samples (seconds), plus throughput
+    as `units` processed per second of median call time.
+    """
+    ms = np.asarray(samples) * 1000
+    p50 = float(np.percentile(ms, 50))
+    return {
+        "samples": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "throughput": round(units / (p50 / 1000), 3) if p50 else None,
+        "throughput_unit": unit_name,
+        "rss_bytes": _rss_bytes(),
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def _timed(fn, repeat: int):
+    samples, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - started)
+    return samples, result
+
+
+def build_corpora(args, directory: Path) -> list[dict]:
+    corpora = []
+    for pages in args.pdf_pages:
+        corpora.append({"name": f"pdf-text-{pages}", "pages": pages,
+                        "path": corpus.make_pdf(directory / f"text-{pages}.pdf", pages, seed=pages)})
+
+    # Scanned inputs go through OCR; skip them on hosts without Tesseract
+    if shutil.which("tesseract"):
+        for pages in args.scanned_pages:
+            corpora.append({"name": f"pdf-scanned-{pages}", "pages": pages,
+                            "path": corpus.make_pdf(directory / f"scanned-{pages}.pdf", pages, scanned=True, seed=pages)})
+        if args.images:
+            corpora.append({"name": "image-1", "pages": 1,
+                            "path": corpus.make_image(directory / "scanned-1.png")})
+    elif args.scanned_pages or args.images:
+        print("tesseract not found; skipping scanned PDF and image corpora", file=sys.stderr)
+
+    return corpora
+
+
+def bench_corpus(entry: dict, client, args) -> dict:
+    from app.agents.indexing_agent import IndexingAgent
+    from app.agents.ingestion_agent import IngestionAgent
+    from app.agents.qa_agent import QAAgent
+
+    name, pages, path = entry["name"], entry["pages"], entry["path"]
+    file_type = path.suffix.lstrip(".")
+    results = {}
+    print(f"[{name}] {path.stat().st_size / 1024:.0f} KB", file=sys.stderr)
+
+    # Full upload + synchronous processing through the API
+    def process():
+        with open(path, "rb") as f:
+            upload = client.post("/documents/upload", files={"file": (path.name, f)})
+        upload.raise_for_status()
+        document_id = upload.json()["document"]["id"]
+        response = client.post(f"/documents/{document_id}/process", params={"sync": "true"})
+        response.raise_for_status()
+        return document_id
+
+    samples, document_id = _timed(process, 1)
+    results["process"] = summarize(samples, pages, "pages/s")
+
+    # Individual stages, called directly on the agents
+    ingestion = IngestionAgent()
+    samples, text = _timed(lambda: ingestion.extract_text(str(path), file_type), args.repeat)
+    results["extract"] = summarize(samples, pages, "pages/s")
+
+    indexing = IndexingAgent()
+    samples, chunks = _timed(lambda: indexing.chunk_text(text), args.repeat)
+    results["chunk"] = summarize(samples, len(chunks), "chunks/s")
+
+    # Model cost only; the embedding cache is bypassed here
+    samples, _ = _timed(lambda: indexing.model.encode(chunks, show_progress_bar=False), args.repeat)
+    results["embed"] = summarize(samples, len(chunks), "chunks/s")
+
+    # Index construction and persistence; embeddings come from the (primed) embedding cache
+    work = Path(tempfile.mkdtemp(prefix="build-"))
+    indexing.embed_chunks(chunks)
+    samples, _ = _timed(
+        lambda: indexing.build_index(chunks, work / "bench.faiss", work / "bench.chunks"),
+        args.repeat,
+    )
+    results["build_index"] = summarize(samples, len(chunks), "chunks/s")
+    shutil.rmtree(work, ignore_errors=True)
+
+    questions = corpus.questions(args.queries, seed=pages)
+    qa = QAAgent()
+    samples = []
+    for question in questions:
+        started = time.perf_counter()
+        qa.retrieve(document_id, question, top_k=args.top_k)
+        samples.append(time.perf_counter() - started)
+    results["retrieve"] = summarize(samples, 1, "queries/s")
+
+    samples = []
+    for question in questions:
+        started = time.perf_counter()
+        response = client.post(
+            "/questions/ask",
+            json={"document_id": document_id, "question": question, "top_k": args.top_k},
+        )
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+    results["ask"] = summarize(samples, 1, "queries/s")
+
+    return {f"{stage}/{name}": results[stage] for stage in STAGES}
+
+
+def compare(results: dict, baseline: dict, threshold: float, min_delta_ms: float) -> list[str]:
+    """
+    Report stages whose p50 or p95 got slower than the baseline by more than
+    `threshold` (fraction) and `min_delta_ms`. Returns the regressed keys.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<36}{'p50 base':>12}{'p50 now':>12}{'p95 base':>12}{'p95 now':>12}")
+    for key, current in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        flag = ""
+        for metric in ("p50_ms", "p95_ms"):
+            delta = current[metric] - base[metric]
+            if delta > min_delta_ms and current[metric] > base[metric] * (1 + threshold):
+                flag = "  REGRESSION"
+        if flag:
+            regressions.append(key)
+        print(f"{key:<36}{base['p50_ms']:>12.2f}{current['p50_ms']:>12.2f}"
+              f"{base['p95_ms']:>12.2f}{current['p95_ms']:>12.2f}{flag}")
+    return regressions
+
+
+def _metadata(args) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    from app.core.config import EMBEDDING_MODEL_NAME
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "embedding_model": "stub" if args.stub_embeddings else EMBEDDING_MODEL_NAME,
+        "llm_latency_ms": args.llm_latency_ms,
+        "repeat": args.repeat,
+        "queries": args.queries,
+        "top_k": args.top_k,
+    }
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf-pages", type=_int_list, default=[10, 100, 500, 2000],
+                        help="text PDF sizes in pages (default: 10,100,500,2000)")
+    parser.add_argument("--scanned-pages", type=_int_list, default=[10, 100],
+                        help="scanned (OCR) PDF sizes in pages (default: 10,100)")
+    parser.add_argument("--no-images", dest="images", action="store_false",
+                        help="skip the single-page PNG corpus")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions per stage (default: 3)")
+    parser.add_argument("--queries", type=int, default=50, help="questions per corpus (default: 50)")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0,
+                        help="simulated LLM latency per completion (default: 0)")
+    parser.add_argument("--stub-embeddings", action="store_true",
+                        help="use a hashing embedder instead of the real model")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="keep the answer cache enabled during /questions/ask")
+    parser.add_argument("--workdir", type=Path, help="keep generated files and storage here")
+    parser.add_argument("--out", type=Path, default=Path("bench/results.json"))
+    parser.add_argument("--baseline", type=Path, help="compare against this results file")
+    parser.add_argument("--save-baseline", type=Path, help="also write results here as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown vs baseline as a fraction (default: 0.2)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="ignore slowdowns smaller than this (default: 1ms)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="docai-bench-"))
+    storage = workdir / "storage"
+    storage.mkdir(parents=True, exist_ok=True)
+
+    # Configuration is read at import time, so point it at scratch storage first
+    os.environ["STORAGE_DIR"] = str(storage)
+    if not args.answer_cache:
+        os.environ["ANSWER_CACHE_MAX_ENTRIES"] = "0"
+
+    from bench import stubs
+    stubs.install(args.llm_latency_ms / 1000, args.stub_embeddings)
+
+    # Without the lifespan there is no background warmup; load the model up front
+    # so the first "process" sample doesn't include it
+    from app.core.model_registry import warmup
+    warmup()
+
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    # No lifespan: /process?sync=true runs inline, so the job worker pool is not needed
+    client = TestClient(app)
+
+    results = {}
+    for entry in build_corpora(args, workdir):
+        results.update(bench_corpus(entry, client, args))
+
+    report = {"meta": _metadata(args), "results": results}
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    args.out.write_text(json.dumps(report, indent=2))
+    print(f"wrote {args.out}", file=sys.stderr)
+
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(json.dumps(report, indent=2))
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())["results"]
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) vs {args.baseline}", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
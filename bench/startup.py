@@ -0,0 +1,135 @@
+"""
+Cold-start budget: import time of app.main and time until /health and /ready answer.
+
+    python -m bench.startup                      # import budget only
+    python -m bench.startup --serve              # also start uvicorn and poll /health, /ready
+    python -m bench.startup --budget-ms 1200 --health-budget-ms 2000
+
+Exits 1 when a budget is exceeded or a module that should load lazily (torch,
+sentence_transformers, openai, faiss, PyMuPDF, ...) is imported by app.main.
+"""
+import argparse
+import importlib.util
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+# Loaded on first use or by the background warmup, never at import time
+LAZY_MODULES = ("torch", "sentence_transformers", "transformers", "onnxruntime", "openai", "faiss", "fitz", "pytesseract")
+
+
+def _env(storage: str) -> dict:
+    env = dict(os.environ, STORAGE_DIR=storage)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    return env
+
+
+def measure_imports(storage: str) -> tuple[float, list[tuple[str, float]], list[str]]:
+    """
+    Import app.main in a fresh interpreter with -X importtime.
+    Returns (total_ms, [(top-level package, ms)] heaviest first, lazy modules that were imported).
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True, text=True, env=_env(storage),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import app.main failed:\n{proc.stderr[-2000:]}")
+
+    # Self time of every module, summed per top-level package
+    packages = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line[len("import time:"):].split("|")
+        if not own.strip().isdigit():
+            continue  # header line
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + int(own) / 1000
+
+    total = sum(packages.values())
+    top = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return total, top, sorted(m for m in LAZY_MODULES if m in packages)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url: str, started: float, deadline: float) -> float | None:
+    # Seconds from started until url returns 200, or None past the deadline
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return round(time.perf_counter() - started, 3)
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.01)
+    return None
+
+
+def measure_serve(storage: str, timeout: float) -> dict:
+    # Start uvicorn and time the first successful /health and /ready from process start
+    if importlib.util.find_spec("uvicorn") is None:
+        raise RuntimeError("--serve needs uvicorn (pip install -r requirements.txt)")
+
+    port = _free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=_env(storage), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base = f"http://127.0.0.1:{port}"
+        deadline = started + timeout
+        return {
+            "health_s": _wait_for(f"{base}/health", started, deadline),
+            "ready_s": _wait_for(f"{base}/ready", started, deadline),
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget-ms", type=float, default=1200, help="max import time of app.main (default: 1200)")
+    parser.add_argument("--serve", action="store_true", help="also time /health and /ready under uvicorn")
+    parser.add_argument("--health-budget-ms", type=float, default=2000,
+                        help="max time from process start to the first /health 200 (default: 2000)")
+    parser.add_argument("--timeout", type=float, default=300, help="give up waiting for /ready after this many seconds")
+    parser.add_argument("--top", type=int, default=10, help="packages to list (default: 10)")
+    args = parser.parse_args(argv)
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix="docai-startup-") as storage:
+        total, top, lazy = measure_imports(storage)
+        print(f"import app.main: {total:.0f} ms (budget {args.budget_ms:.0f} ms)")
+        for name, ms in top[:args.top]:
+            print(f"  {name:<40}{ms:>8.0f} ms")
+        if total > args.budget_ms:
+            failures.append(f"import time {total:.0f} ms > {args.budget_ms:.0f} ms")
+        if lazy:
+            failures.append(f"imported at startup: {', '.join(lazy)}")
+
+        if args.serve:
+            timings = measure_serve(storage, args.timeout)
+            print(f"first /health: {timings['health_s']} s, /ready: {timings['ready_s']} s")
+            if timings["health_s"] is None or timings["health_s"] * 1000 > args.health_budget_ms:
+                failures.append(f"/health after {timings['health_s']} s > {args.health_budget_ms:.0f} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
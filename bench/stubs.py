@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import time
+
+import numpy as np
+
+
+class _Message:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class _Choice:
+    def __init__(self, content: str):
+        self.message = _Message(content)
+        self.delta = _Message(content)
+
+
+class _Response:
+    def __init__(self, content: str):
+        self.choices = [_Choice(content)]
+
+
+class _Stream:
+    # Minimal stand-in for openai.AsyncStream
+    def __init__(self, tokens: list[str], delay: float):
+        self._tokens = tokens
+        self._delay = delay
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for token in self._tokens:
+            if self._delay:
+                await asyncio.sleep(self._delay)
+            yield _Response(token)
+
+
+class StubOpenAI:
+    """
+    Drop-in for the OpenAI client's chat.completions.create (sync or async).
+    Sleeps for a fixed latency so the benchmark measures our overhead, not the network.
+    """
+
+    ANSWER = "Stub answer generated from the retrieved context."
+
+    def __init__(self, latency: float = 0.0, is_async: bool = False):
+        self.latency = latency
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+        self._async = is_async
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if not self._async:
+            if self.latency:
+                time.sleep(self.latency)
+            return _Response(self.ANSWER)
+        return self._acreate(**kwargs)
+
+    async def _acreate(self, stream: bool = False, **kwargs):
+        tokens = self.ANSWER.split(" ")
+        if stream:
+            return _Stream([t + " " for t in tokens], self.latency / max(len(tokens), 1))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return _Response(self.ANSWER)
+
+
+class _Tokenizer:
+    def __call__(self, texts, add_special_tokens: bool = False, **kwargs):
+        return {"input_ids": [[hash(w) % 30522 for w in t.split()] for t in texts]}
+
+    def tokenize(self, text: str) -> list[str]:
+        return text.split()
+
+
+class HashEmbeddingModel:
+    """
+    Deterministic bag-of-words embeddings for runs without the real model
+    (CI, air-gapped hosts). Numbers from it say nothing about model cost.
+    """
+
+    backend = variant = "hash"
+    max_seq_length = 256
+    tokenizer = _Tokenizer()
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, texts, show_progress_bar: bool = False, batch_size: int = 32, **kwargs):
+        out = np.full((len(texts), self.dimension), 1e-3, dtype="float32")
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                out[row, int.from_bytes(hashlib.blake2b(word.encode(), digest_size=4).digest(), "little") % self.dimension] += 1
+        return out
+
+
+def install(llm_latency: float = 0.0, stub_embeddings: bool = False) -> None:
+    # Swap the process-wide clients (and optionally the model) in the model registry
+    import app.core.model_registry as registry
+    from app.core.config import EMBEDDING_MODEL_NAME
+
+    registry._openai_client = StubOpenAI(llm_latency)
+    registry._async_openai_client = StubOpenAI(llm_latency, is_async=True)
+    if stub_embeddings:
+        registry._models[EMBEDDING_MODEL_NAME] = HashEmbeddingModel()
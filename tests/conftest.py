@@ -0,0 +1,176 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+# Settings are read at import time: point storage at a scratch directory and
+# keep tests off any embedding sidecar before the app is imported
+_STORAGE_DIR = tempfile.mkdtemp(prefix="docai-tests-")
+os.environ["STORAGE_DIR"] = _STORAGE_DIR
+os.environ["EMBEDDING_SIDECAR_SOCKET"] = ""
+
+# Registered before the app's own exit handlers (e.g. the metrics flush), so it runs after them
+atexit.register(shutil.rmtree, _STORAGE_DIR, ignore_errors=True)
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _ChatCompletions(BaseHTTPRequestHandler):
+    """
+    Local stand-in for POST /v1/chat/completions: answers "answer: <question>",
+    as one JSON body or (stream=true) as text/event-stream chunks of one word
+    each followed by a usage chunk. Questions containing "fail" get a 500. A
+    question's delay decides when it finishes, so completion order can differ
+    from submission order.
+    """
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        question = re.search(r"QUESTION: (.*)", body["messages"][-1]["content"]).group(1)
+
+        with server.lock:
+            server.requests.append(question)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.delays.get(question, 0.05))
+            if "fail" in question:
+                self._json(500, {"error": {"message": "upstream exploded", "type": "server_error"}})
+            elif body.get("stream"):
+                self._stream(body["model"], question)
+            else:
+                self._json(200, {
+                    "id": "chatcmpl-test",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"answer: {question}"},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13},
+                })
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _json(self, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, model: str, question: str) -> None:
+        server = self.server
+        words = server.stream_words or f"answer: {question}".split(" ")
+        chunk = {"id": "chatcmpl-test", "object": "chat.completion.chunk", "created": 0, "model": model}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for n, word in enumerate(words):
+                delta = {"content": word if n == 0 else " " + word}
+                self._event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+                time.sleep(server.token_delay)
+            self._event({**chunk, "choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": len(words), "total_tokens": 10 + len(words)}})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            server.streams.append("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away mid-answer
+            server.streams.append("closed")
+
+    def _event(self, payload: dict) -> None:
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="session")
+def llm_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ChatCompletions)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def embedding_model():
+    # Deterministic bag-of-words embeddings instead of the real model
+    import app.core.model_registry as registry
+    from app.core.config import EMBEDDING_MODEL_NAME
+    from bench.stubs import install
+
+    install(stub_embeddings=True)
+    return registry._models[EMBEDDING_MODEL_NAME]
+
+
+@pytest.fixture
+def llm(llm_server, embedding_model):
+    # Real OpenAI clients pointed at the stub endpoint
+    from openai import AsyncOpenAI, OpenAI
+    import app.core.model_registry as registry
+
+    server = llm_server
+    server.requests, server.delays, server.in_flight, server.max_in_flight = [], {}, 0, 0
+    server.streams, server.stream_words, server.token_delay = [], None, 0.0
+
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    registry._openai_client = OpenAI(base_url=base_url, api_key="test", max_retries=0)
+    registry._async_openai_client = AsyncOpenAI(base_url=base_url, api_key="test", max_retries=0)
+    yield server
+    registry._openai_client = registry._async_openai_client = None
+
+
+@pytest.fixture
+def db():
+    from app.db.session import SessionLocal, ensure_db
+
+    ensure_db()
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def document_id(db, llm):
+    # A fresh indexed document per test, so answers cached by other tests don't apply
+    from app.db.models import Document
+    from app.services.indexing_service import index_document
+
+    doc = Document(filename="contract.pdf", file_type="pdf", path="contract.pdf", status="TEXT_EXTRACTED")
+    db.add(doc)
+    db.commit()
+    pages = [
+        (1, "The supplier delivers parts within thirty days. Late deliveries incur a penalty."),
+        (2, "Either party may terminate the agreement with sixty days written notice."),
+        (3, "Warranty claims must be filed within one year of delivery."),
+    ]
+    index_document(doc.id, pages, db)
+    return doc.id
+
+
+@pytest.fixture
+def client(llm):
+    # Without the lifespan: the tests set up their own models and database
+    from fastapi.testclient import TestClient
+    from app.main import create_app
+
+    return TestClient(create_app())
@@ -0,0 +1,28 @@
+from app.agents.qa_agent import QAAgent
+
+
+def test_lexical_questions_are_not_embedded(client, llm, document_id, monkeypatch):
+    def embed(self, questions):
+        raise AssertionError("lexical retrieval must not encode the question")
+
+    monkeypatch.setattr(QAAgent, "embed_questions", embed)
+    body = {"document_id": document_id, "question": "sixty days notice", "mode": "lexical"}
+
+    response = client.post("/questions/ask", json=body)
+    assert response.status_code == 200
+    assert response.json()["answer"] == "answer: sixty days notice"
+
+    # Exact repeats still come from the answer cache
+    llm.requests = []
+    assert client.post("/questions/ask", json=body).json() == response.json()
+    assert llm.requests == []
+
+
+def test_llm_failure_is_reported_and_not_cached(client, llm, document_id):
+    body = {"document_id": document_id, "question": "please fail on delivery"}
+
+    for _ in range(2):
+        response = client.post("/questions/ask", json=body)
+        assert response.status_code == 502
+        assert response.json()["detail"]["code"] == "LLM_FAILED"
+    assert llm.requests == [body["question"]] * 2
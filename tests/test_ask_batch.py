@@ -0,0 +1,47 @@
+from app.services import qa_service
+
+
+def test_results_keep_question_order(llm, db, document_id):
+    questions = [f"question {n} about delivery penalty warranty" for n in range(6)]
+    # Earlier questions finish last
+    llm.delays = {question: 0.05 * (len(questions) - n) for n, question in enumerate(questions)}
+
+    results = qa_service.ask_questions(questions, db, document_id=document_id)
+
+    assert [r["question"] for r in results] == questions
+    assert [r["answer"] for r in results] == [f"answer: {q}" for q in questions]
+    assert all(r["success"] and r["sources"] for r in results)
+    assert sorted(llm.requests) == sorted(questions)
+
+
+def test_failed_question_does_not_fail_the_batch(llm, db, document_id):
+    questions = ["first delivery question", "please fail this termination question", "third warranty question"]
+
+    results = qa_service.ask_questions(questions, db, document_id=document_id)
+
+    assert [r["success"] for r in results] == [True, False, True]
+    failed = results[1]
+    assert failed["question"] == questions[1]
+    assert failed["error"]["code"] == "LLM_FAILED"
+    assert "500" in failed["error"]["message"]
+    assert failed["sources"]
+    assert results[0]["answer"] == f"answer: {questions[0]}"
+    assert results[2]["answer"] == f"answer: {questions[2]}"
+
+    # Answers are cached, failures are not: asking again only calls the LLM for the failed one
+    llm.requests = []
+    again = qa_service.ask_questions(questions, db, document_id=document_id)
+    assert llm.requests == [questions[1]]
+    assert [r["success"] for r in again] == [True, False, True]
+
+
+def test_llm_calls_are_bounded_by_concurrency(llm, db, document_id, monkeypatch):
+    monkeypatch.setattr(qa_service, "QA_BATCH_CONCURRENCY", 3)
+    questions = [f"bounded question {n} about notice" for n in range(10)]
+    llm.delays = {question: 0.1 for question in questions}
+
+    results = qa_service.ask_questions(questions, db, document_id=document_id)
+
+    assert all(r["success"] for r in results)
+    assert len(llm.requests) == len(questions)
+    assert llm.max_in_flight == 3
@@ -0,0 +1,83 @@
+import asyncio
+import json
+import time
+
+from app.main import create_app
+
+
+def _events(body: str) -> list[tuple[str, dict]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def test_sources_then_tokens_then_done_with_usage(client, llm, document_id):
+    question = "when are deliveries due"
+    with client.stream("POST", "/questions/ask/stream", json={"document_id": document_id, "question": question}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _events(response.read().decode())
+
+    names = [name for name, _ in events]
+    assert names[0] == "sources"
+    assert events[0][1]["sources"]
+    assert names[-1] == "done"
+    assert set(names[1:-1]) == {"token"}
+    assert "".join(data["text"] for name, data in events if name == "token") == f"answer: {question}"
+    words = len(f"answer: {question}".split(" "))
+    assert events[-1][1]["usage"] == {"prompt_tokens": 10, "completion_tokens": words, "total_tokens": 10 + words}
+    assert llm.streams == ["completed"]
+
+
+def test_upstream_error_becomes_error_event(client, llm, document_id):
+    body = {"document_id": document_id, "question": "this one should fail"}
+    with client.stream("POST", "/questions/ask/stream", json=body) as response:
+        assert response.status_code == 200
+        events = _events(response.read().decode())
+
+    assert [name for name, _ in events] == ["sources", "error"]
+    assert events[1][1]["code"] == "LLM_FAILED"
+
+
+def test_client_disconnect_closes_upstream_stream(llm, document_id):
+    llm.stream_words = [f"word{n}" for n in range(200)]
+    llm.token_delay = 0.02
+    body = json.dumps({"document_id": document_id, "question": "a long answer please"}).encode()
+    sent = []
+
+    async def run():
+        first_token = asyncio.Event()
+        received = iter([{"type": "http.request", "body": body, "more_body": False}])
+
+        async def receive():
+            message = next(received, None)
+            if message is not None:
+                return message
+            # The client hangs up once it has seen the first token
+            await first_token.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+            if b"event: token" in message.get("body", b""):
+                first_token.set()
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/questions/ask/stream", "raw_path": b"/questions/ask/stream",
+            "root_path": "", "query_string": b"", "server": ("test", 80), "client": ("test", 1),
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        }
+        await asyncio.wait_for(create_app()(scope, receive, send), timeout=10)
+
+    asyncio.run(run())
+
+    # The response ended early, and the stub saw its connection closed mid-answer
+    tokens = sum(m.get("body", b"").count(b"event: token") for m in sent if m["type"] == "http.response.body")
+    assert 0 < tokens < len(llm.stream_words)
+    deadline = time.monotonic() + 5
+    while not llm.streams and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert llm.streams == ["closed"]
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from app.db.models import BulkRun, Chunk, Document
+from app.services.bulk_ingest import BulkIngestion, get_bulk_ingestion, register_files, shutdown_extract_pool
+from bench.corpus import make_pdf
+
+
+@pytest.fixture
+def pool():
+    # Extraction processes are shared per process; don't leave them behind
+    yield
+    shutdown_extract_pool()
+
+
+def test_one_corrupt_file_fails_alone(db, embedding_model, pool, tmp_path):
+    paths = [make_pdf(tmp_path / f"report-{n}.pdf", pages=2, seed=n) for n in range(3)]
+    corrupt = tmp_path / "corrupt.pdf"
+    corrupt.write_bytes(b"%PDF-1.7 truncated before any object")
+    paths.insert(1, corrupt)
+
+    document_ids, skipped = register_files(paths, db)
+    assert skipped == []
+    bad_id = document_ids[1]
+
+    run = BulkIngestion(document_ids, extract_workers=2, embed_batch=8, write_batch=2)
+    progress = run.run()
+
+    db.expire_all()
+    statuses = {doc.id: doc.status for doc in db.query(Document).filter(Document.id.in_(document_ids))}
+    assert statuses.pop(bad_id) == "FAILED_TEXT_EXTRACTION"
+    assert set(statuses.values()) == {"INDEXED"}
+
+    chunks = db.query(Chunk).filter(Chunk.document_id.in_(document_ids)).count()
+    assert db.query(Chunk).filter(Chunk.document_id == bad_id).count() == 0
+
+    # The saved row matches what the run counted
+    row = db.get(BulkRun, run.id)
+    assert row.status == "SUCCEEDED"
+    assert (row.documents, row.extracted, row.indexed, row.failed) == (4, 3, 3, 1)
+    assert (row.pages, row.chunks) == (6, chunks)
+    assert [(e["document_id"], e["stage"]) for e in json.loads(row.errors)] == [(bad_id, "extract")]
+
+    saved = get_bulk_ingestion(run.id, db)
+    for key in ("status", "documents", "extracted", "indexed", "failed", "pages", "chunks", "errors"):
+        assert saved[key] == progress[key]
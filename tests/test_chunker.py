@@ -0,0 +1,90 @@
+import pytest
+
+from app.agents.ingestion_agent import IngestionAgent
+from app.core.chunker import PAGE_SEPARATOR, TokenCounter, iter_chunks
+
+
+class _PieceTokenizer:
+    # Three characters per token, so words cost different numbers of tokens
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts, add_special_tokens: bool = False, **kwargs):
+        self.calls.append(list(texts))
+        return {"input_ids": [[0] * -(-len(t) // 3) for t in texts]}
+
+
+def _sentence(n: int) -> str:
+    return f"Clause {n} covers item {n * 7}."
+
+
+PAGES = [
+    (1, " ".join(_sentence(n) for n in range(12))),
+    (2, ""),
+    # One sentence longer than any chunk, split at word boundaries
+    (3, "Preamble. " + " ".join(f"word{n}" for n in range(60)) + ". Closing remark!"),
+    (4, " ".join(_sentence(n) for n in range(12, 40))),
+]
+
+
+def _normalized(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _page_spans(pages) -> dict[int, tuple[int, int]]:
+    # page number -> (start, end) in the joined text
+    spans, offset = {}, 0
+    for number, text in pages:
+        if not text:
+            continue
+        if spans:
+            offset += len(PAGE_SEPARATOR)
+        spans[number] = (offset, offset + len(text))
+        offset += len(text)
+    return spans
+
+
+def test_token_counter_sums_word_counts_and_caches_words():
+    tokenizer = _PieceTokenizer()
+    counter = TokenCounter(tokenizer)
+
+    assert counter(["abc abcd", "abcdefg"]) == [1 + 2, 3]
+    assert counter(["abcd abc abcd"]) == [5]
+    # Only unseen words reach the tokenizer
+    assert sorted(tokenizer.calls[0]) == ["abc", "abcd", "abcdefg"]
+    assert len(tokenizer.calls) == 1
+
+
+@pytest.mark.parametrize("chunk_size, overlap", [(30, 0), (30, 10), (45, 20)])
+def test_chunks_fit_overlap_and_slice_the_pages(chunk_size, overlap):
+    counter = TokenCounter(_PieceTokenizer())
+    chunks = list(iter_chunks(PAGES, counter, chunk_size, overlap))
+    joined = IngestionAgent.join_pages(PAGES)
+    spans = _page_spans(PAGES)
+
+    assert len(chunks) > 3
+    for chunk in chunks:
+        assert chunk["tokens"] == counter([chunk["text"]])[0]
+        assert chunk["tokens"] <= chunk_size
+
+        # Offsets slice the joined pages, and fall inside the pages they name
+        assert _normalized(joined[chunk["char_start"]:chunk["char_end"]]) == _normalized(chunk["text"])
+        start, _ = spans[chunk["page_start"]]
+        _, end = spans[chunk["page_end"]]
+        assert start <= chunk["char_start"] < chunk["char_end"] <= end
+
+    overlapped = 0
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # No text is skipped between chunks, and chunks move forward
+        assert previous["char_start"] < chunk["char_start"] <= previous["char_end"] + len(PAGE_SEPARATOR)
+
+        shared = joined[chunk["char_start"]:previous["char_end"]] if chunk["char_start"] < previous["char_end"] else ""
+        assert counter([shared])[0] <= overlap
+        overlapped += bool(shared)
+
+    assert joined.startswith(chunks[0]["text"][:20])
+    assert chunks[-1]["char_end"] == len(joined)
+    if overlap:
+        assert overlapped
+    else:
+        assert not overlapped
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from app.core.config import EMBEDDING_MODEL_NAME
+from app.core.embedding_backend import EmbeddingBackend, _SAMPLE_TEXTS
+
+
+def test_backend_must_implement_interface():
+    class Partial(EmbeddingBackend):
+        def get_sentence_embedding_dimension(self) -> int:
+            return 3
+
+    with pytest.raises(TypeError):
+        EmbeddingBackend()
+    with pytest.raises(TypeError):
+        Partial()
+
+
+# --------------------------------------------------
+# ONNX vs PyTorch (needs onnxruntime and the model weights)
+# --------------------------------------------------
+
+def _onnx(quantized: bool):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("sentence_transformers")
+    from app.core.embedding_backend import OnnxBackend
+
+    return OnnxBackend(EMBEDDING_MODEL_NAME, quantized=quantized)
+
+
+@pytest.fixture(scope="module")
+def onnx_backend():
+    return _onnx(quantized=False)
+
+
+@pytest.fixture(scope="module")
+def onnx_int8_backend():
+    return _onnx(quantized=True)
+
+
+@pytest.fixture(scope="module")
+def torch_backend():
+    pytest.importorskip("sentence_transformers")
+    from app.core.embedding_backend import TorchBackend
+
+    return TorchBackend(EMBEDDING_MODEL_NAME)
+
+
+@pytest.mark.parametrize("backend, min_cosine", [("onnx_backend", 0.9999), ("onnx_int8_backend", 0.99)])
+def test_onnx_matches_torch(request, backend, min_cosine):
+    # ONNX first: it skips without onnxruntime before the PyTorch model is loaded
+    candidate = request.getfixturevalue(backend).encode(_SAMPLE_TEXTS)
+    reference = request.getfixturevalue("torch_backend").encode(_SAMPLE_TEXTS)
+
+    assert candidate.shape == reference.shape
+    # ONNX embeddings come out normalized; SentenceTransformer's only if the model says so
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    cosine = (reference * candidate).sum(axis=1)
+    assert cosine.min() >= min_cosine, cosine
+
+
+def test_onnx_batching_keeps_input_order(onnx_backend):
+    # Texts of different lengths are sorted and packed into batches; results come back in input order
+    texts = _SAMPLE_TEXTS + [" ".join(_SAMPLE_TEXTS)]
+    batched = onnx_backend.encode(texts, batch_size=1)
+    one_by_one = np.vstack([onnx_backend.encode([text]) for text in texts])
+
+    assert batched.shape == (len(texts), onnx_backend.get_sentence_embedding_dimension())
+    assert batched.dtype == np.float32
+    np.testing.assert_allclose(batched, one_by_one, atol=1e-5)
+    np.testing.assert_allclose(np.linalg.norm(batched, axis=1), 1.0, atol=1e-5)
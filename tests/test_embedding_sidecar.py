@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import app.core.embedding_sidecar as sidecar
+from app.core.embedding_sidecar import SidecarBackend, SidecarServer, connect
+from bench.stubs import HashEmbeddingModel
+
+MODEL = "stub-model"
+
+
+class _SlowModel(HashEmbeddingModel):
+    # Records each model batch; the delay lets concurrent requests queue up
+    def __init__(self):
+        super().__init__(dimension=64)
+        self.batches = []
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        time.sleep(0.05)
+        return super().encode(texts)
+
+
+@pytest.fixture
+def model():
+    return _SlowModel()
+
+
+@pytest.fixture
+def server(tmp_path, model):
+    server = SidecarServer(str(tmp_path / "embed.sock"), {MODEL: model}, window_seconds=0.05, max_batch=64)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_encodes_are_coalesced_in_order(server, model):
+    client = connect(MODEL, server.server_address)
+    assert client.served_variant == "hash"
+    assert client.get_sentence_embedding_dimension() == 64
+
+    texts = [[f"clause {n} covers delivery", f"item {n} of order {n * 3}"] for n in range(8)]
+    results = [None] * len(texts)
+    start = threading.Barrier(len(texts))
+
+    def encode(n):
+        start.wait()
+        results[n] = client.encode(texts[n])
+
+    threads = [threading.Thread(target=encode, args=(n,)) for n in range(len(texts))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every caller gets its own rows back, in the order it sent them
+    reference = HashEmbeddingModel(dimension=64)
+    for n, embeddings in enumerate(results):
+        np.testing.assert_array_equal(embeddings, reference.encode(texts[n]))
+
+    stats = server.batchers[MODEL].stats()
+    assert stats["requests"] == len(texts)
+    assert stats["texts"] == 2 * len(texts)
+    assert stats["batches"] < len(texts)
+    assert max(len(batch) for batch in model.batches) > 2
+
+
+def test_client_falls_back_to_the_local_model(server, monkeypatch):
+    local = HashEmbeddingModel(dimension=64)
+    monkeypatch.setattr(sidecar, "load_backend", lambda name: local)
+
+    # No socket: workers load the model in-process
+    assert connect(MODEL, server.server_address + ".missing") is None
+
+    # A sidecar that goes away later: the same client encodes locally
+    client = SidecarBackend(MODEL, server.server_address)
+    server.shutdown()
+    server.server_close()
+    os.unlink(server.server_address)
+    # A sidecar process that exits also drops its open connections
+    client._disconnect()
+
+    texts = ["termination requires notice", "warranty lasts one year"]
+    np.testing.assert_array_equal(client.encode(texts), local.encode(texts))
+    assert client._fallback is local
+    assert server.batchers[MODEL].stats()["requests"] == 0
@@ -0,0 +1,69 @@
+import itertools
+
+import pytest
+
+from app.core.index_snapshots import collect_garbage, current_snapshot, document_dir, index_snapshot, lease_snapshot
+
+# Ids no other test indexes
+_document_ids = itertools.count(90_000)
+
+
+def _build(document_id: int, content: str):
+    with index_snapshot(document_id) as snapshot:
+        snapshot.index_path.write_text(content)
+    return snapshot
+
+
+def _versions(document_id: int) -> set[str]:
+    return {p.name for p in document_dir(document_id).iterdir() if p.is_dir()}
+
+
+def test_leased_snapshot_survives_a_newer_publish():
+    document_id = next(_document_ids)
+    first = _build(document_id, "v1")
+
+    lease = lease_snapshot(document_id)
+    second = _build(document_id, "v2")
+
+    assert current_snapshot(document_id) == second
+    assert lease.snapshot == first
+    assert lease.snapshot.index_path.read_text() == "v1"
+
+    # The last reader to let go collects it
+    lease.release()
+    assert _versions(document_id) == {second.version}
+
+
+def test_garbage_collection_only_removes_unleased_snapshots():
+    document_id = next(_document_ids)
+    first = _build(document_id, "v1")
+    lease = lease_snapshot(document_id)
+    second = _build(document_id, "v2")
+    third = _build(document_id, "v3")
+
+    assert _versions(document_id) == {first.version, third.version}
+    assert second.version not in _versions(document_id)
+    assert collect_garbage(document_id) == 0
+
+    lease.release()
+    assert _versions(document_id) == {third.version}
+    assert current_snapshot(document_id).index_path.read_text() == "v3"
+
+
+def test_failed_build_never_moves_current():
+    document_id = next(_document_ids)
+    with pytest.raises(RuntimeError):
+        with index_snapshot(document_id) as snapshot:
+            snapshot.index_path.write_text("partial")
+            raise RuntimeError("build failed")
+    assert current_snapshot(document_id) is None
+
+    published = _build(document_id, "v1")
+    with pytest.raises(RuntimeError):
+        with index_snapshot(document_id) as snapshot:
+            snapshot.index_path.write_text("partial")
+            raise RuntimeError("build failed")
+
+    assert current_snapshot(document_id) == published
+    assert published.index_path.read_text() == "v1"
+    assert _versions(document_id) == {published.version}
@@ -0,0 +1,8 @@
+from bench.startup import measure_imports
+
+
+def test_import_app_main_stays_within_budget(tmp_path):
+    # Fresh interpreter: the test session has already imported everything
+    total, top, lazy = measure_imports(str(tmp_path))
+    assert lazy == []
+    assert total < 1200, top[:5]
@@ -0,0 +1,92 @@
+import pytest
+
+from app.agents.indexing_agent import IndexingAgent
+from app.agents.qa_agent import QAAgent
+from app.core.index_cache import index_cache
+from app.core.vector_index import search_index
+from app.db.models import Chunk, Document
+from app.services.indexing_service import index_document, update_document_index
+
+CHUNK_SIZE, OVERLAP = 40, 8
+
+TOPICS = ["delivery", "termination", "warranty", "payment", "liability"]
+
+
+def _page(topic: str, edition: str = "") -> str:
+    # Unique sentences, so every chunk text identifies one chunk
+    return " ".join(
+        f"Clause {topic} {n}{edition} sets out how the {topic} terms apply to order {n} of the supplier."
+        for n in range(12)
+    )
+
+
+PAGES = [(number, _page(topic)) for number, topic in enumerate(TOPICS, start=1)]
+EDITED = [(number, _page(topic, "b") if number == 3 else text) for (number, text), topic in zip(PAGES, TOPICS)]
+
+
+def _new_document(db) -> int:
+    doc = Document(filename="terms.pdf", file_type="pdf", path="terms.pdf", status="TEXT_EXTRACTED")
+    db.add(doc)
+    db.commit()
+    return doc.id
+
+
+def _chunks(db, document_id: int) -> dict[str, int]:
+    # chunk text -> chunk_index
+    return {row.text: row.chunk_index for row in db.query(Chunk.text, Chunk.chunk_index).filter(Chunk.document_id == document_id)}
+
+
+@pytest.fixture
+def embedded(monkeypatch):
+    # Every text handed to the embedding step (before the embedding cache)
+    texts = []
+    embed_chunks = IndexingAgent.embed_chunks
+
+    def spy(self, chunks):
+        texts.extend(chunks)
+        return embed_chunks(self, chunks)
+
+    monkeypatch.setattr(IndexingAgent, "embed_chunks", spy)
+    return texts
+
+
+def test_editing_one_page_only_embeds_its_chunks(db, embedding_model, embedded):
+    document_id = _new_document(db)
+    index_document(document_id, PAGES, db, CHUNK_SIZE, OVERLAP)
+    before = _chunks(db, document_id)
+    embedded.clear()
+
+    count = update_document_index(document_id, EDITED, db, CHUNK_SIZE, OVERLAP)
+
+    after = _chunks(db, document_id)
+    assert count == len(after)
+    inserted = set(after) - set(before)
+    assert inserted and len(inserted) < len(after) / 2
+    assert sorted(embedded) == sorted(inserted)
+    # Unchanged chunks keep their stable ids; inserted ones get fresh ids
+    assert all(after[text] == before[text] for text in after if text in before)
+    assert min(after[text] for text in inserted) > max(before.values())
+
+
+def _ranking(document_id: int, question: str, mode: str) -> list[tuple[str, float]]:
+    # Every chunk's (text, score), best first; ties by text, since chunk ids differ
+    index, store, vectors, lexical = index_cache.get(document_id)
+    if mode == "vector":
+        scores, ids = search_index(index, QAAgent().embed_question(question), len(store), vectors)
+        hits = [(int(i), float(score)) for i, score in zip(ids[0], scores[0]) if i != -1]
+    else:
+        hits = lexical.search(question, len(store))
+    return sorted(((store.get(i), round(score, 5)) for i, score in hits), key=lambda hit: (-hit[1], hit[0]))
+
+
+@pytest.mark.parametrize("mode", ["vector", "lexical"])
+def test_updated_index_searches_like_a_rebuild(db, embedding_model, mode):
+    updated = _new_document(db)
+    index_document(updated, PAGES, db, CHUNK_SIZE, OVERLAP)
+    assert update_document_index(updated, EDITED, db, CHUNK_SIZE, OVERLAP) is not None
+
+    rebuilt = _new_document(db)
+    index_document(rebuilt, EDITED, db, CHUNK_SIZE, OVERLAP)
+
+    for question in ["warranty terms for order 3b", "termination clause 7", "supplier payment order 11"]:
+        assert _ranking(updated, question, mode) == _ranking(rebuilt, question, mode)